@@ -58,6 +58,63 @@ ROW FORMAT SERDE 'org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe'
 LOCATION 's3://qivr-analytics-lake/aggregated/clinic-benchmarks/'
 TBLPROPERTIES ('has_encrypted_data'='false');
 
+-- Nightly extracts written by etl-lambda/lambda_function.py (zstd Parquet, one dt= partition per day;
+-- usage_stats has one per day of activity). It registers each partition as it writes it.
+CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.extract_tenants (
+  id STRING,
+  name STRING,
+  slug STRING,
+  status STRING,
+  plan STRING,
+  region STRING,
+  patient_count INT,
+  staff_count INT,
+  created_at TIMESTAMP
+)
+PARTITIONED BY (dt STRING)
+STORED AS PARQUET
+LOCATION 's3://qivr-analytics-lake/tenants/'
+TBLPROPERTIES ('parquet.compression'='ZSTD');
+
+CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.extract_usage_stats (
+  tenant_id STRING,
+  `date` DATE,
+  appointments INT,
+  documents INT,
+  messages INT,
+  completed INT
+)
+PARTITIONED BY (dt STRING)
+STORED AS PARQUET
+LOCATION 's3://qivr-analytics-lake/usage_stats/'
+TBLPROPERTIES ('parquet.compression'='ZSTD');
+
+CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.extract_prom_outcomes (
+  region STRING,
+  prom_type STRING,
+  age_bracket STRING,
+  gender STRING,
+  avg_baseline DOUBLE,
+  avg_final DOUBLE,
+  patient_count INT
+)
+PARTITIONED BY (dt STRING)
+STORED AS PARQUET
+LOCATION 's3://qivr-analytics-lake/prom_outcomes/'
+TBLPROPERTIES ('parquet.compression'='ZSTD');
+
+-- Sample query: Monthly outcomes by region, from the rollup the ETL maintains
+-- (table defined in glue/create_tables.sql), one small file per month
+-- SELECT month, region, prom_type, patient_count, avg_final - avg_baseline as avg_change
+-- FROM qivr_analytics.prom_outcomes_by_region
+-- WHERE month >= '2024-01'
+-- ORDER BY month, region, prom_type;
+
+-- Sample query: Monthly usage per tenant, likewise from usage_by_month
+-- SELECT tenant_id, appointments, messages, documents
+-- FROM qivr_analytics.usage_by_month
+-- WHERE month = '2024-03';
+
 -- Sample query: Average improvement by condition and region
 -- SELECT 
 --   condition_category,
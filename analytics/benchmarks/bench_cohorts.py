@@ -0,0 +1,124 @@
+"""
+Benchmark: cohort aggregation throughput on synthetic PROM rows.
+
+Generates millions of de-identified PROM rows (the row set handler.py pulls
+for prom_outcomes) with pyarrow.compute, then aggregates them with
+cohorts.py: the prom_outcomes cohort alone, several cohort cuts from one
+pass, the same cuts one pass each, and the cuts over batches the size the
+streaming export reads. Reports rows/sec, wall time, cohorts published and
+peak RSS per case.
+
+    python bench_cohorts.py --rows 1000000 5000000 --batch-size 10000 --json cohorts.json
+"""
+import argparse
+import json
+import resource
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import seed
+
+REGIONS = 40
+PROM_TYPES = 12
+GENDERS = ('Female', 'Male', 'Other', 'Unknown')
+
+
+def synthetic_rows(count, seed_value=1):
+    """count PROM rows with uniformly spread cohorts, built column-wise."""
+    def uniform(n):
+        return pc.random(count, initializer=seed_value + n)
+
+    def pick(values, n):
+        index = pc.cast(pc.floor(pc.multiply(uniform(n), len(values))), pa.int32())
+        return pc.take(pa.array(values, pa.string()), index)
+
+    return pa.table({
+        'region': pick([f'Region/{i}' for i in range(REGIONS)], 0),
+        'prom_type': pick([f'PROM-{i}' for i in range(PROM_TYPES)], 1),
+        'age': pc.cast(pc.add(pc.floor(pc.multiply(uniform(2), 80)), 16), pa.int32()),
+        'gender': pick(GENDERS, 3),
+        'baseline_score': pc.multiply(uniform(4), 100),
+        'final_score': pc.multiply(uniform(5), 100),
+    })
+
+
+def definitions():
+    """The prom_outcomes cohort plus other cuts a single scan can serve."""
+    cohorts = seed.import_etl_module('cohorts')
+    handler = seed.import_etl_module('handler')
+    averages = (('avg_baseline', 'float64'), ('avg_final', 'float64'), ('patient_count', 'int64'))
+    return [
+        handler.PROM_OUTCOMES_COHORT,
+        cohorts.CohortDefinition('by_type', (('region', 'string'), ('prom_type', 'string')) + averages, k=5),
+        cohorts.CohortDefinition('by_decade', (('prom_type', 'string'), ('age_bracket', 'string')) + averages,
+                                 k=10, age_edges=(18, 30, 40, 50, 60, 70, 80)),
+        cohorts.CohortDefinition('suppressed', (('region', 'string'), ('prom_type', 'string'),
+                                                ('age_bracket', 'string'), ('gender', 'string')) + averages,
+                                 k=11, complementary=True),
+    ]
+
+
+def measure(label, rows, cuts, batch_size=None):
+    cohorts = seed.import_etl_module('cohorts')
+    source = rows.to_batches(max_chunksize=batch_size) if batch_size else rows
+    started = time.perf_counter()
+    if label.endswith('one pass each'):
+        results = {}
+        for cut in cuts:
+            results.update(cohorts.aggregate(source, [cut]))
+    else:
+        results = cohorts.aggregate(source, cuts)
+    seconds = time.perf_counter() - started
+    return {
+        'case': label,
+        'rows': rows.num_rows,
+        'definitions': len(cuts),
+        'batch_size': batch_size,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows.num_rows / seconds) if seconds else None,
+        'cohorts': {name: table.num_rows for name, table in results.items()},
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run(scales, batch_size):
+    cuts = definitions()
+    results = []
+    for count in scales:
+        rows = synthetic_rows(count)
+        cases = [
+            ('prom_outcomes', cuts[:1], None),
+            (f'{len(cuts)} cuts, one pass', cuts, None),
+            (f'{len(cuts)} cuts, one pass each', cuts, None),
+            (f'{len(cuts)} cuts, batches', cuts, batch_size),
+        ]
+        for label, case_cuts, size in cases:
+            result = measure(label, rows, case_cuts, size)
+            results.append(result)
+            print(f"{label:<26} rows={count:<9} {result['seconds']:.3f}s "
+                  f"{result['rows_per_second'] or 0:>12,} rows/s "
+                  f"cohorts={sum(result['cohorts'].values()):<6} peak={result['peak_rss_mb']:.0f}MB")
+        del rows
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 5_000_000])
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Rows per batch in the batched case (STREAMING_BATCH_SIZE)')
+    parser.add_argument('--json', help='Write results to this path')
+    args = parser.parse_args()
+
+    results = run(args.rows, args.batch_size)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
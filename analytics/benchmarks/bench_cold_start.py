@@ -0,0 +1,97 @@
+"""
+Benchmark: cold-start cost of the ETL Lambda module.
+
+Imports handler in fresh interpreters, as a new Lambda container would, and
+then forces every deferred import and AWS client so their cost shows up in
+the breakdown. Exits non-zero when the median module import time is over
+the budget, so it can gate CI:
+
+    python bench_cold_start.py --runs 5 --budget-ms 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import seed
+
+COLD_START_BUDGET_MS = float(os.environ.get('COLD_START_BUDGET_MS', '150'))
+
+# Runs in the child interpreter; prints one JSON line with its measurements
+PROBE = """
+import json, time
+started = time.perf_counter()
+import handler
+import_ms = (time.perf_counter() - started) * 1000
+loaded = sorted(m for m in ('pyarrow', 'psycopg2', 'pg8000', 'boto3') if m in __import__('sys').modules)
+for module in (handler.psycopg2, handler.pa, handler.pq):
+    module.__name__
+for client in (handler.s3, handler.secrets):
+    client.meta
+print(json.dumps({'import_ms': import_ms, 'eager': loaded, 'breakdown': handler.coldstart.breakdown()}))
+"""
+
+
+def probe():
+    """Measure one cold import of handler in a fresh interpreter."""
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'ap-southeast-2'))
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=seed.ETL_LAMBDA_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(runs):
+    results = [probe() for _ in range(runs)]
+    import_ms = [r['import_ms'] for r in results]
+    summary = {
+        'runs': runs,
+        'import_ms_median': round(statistics.median(import_ms), 1),
+        'import_ms_max': round(max(import_ms), 1),
+        'eager_heavy_imports': sorted({m for r in results for m in r['eager']}),
+        # Per-item medians across runs
+        'deferred_ms': {
+            phase: {
+                name: round(statistics.median(r['breakdown'][phase][name] for r in results), 1)
+                for name in results[0]['breakdown'][phase]
+            }
+            for phase in results[0]['breakdown']
+        },
+    }
+    print(f"handler import: median {summary['import_ms_median']} ms, max {summary['import_ms_max']} ms "
+          f"over {runs} runs")
+    for phase, timings in summary['deferred_ms'].items():
+        for name, ms in sorted(timings.items(), key=lambda kv: -kv[1]):
+            print(f"  {phase:<7} {name:<20} {ms:>8.1f} ms")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=COLD_START_BUDGET_MS,
+                        help='Fail when the median handler import exceeds this')
+    parser.add_argument('--json', help='Write results to this path')
+    args = parser.parse_args()
+
+    summary = run(args.runs)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    failures = []
+    if summary['import_ms_median'] > args.budget_ms:
+        failures.append(f"median import {summary['import_ms_median']} ms is over the "
+                        f"{args.budget_ms:.0f} ms budget")
+    if summary['eager_heavy_imports']:
+        failures.append(f"imported eagerly: {', '.join(summary['eager_heavy_imports'])}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Benchmark: fetchall into Python tuples against COPY decoded natively by Arrow.
+
+Generates tenant-shaped rows server-side (with the NULLs and empty strings
+the defaulting rules have to handle) and times three client paths:
+
+- legacy:  fetchall, per-column list comprehensions, Table.from_pydict
+- fetchall: fetchall, pg_arrow.rows_to_batch with vectorized defaults
+- copy:    pg_arrow.read_copy_table (COPY ... TO STDOUT, Arrow CSV reader)
+
+CPU time is this process only (all threads), so it isolates client-side cost.
+
+    python bench_copy_ingest.py --rows 100000 1000000 --json ingest.json
+"""
+import argparse
+import json
+import time
+
+import pyarrow as pa
+
+import seed
+
+ROWS_QUERY = """
+    SELECT
+        md5(i::text) as id,
+        'Clinic ' || i as name,
+        'clinic-' || i as slug,
+        'Active' as status,
+        (ARRAY['starter', 'professional', 'enterprise'])[1 + i %% 3] as plan,
+        (ARRAY['Australia/Sydney', NULL, ''])[1 + i %% 3] as region,
+        now() - i * interval '1 minute' as created_at,
+        NULLIF(i %% 50, 0)::bigint as patient_count,
+        (i %% 7)::bigint as staff_count,
+        NULLIF(i %% 4, 0) * 99 as mrr
+    FROM generate_series(1, %(rows)s) i
+"""
+
+
+def legacy_tenant_columns(rows):
+    """handler.tenant_columns as it stood before COPY ingestion, kept for comparison."""
+    return {
+        'id': [r[0] for r in rows],
+        'name': [r[1] for r in rows],
+        'slug': [r[2] for r in rows],
+        'status': [r[3] for r in rows],
+        'plan': [r[4] for r in rows],
+        'region': [r[5] or 'Australia/Sydney' for r in rows],
+        'created_at': [r[6] for r in rows],
+        'patient_count': [r[7] or 0 for r in rows],
+        'staff_count': [r[8] or 0 for r in rows],
+        'mrr': [r[9] or 0 for r in rows],
+    }
+
+
+def time_path(read, repeats):
+    """Best-of-N (wall seconds, CPU seconds) and the table from the last run."""
+    best = None
+    for _ in range(repeats):
+        wall, cpu = time.perf_counter(), time.process_time()
+        table = read()
+        timing = (time.perf_counter() - wall, time.process_time() - cpu)
+        best = timing if best is None or timing[0] < best[0] else best
+    return best, table
+
+
+def run(scales, repeats, block_size):
+    handler = seed.import_etl_module('handler')
+    pg_arrow = seed.import_etl_module('pg_arrow')
+    schema = handler.arrow_schema(handler.TENANTS_COLUMNS)
+    defaults = handler.TENANTS_DEFAULTS
+
+    conn = seed.connect()
+
+    def legacy(params):
+        with conn.cursor() as cur:
+            cur.execute(ROWS_QUERY, params)
+            return pa.Table.from_pydict(legacy_tenant_columns(cur.fetchall()), schema=schema)
+
+    def fetchall(params):
+        with conn.cursor() as cur:
+            cur.execute(ROWS_QUERY, params)
+            return pa.Table.from_batches([pg_arrow.rows_to_batch(cur.fetchall(), schema, defaults)])
+
+    def copy(params):
+        return pg_arrow.read_copy_table(conn, ROWS_QUERY, params, schema, defaults, block_size)
+
+    results = []
+    for rows in scales:
+        params = {'rows': rows}
+        tables = {}
+        for name, read in [('legacy', legacy), ('fetchall', fetchall), ('copy', copy)]:
+            (wall, cpu), tables[name] = time_path(lambda: read(params), repeats)
+            results.append({
+                'path': name,
+                'rows': rows,
+                'seconds': round(wall, 4),
+                'cpu_seconds': round(cpu, 4),
+                'rows_per_second': round(rows / wall),
+            })
+            print(f"{name:<9} rows={rows:<9} wall={wall:.3f}s cpu={cpu:.3f}s "
+                  f"rows/s={rows / wall:,.0f}")
+        # created_at differs between runs (now()), so compare everything else
+        names = [n for n in schema.names if n != 'created_at']
+        if not tables['legacy'].select(names).equals(tables['copy'].select(names)):
+            raise AssertionError(f"COPY output differs from the legacy path at {rows} rows")
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--block-size-mb', type=int, default=4, help='Arrow CSV block size for COPY')
+    parser.add_argument('--json', help='Write results to this path')
+    args = parser.parse_args()
+
+    results = run(args.rows, args.repeats, args.block_size_mb * 1024 * 1024)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Benchmark: every ETL exporter end to end at increasing tenant counts.
+
+Seeds the full schema the ETL reads into a local Postgres, then runs each
+handler.py exporter and each lambda_function.py export against each
+requested output sink (sinks.py): 'local' writes to a temporary directory,
+'mmap' is the same read back through memory maps and 'null' discards the
+bytes, isolating extraction and encoding from any upload cost. Every case
+runs in a fresh process so its peak RSS is its own. Records rows/sec, wall
+time, peak RSS and output bytes per table.
+
+lambda_function.py cases also report what the same rows cost as the JSON
+lines it used to write, and the bytes Athena would scan for a typical query
+over each format (whole objects for JSON, only the referenced column chunks
+plus footer for Parquet).
+
+    python bench_exporters.py --tenants 10 1000 10000 --json exporters.json
+    python bench_exporters.py --tenants 10 1000 --compare exporters.json
+    python bench_exporters.py --tenants 1000 --sinks local null
+
+With --compare, cases slower or hungrier than the earlier results by more
+than --tolerance are reported and the exit status is non-zero. With
+--shards, handler.py's per-tenant exporters run in sharded mode on that many
+tenant shards.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import seed
+
+HANDLER_TABLES = ('tenants', 'usage', 'prom_outcomes')
+LAMBDA_TABLES = ('tenants', 'usage_stats', 'prom_outcomes')
+
+# Benchmark sink name: (sinks.py sink, memory-mapped readback)
+SINKS = {'local': ('local', False), 'mmap': ('local', True), 'null': ('null', False)}
+
+# Columns a typical Athena query over each lambda_function.py table reads
+SCAN_COLUMNS = {
+    'tenants': ('plan', 'patient_count', 'staff_count'),
+    'usage_stats': ('date', 'appointments', 'messages'),
+    'prom_outcomes': ('prom_type', 'avg_baseline', 'avg_final', 'patient_count'),
+}
+
+
+def open_sink(sink, s3_root):
+    """A fresh sinks.py client for a benchmark sink name."""
+    sinks = seed.import_etl_module('sinks')
+    kind, memory_map = SINKS[sink]
+    return sinks.LocalSink(s3_root, memory_map) if kind == 'local' else sinks.NullSink()
+
+
+def run_handler_case(table, end, streaming, shards, sink, s3_root):
+    """Run one handler.py exporter (in a worker process) and measure it."""
+    handler = seed.import_etl_module('handler')
+    metrics = seed.import_etl_module('metrics')
+    s3 = handler.s3 = open_sink(sink, s3_root)
+    if shards:
+        warm_cache = seed.import_etl_module('warm_cache')
+        handler.SHARDED_EXPORT, handler.EXPORT_SHARDS = True, shards
+        handler.connection_cache = warm_cache.ConnectionCache(
+            _transactional_connection, handler.ping_connection, max_idle=handler.SHARD_WORKERS
+        )
+    date_str = end.date().isoformat()
+
+    conn = seed.connect()
+    conn.autocommit = False  # server-side cursors need a transaction
+    table_metrics = metrics.TableMetrics(table)
+    baseline_mb = _peak_rss_mb()
+    started = time.perf_counter()
+    with metrics.recording(table_metrics):
+        rows, _ = handler.EXPORTERS[table](conn, date_str, streaming)
+    conn.commit()
+    seconds = time.perf_counter() - started
+    conn.close()
+    return _result(rows, seconds, baseline_mb, s3.prefix_bytes(handler.S3_BUCKET, ''),
+                   stages=table_metrics.to_dict()['stages'])
+
+
+def _transactional_connection():
+    conn = seed.connect()
+    conn.autocommit = False  # shard time budgets are SET LOCAL
+    return conn
+
+
+def run_lambda_case(table, end, days, sink, s3_root):
+    """Run one lambda_function.py export to Parquet (in a worker process)."""
+    lambda_function = seed.import_etl_module('lambda_function')
+    sinks = seed.import_etl_module('sinks')
+    s3 = lambda_function.s3 = open_sink(sink, s3_root)
+    lambda_function.partition_catalog = lambda_function.GlueCatalog(sinks.MemoryGlue())
+    start = (end - timedelta(days=days)).date()
+    # The seeded window rather than the watermark or lookback the Lambda uses
+    extract = {
+        'tenants': lambda conn: lambda_function.extract_tenants(conn),
+        'usage_stats': lambda conn: lambda_function.extract_usage_stats(conn, start, end.date()),
+        'prom_outcomes': lambda conn: lambda_function.extract_prom_outcomes(conn, start),
+    }[table]
+    _, columns, layout, partition_by = lambda_function.EXPORTS[table]
+
+    conn = seed.connect_pg8000()
+    baseline_mb = _peak_rss_mb()
+    started = time.perf_counter()
+    rows = extract(conn)
+    partitions = lambda_function.partition_rows(rows, columns, partition_by, end.date())
+    uris = [lambda_function.write_to_s3(part, columns, table, layout, dt) for dt, part in sorted(partitions.items())]
+    seconds = time.perf_counter() - started
+    conn.close()
+
+    names = [name for name, _ in columns]
+    jsonl_bytes = legacy_jsonl_bytes(rows, names)
+    # Scan sizes need the files' footers, which the null sink does not keep
+    parquet_paths = [s3.path(lambda_function.BUCKET, uri.split('/', 3)[3]) for uri in uris] if sink != 'null' else []
+    return _result(
+        len(rows), seconds, baseline_mb, s3.prefix_bytes(lambda_function.BUCKET, f'{table}/'),
+        jsonl_bytes=jsonl_bytes,
+        athena_scan_bytes=sum(parquet_scan_bytes(path, SCAN_COLUMNS[table]) for path in parquet_paths),
+        athena_scan_bytes_jsonl=jsonl_bytes,
+    )
+
+
+def legacy_jsonl_bytes(rows, names):
+    """Size of rows (tuples or a table) as the JSON lines lambda_function.py wrote before Parquet."""
+    records = rows.to_pylist() if hasattr(rows, 'to_pylist') else (dict(zip(names, r)) for r in rows)
+    return sum(len(json.dumps(record, default=str).encode('utf-8')) + 1 for record in records)
+
+
+def parquet_scan_bytes(path, columns):
+    """Bytes Athena reads for a query over columns: their chunks plus the footer."""
+    import pyarrow.parquet as pq
+
+    metadata = pq.ParquetFile(path).metadata
+    scanned = metadata.serialized_size
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            chunk = row_group.column(j)
+            if chunk.path_in_schema in columns:
+                scanned += chunk.total_compressed_size
+    return min(scanned, os.path.getsize(path))
+
+
+def _result(rows, seconds, baseline_mb, output_bytes, **extra):
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds) if seconds else None,
+        'baseline_rss_mb': round(baseline_mb, 1),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'output_bytes': output_bytes,
+        **extra,
+    }
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def in_fresh_process(fn, *args):
+    # spawn so each case starts from a clean interpreter and its own peak RSS
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def run(scales, users_per_tenant, proms_per_patient, rows_per_tenant_day, days, streaming, shards=None,
+        sinks=('local',)):
+    end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    conn = seed.connect()
+    results = []
+    for tenants in scales:
+        seed_started = time.perf_counter()
+        seed.create_schema(conn)
+        seed.seed_usage(conn, tenants, rows_per_tenant_day, days, end)
+        seed.seed_people(conn, users_per_tenant, proms_per_patient, end)
+        print(f"Seeded {tenants} tenants in {time.perf_counter() - seed_started:.1f}s")
+
+        cases = [('handler', t, run_handler_case, (end, streaming, shards)) for t in HANDLER_TABLES]
+        cases += [('lambda_function', t, run_lambda_case, (end, days)) for t in LAMBDA_TABLES]
+        for (module, table, fn, args), sink in ((case, sink) for case in cases for sink in sinks):
+            with tempfile.TemporaryDirectory() as s3_root:
+                result = in_fresh_process(fn, table, *args, sink, s3_root)
+            result.update(module=module, table=table, tenants=tenants, sink=sink)
+            results.append(result)
+            print(f"{module:<16} {table:<14} {sink:<5} tenants={tenants:<6} rows={result['rows']:<8} "
+                  f"{result['seconds']:.3f}s {result['rows_per_second'] or 0:>10,} rows/s "
+                  f"peak={result['peak_rss_mb']:.0f}MB out={result['output_bytes']:,}B")
+            if result.get('athena_scan_bytes'):
+                print(f"{'':<37} as JSONL={result['jsonl_bytes']:,}B "
+                      f"athena scan {result['athena_scan_bytes_jsonl']:,}B -> {result['athena_scan_bytes']:,}B")
+    conn.close()
+    return results
+
+
+def compare(results, previous, tolerance):
+    """Regressions against an earlier results file, as readable strings."""
+    def key(r):
+        return (r['module'], r['table'], r['tenants'], r.get('sink', 'local'))
+
+    before = {key(r): r for r in previous}
+    regressions = []
+    for result in results:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        for metric in ('seconds', 'peak_rss_mb', 'output_bytes'):
+            if old[metric] and result[metric] > old[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{result['module']}.{result['table']} tenants={result['tenants']}: "
+                    f"{metric} {old[metric]} -> {result[metric]}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tenants', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--users-per-tenant', type=int, default=50)
+    parser.add_argument('--proms-per-patient', type=int, default=2)
+    parser.add_argument('--rows-per-tenant-day', type=int, default=5,
+                        help='Appointments, messages and documents per tenant per day')
+    parser.add_argument('--days', type=int, default=7, help='Days of activity to seed')
+    parser.add_argument('--streaming', action='store_true', help='Use the streaming export mode')
+    parser.add_argument('--shards', type=int, help='Run handler.py exporters sharded over this many tenant shards')
+    parser.add_argument('--sinks', nargs='+', choices=sorted(SINKS), default=['local'],
+                        help='Output sinks to run every case against')
+    parser.add_argument('--json', help='Write results to this path')
+    parser.add_argument('--compare', help='Earlier results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed growth before a metric counts as a regression')
+    args = parser.parse_args()
+
+    results = run(args.tenants, args.users_per_tenant, args.proms_per_patient,
+                  args.rows_per_tenant_day, args.days, args.streaming, args.shards, args.sinks)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Benchmark: admin portal analytics queries from the local partition cache.
+
+Writes a synthetic lake to a temporary 'local' sink (handler.py's columns
+and layouts): daily tenants, usage and prom_outcomes partitions over two
+months, the first month of usage compacted as compact.py does. Then runs
+each lake_query.py query against a fresh PartitionCache:
+
+- cold: the first run, fetching every partition it needs
+- warm: repeated runs within the manifest TTL (no S3 calls at all)
+- revalidated: repeated runs with a TTL of 0 (one manifest HEAD per table)
+- published: the first run after the next day's partitions are published
+
+The local sink answers in microseconds, so every S3 call is delayed by
+--s3-latency-ms to stand in for a round trip from Lambda. Reports
+milliseconds (p50 and p95 of --repeat runs) and the cache's counters.
+
+    python bench_lake_query.py --tenants 1000 10000 --days 45 --s3-latency-ms 20 --json lake_query.json
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import seed
+
+PROM_REGIONS = ('Australia/Sydney', 'Australia/Melbourne', 'Australia/Brisbane', 'Australia/Perth')
+PROM_TYPES = ('ODI', 'NDI', 'KOOS', 'QuickDASH', 'PSFS')
+QUERIES = (
+    ('dashboard', {}),
+    ('usage', {'days': 30}),
+    ('prom_outcomes', {'region': 'Australia/Sydney'}),
+    ('revenue_trend', {'months': 6}),
+)
+
+
+class SlowSink:
+    """A sink whose object calls each take latency seconds longer, like a round trip to S3."""
+
+    def __init__(self, sink, latency):
+        self._sink = sink
+        self._latency = latency
+        self.exceptions = sink.exceptions
+        self.calls = 0
+
+    def __getattr__(self, name):
+        call = getattr(self._sink, name)
+
+        def delayed(*args, **kwargs):
+            self.calls += 1
+            time.sleep(self._latency)
+            return call(*args, **kwargs)
+        return delayed
+
+
+def _ids(tenants):
+    return pa.array([f'{i:08x}-0000-4000-8000-{i:012x}' for i in range(tenants)], pa.string())
+
+
+def _ints(n, scale, seed_value):
+    return pc.cast(pc.floor(pc.multiply(pc.random(n, initializer=seed_value), scale)), pa.int64())
+
+
+def tenants_day(handler, tenants, day):
+    created = [datetime(2022, 1, 1) + timedelta(hours=(i * 97) % (24 * 900)) for i in range(tenants)]
+    return pa.table({
+        'id': _ids(tenants),
+        'name': pa.array([f'Clinic {i}' for i in range(tenants)]),
+        'slug': pa.array([f'clinic-{i}' for i in range(tenants)]),
+        'status': pa.array(['0' if i % 7 else '1' for i in range(tenants)]),  # Active, Suspended
+        'plan': pa.array([('starter', 'professional', 'enterprise')[i % 3] for i in range(tenants)]),
+        'region': pa.array([PROM_REGIONS[i % len(PROM_REGIONS)] for i in range(tenants)]),
+        'created_at': pa.array(created, pa.timestamp('us')),
+        'patient_count': _ints(tenants, 500, day.toordinal()),
+        'staff_count': _ints(tenants, 30, day.toordinal() + 1),
+        'mrr': pa.array([(99, 299, 599)[i % 3] for i in range(tenants)], pa.int64()),
+    }, schema=handler.arrow_schema(handler.TENANTS_COLUMNS))
+
+
+def usage_day(handler, tenants, day):
+    seed_value = day.toordinal() * 10
+    return pa.table({
+        'tenant_id': _ids(tenants),
+        'date': pa.array([day - timedelta(days=1)] * tenants, pa.date32()),
+        'appointments': _ints(tenants, 40, seed_value),
+        'completed_appointments': _ints(tenants, 20, seed_value + 1),
+        'messages': _ints(tenants, 100, seed_value + 2),
+        'documents': _ints(tenants, 10, seed_value + 3),
+    }, schema=handler.arrow_schema(handler.USAGE_COLUMNS))
+
+
+def prom_day(handler, day):
+    cells = [(r, t, a, g) for r in PROM_REGIONS for t in PROM_TYPES
+             for a in ('18-29', '30-44', '45-59', '60+') for g in ('Female', 'Male', 'Other')]
+    n = len(cells)
+    return pa.table({
+        'region': [c[0] for c in cells], 'prom_type': [c[1] for c in cells],
+        'age_bracket': [c[2] for c in cells], 'gender': [c[3] for c in cells],
+        'avg_baseline': pc.add(pc.multiply(pc.random(n, initializer=day.toordinal()), 30), 30),
+        'avg_final': pc.add(pc.multiply(pc.random(n, initializer=day.toordinal() + 1), 30), 10),
+        'patient_count': pc.add(_ints(n, 200, day.toordinal() + 2), 5),
+    }, schema=handler.arrow_schema(handler.PROM_OUTCOMES_COLUMNS))
+
+
+def publish_day(modules, tenants, day):
+    """Write and register one day's partitions of the three tables."""
+    handler, catalog, parquet_writer = modules['handler'], modules['catalog'], modules['parquet_writer']
+    date_str = day.isoformat()
+    for name, table, layout in (
+        ('tenants', tenants_day(handler, tenants, day), handler.TENANTS_LAYOUT),
+        ('usage', usage_day(handler, tenants, day), handler.USAGE_LAYOUT),
+        ('prom_outcomes', prom_day(handler, day), handler.PROM_OUTCOMES_LAYOUT),
+    ):
+        key = handler.partition_key(name, date_str)
+        table = layout.sort(table)
+        size = parquet_writer.write_parquet(handler.s3, handler.S3_BUCKET, key, table, layout)
+        catalog.publish_partitions(handler.s3, handler.S3_BUCKET, modules['glue'], name, [
+            catalog.partition_entry({'dt': date_str}, handler.S3_BUCKET, key, table.num_rows, size)])
+
+
+def _timed(run):
+    started = time.perf_counter()
+    run()
+    return (time.perf_counter() - started) * 1000
+
+
+def _p(samples, q):
+    return round(statistics.quantiles(samples, n=100)[q - 1], 2) if len(samples) > 1 else round(samples[0], 2)
+
+
+def run_case(tenants, days, latency, repeat, root):
+    modules = {name: seed.import_etl_module(name) for name in
+               ('handler', 'catalog', 'compact', 'lake_cache', 'lake_query', 'parquet_writer', 'sinks')}
+    handler, lake_query = modules['handler'], modules['lake_query']
+    handler.s3 = modules['sinks'].LocalSink(f'{root}/lake')
+    modules['glue'] = modules['catalog'].GlueCatalog(modules['sinks'].MemoryGlue())
+    today = date(2024, 2, 1) + timedelta(days=days - 31)
+    first = today - timedelta(days=days - 1)
+    for i in range(days):
+        publish_day(modules, tenants, first + timedelta(days=i))
+    # The first month of usage is compacted, so 'usage' reads a compacted file and daily partitions
+    modules['compact'].compact_month(handler.s3, handler.S3_BUCKET, modules['glue'], 'usage', first.isoformat()[:7])
+
+    s3 = SlowSink(handler.s3, latency / 1000)
+    cache = modules['lake_cache'].PartitionCache(s3, handler.S3_BUCKET, root=f'{root}/cache')
+    params = {'usage': {'today': today}, 'revenue_trend': {'today': today}}
+    results = []
+    for name, args in QUERIES:
+        query, _ = lake_query.QUERIES[name]
+
+        def run():
+            return query(cache, **args, **params.get(name, {}))
+        cache.manifest_ttl = 60
+        before, calls = cache.stats(), s3.calls
+        cold = _timed(run)
+        fetched = cache.stats()['bytes_fetched'] - before['bytes_fetched']
+        cold_calls = s3.calls - calls
+        warm = [_timed(run) for _ in range(repeat)]
+        cache.manifest_ttl = 0
+        revalidated = [_timed(run) for _ in range(repeat)]
+        results.append({'query': name, 'rows': run().num_rows, 'cold_ms': round(cold, 2), 'cold_s3_calls': cold_calls,
+                        'cold_bytes': fetched, 'warm_p50_ms': _p(warm, 50), 'warm_p95_ms': _p(warm, 95),
+                        'revalidated_p50_ms': _p(revalidated, 50), 'revalidated_p95_ms': _p(revalidated, 95)})
+
+    # The next nightly run publishes a day: each query refetches only the new partitions it reads
+    publish_day(modules, tenants, today + timedelta(days=1))
+    params = {'usage': {'today': today + timedelta(days=1)}, 'revenue_trend': {'today': today + timedelta(days=1)}}
+    for result, (name, args) in zip(results, QUERIES):
+        query, _ = lake_query.QUERIES[name]
+        calls = s3.calls
+        result['published_ms'] = round(_timed(lambda: query(cache, **args, **params.get(name, {}))), 2)
+        result['published_s3_calls'] = s3.calls - calls
+    return {'tenants': tenants, 'days': days, 's3_latency_ms': latency, 'queries': results, 'cache': cache.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tenants', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--days', type=int, default=45, help='Days of partitions (31 to 60)')
+    parser.add_argument('--s3-latency-ms', type=float, default=20.0, help='Delay added to every S3 call')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='Write results to this path')
+    args = parser.parse_args()
+
+    results = []
+    for tenants in args.tenants:
+        with tempfile.TemporaryDirectory(prefix='qivr-lake-query-') as root:
+            result = run_case(tenants, min(max(args.days, 31), 60), args.s3_latency_ms, args.repeat, root)
+        results.append(result)
+        print(f"tenants={tenants} days={result['days']} s3 latency={args.s3_latency_ms} ms")
+        for q in result['queries']:
+            print(f"  {q['query']:<14} rows={q['rows']:<6} cold {q['cold_ms']:>8.2f} ms "
+                  f"({q['cold_s3_calls']} S3 calls, {q['cold_bytes']} bytes)  "
+                  f"warm p50 {q['warm_p50_ms']:>6.2f} p95 {q['warm_p95_ms']:>6.2f}  "
+                  f"revalidated p50 {q['revalidated_p50_ms']:>6.2f}  "
+                  f"published {q['published_ms']:>7.2f} ms ({q['published_s3_calls']} calls)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
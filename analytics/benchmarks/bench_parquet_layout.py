@@ -0,0 +1,184 @@
+"""
+Benchmark: Parquet layout profiles against the writer's old defaults.
+
+Seeds a local Postgres, reads each exported table once, and encodes it with
+the old defaults (Snappy, every column dictionary-encoded, unsorted), with
+the table's ParquetLayout, and with that layout at other row-group sizes.
+For each encoding it reports the file size and how well an Athena-style
+reader prunes it: for an equality filter on each of the table's filter
+columns, row groups whose min/max statistics rule the value out are skipped,
+and only the queried columns of the rest (plus the footer) count as scanned.
+
+    python bench_parquet_layout.py --tenants 1000 --row-group-sizes 8192 32768 --json layout.json
+"""
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import pyarrow.parquet as pq
+
+import seed
+
+# Per table: the columns queries filter on, and the columns they read
+FILTER_COLUMNS = {
+    'tenants': ('id', 'plan'),
+    'usage': ('tenant_id',),
+    'prom_outcomes': ('region', 'prom_type'),
+    'usage_stats': ('date', 'tenant_id'),
+}
+QUERY_COLUMNS = {
+    'tenants': ('patient_count', 'staff_count'),
+    'usage': ('appointments', 'messages'),
+    'prom_outcomes': ('avg_baseline', 'avg_final', 'patient_count'),
+    'usage_stats': ('appointments', 'messages'),
+}
+
+
+def load_tables(end, days):
+    """Every exported table as (Arrow table, layout), read from the seeded database."""
+    handler = seed.import_etl_module('handler')
+    lambda_function = seed.import_etl_module('lambda_function')
+    yesterday = (end - timedelta(days=1)).date()
+
+    conn = seed.connect()
+    tables = {
+        'tenants': (handler.read_table(conn, handler.TENANTS_QUERY, None,
+                                       handler.TENANTS_COLUMNS, handler.TENANTS_DEFAULTS),
+                    handler.TENANTS_LAYOUT),
+        'usage': (handler.read_table(conn, handler.USAGE_QUERY,
+                                     {'day_start': yesterday, 'day_end': end.date()},
+                                     handler.USAGE_COLUMNS, handler.USAGE_DEFAULTS),
+                  handler.USAGE_LAYOUT),
+        'prom_outcomes': (handler.aggregate_prom_outcomes(conn, handler.PROM_ROWS_QUERY, None)[0],
+                          handler.PROM_OUTCOMES_LAYOUT),
+    }
+    conn.close()
+
+    # lambda_function.py's usage_stats spans days, so date filters matter there
+    conn = seed.connect_pg8000()
+    rows = lambda_function.extract_usage_stats(conn, (end - timedelta(days=days)).date(), end.date())
+    conn.close()
+    schema = lambda_function.arrow_schema(lambda_function.USAGE_STATS_COLUMNS)
+    tables['usage_stats'] = (lambda_function.rows_to_table(rows, schema),
+                             lambda_function.USAGE_STATS_LAYOUT)
+    return tables
+
+
+def encode(table, layout):
+    """Encode table as the writer would with layout (None: the old defaults)."""
+    buf = BytesIO()
+    if layout is None:
+        pq.write_table(table, buf, compression='snappy')
+    else:
+        parquet_writer = seed.import_etl_module('parquet_writer')
+        parquet_writer.encode_parquet(layout.sort(table), buf, layout)
+    return buf.getvalue()
+
+
+def probe_values(table, column):
+    """A handful of values spread across the column to filter on."""
+    values = table.column(column).drop_null().unique().sort()
+    if not len(values):
+        return []
+    step = max(1, len(values) // 5)
+    return [values[i].as_py() for i in range(0, len(values), step)][:5]
+
+
+def pruning(data, column, value, columns):
+    """Row groups read and bytes scanned for WHERE column = value, reading columns."""
+    metadata = pq.ParquetFile(BytesIO(data)).metadata
+    read_groups = 0
+    scanned = metadata.serialized_size
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        chunks = {row_group.column(j).path_in_schema: row_group.column(j)
+                  for j in range(row_group.num_columns)}
+        stats = chunks[column].statistics
+        if stats is not None and stats.has_min_max and not stats.min <= value <= stats.max:
+            continue
+        read_groups += 1
+        scanned += sum(chunks[name].total_compressed_size for name in (column,) + columns)
+    return read_groups, min(scanned, len(data))
+
+
+def measure(name, table, layout, label):
+    data = encode(table, layout)
+    metadata = pq.ParquetFile(BytesIO(data)).metadata
+    filters = {}
+    for column in FILTER_COLUMNS[name]:
+        probes = [pruning(data, column, value, QUERY_COLUMNS[name])
+                  for value in probe_values(table, column)]
+        if probes:
+            filters[column] = {
+                'row_groups_read': round(sum(p[0] for p in probes) / len(probes), 1),
+                'bytes_scanned': round(sum(p[1] for p in probes) / len(probes)),
+            }
+    return {
+        'table': name,
+        'profile': label,
+        'rows': table.num_rows,
+        'bytes': len(data),
+        'row_groups': metadata.num_row_groups,
+        'filters': filters,
+    }
+
+
+def run(tenants, users_per_tenant, proms_per_patient, rows_per_tenant_day, days, row_group_sizes):
+    parquet_writer = seed.import_etl_module('parquet_writer')
+    end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    conn = seed.connect()
+    seed.create_schema(conn)
+    seed.seed_usage(conn, tenants, rows_per_tenant_day, days, end)
+    seed.seed_people(conn, users_per_tenant, proms_per_patient, end)
+    conn.close()
+
+    results = []
+    for name, (table, layout) in load_tables(end, days).items():
+        profiles = [('defaults', None), ('layout', layout)]
+        for size in row_group_sizes:
+            variant = parquet_writer.ParquetLayout(
+                sort_by=layout.sort_by,
+                dictionary_columns=layout.dictionary_columns,
+                statistics_columns=layout.statistics_columns,
+                row_group_size=size,
+                compression=layout.compression,
+                compression_level=layout.compression_level,
+            )
+            profiles.append((f'layout/rg={size}', variant))
+        for label, profile in profiles:
+            result = measure(name, table, profile, label)
+            results.append(result)
+            pushdown = ' '.join(
+                f"{column}: {f['row_groups_read']}/{result['row_groups']} rg {f['bytes_scanned']:,}B"
+                for column, f in result['filters'].items()
+            )
+            print(f"{name:<14} {label:<18} rows={result['rows']:<8} "
+                  f"size={result['bytes']:>10,}B  {pushdown}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tenants', type=int, default=1000)
+    parser.add_argument('--users-per-tenant', type=int, default=50)
+    parser.add_argument('--proms-per-patient', type=int, default=2)
+    parser.add_argument('--rows-per-tenant-day', type=int, default=5,
+                        help='Appointments, messages and documents per tenant per day')
+    parser.add_argument('--days', type=int, default=30, help='Days of activity to seed')
+    parser.add_argument('--row-group-sizes', type=int, nargs='*', default=[8192, 32768],
+                        help='Extra row-group sizes to try each layout at')
+    parser.add_argument('--json', help='Write results to this path')
+    args = parser.parse_args()
+
+    results = run(args.tenants, args.users_per_tenant, args.proms_per_patient,
+                  args.rows_per_tenant_day, args.days, args.row_group_sizes)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Benchmark: cost of the data-quality gate per million rows.
+
+Builds synthetic usage and prom_outcomes partitions (handler.py's columns)
+and runs each table's QualityRules over them with quality.py: rows in
+layout order as exporters hand them over, the same rows shuffled (keys
+checked by hash group-by instead), and batches the size the streaming
+export reads. Reports milliseconds per million rows for every case.
+
+    python bench_quality.py --rows 1000000 5000000 --batch-size 10000 --json quality.json
+"""
+import argparse
+import json
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import seed
+
+
+def usage_rows(count, seed_value=1):
+    """count usage rows, one per tenant, in tenant_id order."""
+    ids = pa.array([f'{i:08x}-0000-4000-8000-{i:012x}' for i in range(count)], pa.string())
+
+    def counter(n, scale):
+        return pc.cast(pc.floor(pc.multiply(pc.random(count, initializer=seed_value + n), scale)), pa.int64())
+
+    return pa.table({
+        'tenant_id': ids,
+        'date': pa.repeat(pa.scalar(0, pa.int32()), count).cast(pa.date32()),
+        'appointments': counter(0, 40),
+        'completed_appointments': counter(1, 20),
+        'messages': counter(2, 100),
+        'documents': counter(3, 10),
+    })
+
+
+def prom_outcomes_rows(count, k, seed_value=1):
+    """count cohort rows with distinct keys, in cohort key order."""
+    index = pa.array(range(count), pa.int64())
+
+    def key(prefix, divisor, modulus=None):
+        # Integer division, so consecutive rows share the slower-changing keys
+        part = pc.divide(index, divisor)
+        part = pc.remainder(part, modulus) if modulus else part
+        return pc.binary_join_element_wise(prefix, pc.cast(pc.add(part, 100000), pa.string()), '')
+
+    return pa.table({
+        'region': key('Region/', 4 * 5 * 40),
+        'prom_type': key('PROM-', 4 * 5, 40),
+        'age_bracket': key('A', 4, 5),
+        'gender': key('G', 1, 4),
+        'avg_baseline': pc.multiply(pc.random(count, initializer=seed_value), 100),
+        'avg_final': pc.multiply(pc.random(count, initializer=seed_value + 1), 100),
+        'patient_count': pc.add(pc.cast(pc.floor(pc.multiply(pc.random(count, initializer=seed_value + 2), 50)),
+                                        pa.int64()), k),
+    })
+
+
+def measure(label, table_name, rows, rules, batch_size=None):
+    quality = seed.import_etl_module('quality')
+    check = quality.QualityCheck(table_name, rules, previous_rows=rows.num_rows)
+    started = time.perf_counter()
+    if batch_size:
+        for _ in check.watch(iter(rows.to_batches(max_chunksize=batch_size))):
+            pass
+    else:
+        check.add(rows)
+        check.finish()
+    seconds = time.perf_counter() - started
+    return {
+        'case': label,
+        'table': table_name,
+        'rows': rows.num_rows,
+        'batch_size': batch_size,
+        'seconds': round(seconds, 4),
+        'ms_per_million_rows': round(seconds * 1000 * 1_000_000 / rows.num_rows, 2),
+    }
+
+
+def run(scales, batch_size):
+    handler = seed.import_etl_module('handler')
+    tables = (
+        ('usage', usage_rows, handler.USAGE_QUALITY),
+        ('prom_outcomes', lambda n: prom_outcomes_rows(n, handler.PROM_OUTCOMES_COHORT.k),
+         handler.PROM_OUTCOMES_QUALITY),
+    )
+    results = []
+    for count in scales:
+        for table_name, build, rules in tables:
+            rows = build(count)
+            shuffled = rows.take(pc.sort_indices(pc.random(count, initializer=7)))
+            cases = [
+                ('sorted', rows, None),
+                ('shuffled', shuffled, None),
+                ('sorted, batches', rows, batch_size),
+            ]
+            for label, case_rows, size in cases:
+                result = measure(label, table_name, case_rows, rules, size)
+                results.append(result)
+                print(f"{table_name:<14} {label:<16} rows={count:<9} {result['seconds']:.4f}s "
+                      f"{result['ms_per_million_rows']:>9.2f} ms/M rows")
+            del rows, shuffled
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 5_000_000])
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Rows per batch in the batched case (STREAMING_BATCH_SIZE)')
+    parser.add_argument('--json', help='Write results to this path')
+    args = parser.parse_args()
+
+    results = run(args.rows, args.batch_size)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
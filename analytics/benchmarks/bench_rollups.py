@@ -0,0 +1,104 @@
+"""
+Benchmark: incremental monthly rollups against recomputing them.
+
+Writes a month of synthetic daily usage partitions (handler.py's columns)
+for a number of tenants to a temporary 'local' sink, merges each day into
+usage_by_month as the ETL does after every export (rollups.py), and then
+rebuilds the same month from all of its days. Reports milliseconds per
+daily merge and per rebuild, and the bytes a dashboard reads for one
+month: the rollup's file against the month's daily partitions.
+
+    python bench_rollups.py --tenants 1000 10000 100000 --days 30 --json rollups.json
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import seed
+
+
+def usage_day(handler, tenants, day, seed_value):
+    """One day's usage partition: a row per tenant, in tenant_id order."""
+    ids = pa.array([f'{i:08x}-0000-4000-8000-{i:012x}' for i in range(tenants)], pa.string())
+
+    def counter(n, scale):
+        return pc.cast(pc.floor(pc.multiply(pc.random(tenants, initializer=seed_value + n), scale)), pa.int64())
+
+    return pa.table({
+        'tenant_id': ids,
+        'date': pa.array([day] * tenants, pa.date32()),
+        'appointments': counter(0, 40),
+        'completed_appointments': counter(1, 20),
+        'messages': counter(2, 100),
+        'documents': counter(3, 10),
+    }, schema=handler.arrow_schema(handler.USAGE_COLUMNS))
+
+
+def run_case(tenants, days, root):
+    handler = seed.import_etl_module('handler')
+    rollups = seed.import_etl_module('rollups')
+    sinks = seed.import_etl_module('sinks')
+    catalog = seed.import_etl_module('catalog')
+    s3 = handler.s3 = sinks.LocalSink(root)
+    glue = catalog.GlueCatalog(sinks.MemoryGlue())
+    rollup = handler.USAGE_BY_MONTH
+    # Partition dates whose day (the day before) falls in January
+    dates = [date(2024, 1, 2) + timedelta(days=i) for i in range(days)]
+
+    merge_seconds = []
+    for i, dt in enumerate(dates):
+        date_str = dt.isoformat()
+        table = usage_day(handler, tenants, dt - timedelta(days=1), seed_value=i * 10)
+        handler.write_table_to_s3(table, handler.partition_key('usage', date_str), handler.USAGE_LAYOUT)
+        started = time.perf_counter()
+        result = rollups.merge_day(s3, handler.S3_BUCKET, glue, rollup, date_str)
+        merge_seconds.append(time.perf_counter() - started)
+        assert result['status'] == 'merged', result
+
+    month = rollup.month_of(dates[0].isoformat())
+    started = time.perf_counter()
+    rollups.rebuild_month(s3, handler.S3_BUCKET, glue, rollup, month)
+    rebuild_seconds = time.perf_counter() - started
+
+    daily_bytes = s3.prefix_bytes(handler.S3_BUCKET, 'curated/usage/')
+    rollup_bytes = s3.prefix_bytes(handler.S3_BUCKET, rollups.rollup_key(rollup.name, month))
+    return {
+        'tenants': tenants,
+        'days': days,
+        'merge_ms_mean': round(sum(merge_seconds) / len(merge_seconds) * 1000, 2),
+        'merge_ms_max': round(max(merge_seconds) * 1000, 2),
+        'rebuild_ms': round(rebuild_seconds * 1000, 2),
+        'daily_bytes': daily_bytes,
+        'rollup_bytes': rollup_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tenants', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--days', type=int, default=30, help='Days merged into the month (at most 31)')
+    parser.add_argument('--json', help='Write results to this path')
+    args = parser.parse_args()
+
+    results = []
+    for tenants in args.tenants:
+        with tempfile.TemporaryDirectory(prefix='qivr-rollups-') as root:
+            result = run_case(tenants, min(args.days, 31), root)
+        results.append(result)
+        print(f"tenants={tenants:<7} merge {result['merge_ms_mean']:>8.2f} ms/day "
+              f"(max {result['merge_ms_max']:.2f})  rebuild {result['rebuild_ms']:>9.2f} ms  "
+              f"month: {result['rollup_bytes']:>9} bytes rolled up vs {result['daily_bytes']:>10} daily")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Benchmark: usage aggregation before and after removing the join fan-out.
+
+Seeds a local Postgres at increasing rows per tenant per day and times the
+legacy COUNT(DISTINCT) queries against the per-source aggregates now used by
+handler.export_usage and lambda_function.extract_usage_stats.
+
+    python bench_usage_query.py --tenants 20 --rows-per-tenant 10 50 200 --json usage.json
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+import seed
+
+# Queries as they stood before the rewrite, kept for comparison
+LEGACY_HANDLER_USAGE_QUERY = """
+    SELECT
+        t.id::text as tenant_id,
+        %(day_start)s::date as date,
+        COUNT(DISTINCT a.id) as appointments,
+        COUNT(DISTINCT CASE WHEN a.status = 'Completed' THEN a.id END) as completed_appointments,
+        COUNT(DISTINCT m.id) as messages,
+        0 as documents
+    FROM tenants t
+    LEFT JOIN appointments a ON a.tenant_id = t.id
+        AND a.scheduled_start::date = %(day_start)s
+    LEFT JOIN messages m ON m.tenant_id = t.id
+        AND m.created_at::date = %(day_start)s
+    WHERE t.deleted_at IS NULL
+    GROUP BY t.id
+"""
+
+LEGACY_USAGE_STATS_QUERY = """
+    SELECT
+        t.id::text as tenant_id,
+        DATE(a.created_at)::text as date,
+        COUNT(DISTINCT a.id)::int as appointments,
+        COUNT(DISTINCT d.id)::int as documents,
+        COUNT(DISTINCT m.id)::int as messages,
+        COUNT(DISTINCT CASE WHEN a.status = 'Completed' THEN a.id END)::int as completed
+    FROM tenants t
+    LEFT JOIN appointments a ON a.tenant_id = t.id AND a.created_at >= %(start)s
+    LEFT JOIN documents d ON d.tenant_id = t.id AND d.created_at >= %(start)s
+    LEFT JOIN messages m ON m.tenant_id = t.id AND m.created_at >= %(start)s
+    WHERE t.deleted_at IS NULL
+    GROUP BY t.id, DATE(a.created_at)
+"""
+
+
+def time_query(conn, query, params, repeats, timeout_ms):
+    """Best-of-N wall time in seconds, or None if the query timed out."""
+    best = None
+    with conn.cursor() as cur:
+        cur.execute('SET statement_timeout = %s', (timeout_ms,))
+        for _ in range(repeats):
+            started = time.perf_counter()
+            try:
+                cur.execute(query, params)
+                rows = cur.fetchall()
+            except Exception as e:
+                if 'statement timeout' not in str(e):
+                    raise
+                return None, None
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def run(tenants, scales, days, repeats, timeout_ms):
+    handler = seed.import_etl_module('handler')
+    lambda_function = seed.import_etl_module('lambda_function')
+    # pg8000 named parameters -> psycopg2 pyformat
+    usage_stats_query = lambda_function.USAGE_STATS_QUERY.replace(':start', '%(start)s').replace(':end', '%(end)s')
+
+    end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    day = (end - timedelta(days=1)).date()
+    usage_params = {'day_start': day, 'day_end': day + timedelta(days=1)}
+    stats_params = {'start': end - timedelta(days=days), 'end': end}
+
+    conn = seed.connect()
+    results = []
+    for rows in scales:
+        seed.create_schema(conn)
+        seed.seed_usage(conn, tenants, rows, days, end)
+        cases = [
+            ('export_usage', LEGACY_HANDLER_USAGE_QUERY, handler.USAGE_QUERY, usage_params),
+            ('extract_usage_stats', LEGACY_USAGE_STATS_QUERY, usage_stats_query, stats_params),
+        ]
+        for name, legacy, current, params in cases:
+            legacy_s, _ = time_query(conn, legacy, params, repeats, timeout_ms)
+            current_s, current_rows = time_query(conn, current, params, repeats, timeout_ms)
+            result = {
+                'query': name,
+                'tenants': tenants,
+                'rows_per_tenant_day': rows,
+                'days': days,
+                'legacy_seconds': legacy_s,
+                'rewritten_seconds': current_s,
+                'speedup': round(legacy_s / current_s, 1) if legacy_s and current_s else None,
+                'output_rows': len(current_rows or []),
+            }
+            results.append(result)
+            legacy_label = f'{legacy_s:.4f}s' if legacy_s is not None else f'>{timeout_ms / 1000:.0f}s'
+            print(f"{name:<20} rows/tenant/day={rows:<6} legacy={legacy_label:<10} "
+                  f"rewritten={current_s:.4f}s speedup={result['speedup'] or 'n/a'}x")
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tenants', type=int, default=20)
+    parser.add_argument('--rows-per-tenant', type=int, nargs='+', default=[5, 20, 50],
+                        help='Appointments, messages and documents per tenant per day')
+    parser.add_argument('--days', type=int, default=7, help='Days of history to seed')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--timeout', type=int, default=120, help='Per-query timeout in seconds')
+    parser.add_argument('--json', help='Write results to this path')
+    args = parser.parse_args()
+
+    results = run(args.tenants, args.rows_per_tenant, args.days, args.repeats, args.timeout * 1000)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
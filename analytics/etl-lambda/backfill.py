@@ -0,0 +1,212 @@
+"""
+Qivr Analytics ETL Backfill
+Regenerates curated dt= partitions for a range of past days.
+
+Each day is an independent task run on a process pool, so several days are
+extracted in parallel while the pool size caps how many connections hit the
+database at once. Days already in a table's manifest (as a dt= partition or
+a compacted month) are skipped unless forced; the partitions written are
+registered with Glue in one batch per table once every day has finished.
+The rollup months the range touches are then rebuilt from their inputs,
+since a day merged before it was regenerated would otherwise stay stale.
+
+Run from a workstation or container with DB_SECRET_ARN and S3_BUCKET set
+(Lambda lacks the shared memory a process pool needs):
+
+    python backfill.py --start 2024-01-01 --end 2024-03-31 --tables usage --concurrency 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+import handler
+from catalog import load_manifest
+from rollups import rebuild_month
+
+BACKFILL_CONCURRENCY = int(os.environ.get('BACKFILL_CONCURRENCY', '4'))
+BACKFILL_TABLES = tuple(handler.EXPORTERS)
+
+
+def exported_days(table):
+    """Days already exported for a table, per its manifests: (dt values, compacted months)."""
+    daily = load_manifest(handler.s3, handler.S3_BUCKET, table)['partitions'].values()
+    monthly = load_manifest(handler.s3, handler.S3_BUCKET, f'{table}_monthly')['partitions'].values()
+    return {e['values']['dt'] for e in daily}, {e['values']['month'] for e in monthly}
+
+
+def partition_exists(exported, date_str):
+    """Check a day against exported_days(), as a dt= partition or a compacted month."""
+    days, months = exported
+    return date_str in days or date_str[:7] in months
+
+
+def export_partition(conn, table, day, streaming=False):
+    """Regenerate one table's partition for one day."""
+    date_str = day.isoformat()
+    if table == 'usage':
+        return handler.export_usage(conn, date_str, streaming)
+    # Snapshot tables are rebuilt as they stood at the start of the partition day
+    as_of = datetime.combine(day, datetime.min.time())
+    return handler.EXPORTERS[table](conn, date_str, streaming, as_of=as_of)
+
+
+def failed_day(day, tables, error):
+    """The result of a day none of whose tables could be backfilled."""
+    return {'date': day.isoformat(), 'tables': {table: {'status': 'failed', 'error': str(error)}
+                                                for table in tables}}
+
+
+def backfill_day(day, tables, skip=(), streaming=False):
+    """Backfill every requested table not in skip for a single day (runs in a worker).
+
+    The day runs on a connection from the worker's ConnectionCache, pinged
+    before reuse, so one dropped since the last day is replaced rather than
+    failing every day after it.
+    """
+    pending = [table for table in tables if table not in skip]
+    result = {'date': day.isoformat(), 'tables': {table: {'status': 'skipped'} for table in skip if table in tables}}
+    if not pending:
+        return result
+    pool = handler.connection_cache
+    try:
+        conn = pool.acquire()
+    except Exception as e:
+        result['tables'].update(failed_day(day, pending, e)['tables'])
+        return result
+    broken = False
+    try:
+        for table in pending:
+            started = time.monotonic()
+            try:
+                rows, _ = export_partition(conn, table, day, streaming)
+                conn.commit()
+                result['tables'][table] = {
+                    'status': 'succeeded',
+                    'rows': rows,
+                    'seconds': round(time.monotonic() - started, 2),
+                }
+            except Exception as e:
+                result['tables'][table] = {'status': 'failed', 'error': str(e)}
+                try:
+                    conn.rollback()
+                except Exception:
+                    # The connection is gone; the day's other tables get a new one
+                    pool.release(conn, discard=True)
+                    conn = pool.acquire()
+    except Exception as e:
+        broken = True
+        for table in pending:
+            result['tables'].setdefault(table, {'status': 'failed', 'error': str(e)})
+    finally:
+        if not broken:
+            pool.release(conn)
+    return result
+
+
+def date_range(start, end):
+    """Every day from start to end inclusive."""
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def run_backfill(start, end, tables=BACKFILL_TABLES, concurrency=BACKFILL_CONCURRENCY,
+                 force=False, streaming=False):
+    """Backfill a date range across a process pool and summarise the outcome."""
+    unknown = set(tables) - set(BACKFILL_TABLES)
+    if unknown:
+        raise ValueError(f"Unknown tables: {', '.join(sorted(unknown))}")
+    days = date_range(start, end)
+    if not days:
+        raise ValueError('End date is before start date')
+
+    print(f"Backfilling {len(days)} days ({start} to {end}) for {', '.join(tables)} "
+          f"with {concurrency} workers")
+    started = time.monotonic()
+    results = []
+    exported = {} if force else {table: exported_days(table) for table in tables}
+    skip = {
+        day: tuple(t for t in exported if partition_exists(exported[t], day.isoformat()))
+        for day in days
+    }
+
+    # spawn gives each worker fresh boto3/psycopg2 state instead of forked sockets
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=concurrency, mp_context=ctx) as pool:
+        futures = {pool.submit(backfill_day, day, tables, skip[day], streaming): day for day in days}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                # A worker that died fails its day alone; finished days are still registered
+                result = failed_day(futures[future], tables, e)
+            results.append(result)
+            elapsed = time.monotonic() - started
+            rate = done / (elapsed / 60) if elapsed else 0.0
+            eta = (len(days) - done) / rate if rate else 0.0
+            statuses = ', '.join(f"{t}={r['status']}" for t, r in result['tables'].items())
+            print(f"[{done}/{len(days)}] {result['date']} {statuses} | "
+                  f"{rate:.1f} days/min, ETA {eta:.1f} min")
+
+    results.sort(key=lambda r: r['date'])
+    failed = [
+        f"{r['date']}/{t}" for r in results
+        for t, status in r['tables'].items() if status['status'] == 'failed'
+    ]
+    # Registered here, one batch per table, so workers never race on a manifest
+    for table in tables:
+        written = [(r['date'], r['tables'][table]['rows']) for r in results
+                   if r['tables'][table]['status'] == 'succeeded' and r['tables'][table]['rows']]
+        try:
+            handler.register_partitions(table, written)
+        except Exception as e:
+            print(f"Registering {len(written)} partitions of {table} failed: {e}")
+            failed.append(f'register/{table}')
+    for rollup in handler.ROLLUPS:
+        if rollup.table not in tables:
+            continue
+        for month in sorted({rollup.month_of(day.isoformat()) for day in days}):
+            try:
+                rebuild_month(handler.s3, handler.S3_BUCKET, handler.partition_catalog, rollup, month)
+            except Exception as e:
+                print(f"Rebuilding {rollup.name} {month} failed: {e}")
+                failed.append(f'rollup/{rollup.name}/{month}')
+
+    elapsed = time.monotonic() - started
+    summary = {
+        'days': len(days),
+        'seconds': round(elapsed, 1),
+        'days_per_minute': round(len(days) / (elapsed / 60), 2) if elapsed else None,
+        'failed': failed,
+        'results': results,
+    }
+    print(f"Backfill finished: {len(days)} days in {elapsed:.1f}s "
+          f"({summary['days_per_minute']} days/min), {len(failed)} failed")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Regenerate curated partitions for a date range.')
+    parser.add_argument('--start', required=True, type=date.fromisoformat, help='First dt= partition (YYYY-MM-DD)')
+    parser.add_argument('--end', required=True, type=date.fromisoformat, help='Last dt= partition, inclusive')
+    parser.add_argument('--tables', nargs='+', default=list(BACKFILL_TABLES), choices=BACKFILL_TABLES)
+    parser.add_argument('--concurrency', type=int, default=BACKFILL_CONCURRENCY,
+                        help='Worker processes, and so concurrent DB connections')
+    parser.add_argument('--force', action='store_true', help='Overwrite partitions that already exist')
+    parser.add_argument('--streaming', action='store_true', help='Use the streaming export mode')
+    parser.add_argument('--summary', help='Write the JSON summary to this path')
+    args = parser.parse_args(argv)
+
+    summary = run_backfill(args.start, args.end, args.tables, max(1, args.concurrency),
+                           args.force, args.streaming)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
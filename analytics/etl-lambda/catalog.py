@@ -0,0 +1,231 @@
+"""
+Partition catalog for the curated lake.
+Exporters register each partition they write directly with the Glue Data
+Catalog and record it in a per-table JSON manifest in S3 (location, row
+count, size), so neither Athena nor downstream jobs ever need to list the
+table's prefix: no MSCK REPAIR TABLE, no crawler run.
+
+The Glue client is passed in, so anything with the same three calls (see
+sinks.MemoryGlue) can stand in for it. Manifests are read-modify-
+write objects: only one process should publish to a given table at a time.
+
+Existing partitions (e.g. from before manifests) are picked up once with:
+
+    python catalog.py --tables usage tenants prom_outcomes usage_monthly usage_by_month
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+from datetime import datetime
+
+from coldstart import lazy_import
+from s3_multipart import S3ObjectFile
+from sinks import OUTPUT_SINK, catalog_client, sink_client
+
+pq = lazy_import('pyarrow.parquet')
+
+GLUE_DATABASE = os.environ.get('GLUE_DATABASE', 'qivr_analytics')
+MANIFEST_PREFIX = 'manifests'
+
+# Glue's per-call limits
+CREATE_BATCH_SIZE = 100
+DELETE_BATCH_SIZE = 25
+
+
+class CatalogError(Exception):
+    """Glue rejected a partition change."""
+
+
+class GlueCatalog:
+    """Adds and drops partitions of the Glue tables Athena queries.
+
+    Partitions inherit the table's storage descriptor with their own
+    location, the same as MSCK REPAIR TABLE would create them. Adding a
+    partition that already exists is not an error.
+    """
+
+    def __init__(self, glue, database=GLUE_DATABASE):
+        self.glue = glue
+        self.database = database
+        self._descriptors = {}
+
+    def _storage_descriptor(self, table):
+        if table not in self._descriptors:
+            resp = self.glue.get_table(DatabaseName=self.database, Name=table)
+            self._descriptors[table] = resp['Table']['StorageDescriptor']
+        return self._descriptors[table]
+
+    def add_partitions(self, table, entries):
+        """Create a partition for every manifest entry, in batches."""
+        descriptor = self._storage_descriptor(table)
+        for i in range(0, len(entries), CREATE_BATCH_SIZE):
+            inputs = []
+            for entry in entries[i:i + CREATE_BATCH_SIZE]:
+                partition_descriptor = copy.deepcopy(descriptor)
+                partition_descriptor['Location'] = entry['location']
+                inputs.append({
+                    'Values': list(entry['values'].values()),
+                    'StorageDescriptor': partition_descriptor,
+                })
+            resp = self.glue.batch_create_partition(
+                DatabaseName=self.database, TableName=table, PartitionInputList=inputs
+            )
+            self._raise_errors(table, resp, ignore='AlreadyExistsException')
+
+    def drop_partitions(self, table, values):
+        """Drop the partitions with the given {column: value} dicts, in batches."""
+        for i in range(0, len(values), DELETE_BATCH_SIZE):
+            resp = self.glue.batch_delete_partition(
+                DatabaseName=self.database,
+                TableName=table,
+                PartitionsToDelete=[{'Values': list(v.values())} for v in values[i:i + DELETE_BATCH_SIZE]],
+            )
+            self._raise_errors(table, resp, ignore='EntityNotFoundException')
+
+    def _raise_errors(self, table, resp, ignore):
+        errors = [e for e in resp.get('Errors', []) if e['ErrorDetail']['ErrorCode'] != ignore]
+        if errors:
+            detail = errors[0]['ErrorDetail']
+            raise CatalogError(f"{self.database}.{table} partition {errors[0]['PartitionValues']}: "
+                               f"{detail['ErrorCode']} {detail.get('ErrorMessage', '')}")
+
+
+def partition_name(values):
+    """Hive-style name of a partition, e.g. dt=2024-01-31."""
+    return '/'.join(f'{column}={value}' for column, value in values.items())
+
+
+def partition_entry(values, bucket, key, rows, size, content_hash=None, write_seconds=None):
+    """Manifest entry for the object at key holding one partition.
+
+    content_hash and write_seconds (the encode and upload time the object
+    took, or saved) are recorded when known.
+    """
+    entry = {
+        'values': dict(values),
+        'location': f"s3://{bucket}/{key.rsplit('/', 1)[0]}/",
+        'key': key,
+        'rows': rows,
+        'bytes': size,
+        'updated_at': datetime.utcnow().isoformat(timespec='seconds'),
+    }
+    if content_hash is not None:
+        entry['content_hash'] = content_hash
+    if write_seconds is not None:
+        entry['write_seconds'] = round(write_seconds, 3)
+    return entry
+
+
+def manifest_key(table):
+    return f'{MANIFEST_PREFIX}/{table}.json'
+
+
+def load_manifest(s3, bucket, table):
+    """A table's manifest, or an empty one if nothing has been published yet."""
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=manifest_key(table))
+    except s3.exceptions.NoSuchKey:
+        return {'table': table, 'partitions': {}}
+    return json.loads(bytes(obj['Body'].read()))
+
+
+def save_manifest(s3, bucket, manifest):
+    s3.put_object(
+        Bucket=bucket,
+        Key=manifest_key(manifest['table']),
+        Body=json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'),
+        ContentType='application/json',
+    )
+
+
+def previous_partition(s3, bucket, table, values, inclusive=True):
+    """Manifest entry of the partition with values (if inclusive), or else the latest one before it.
+
+    Partition names sort by their values, so for a date-partitioned table
+    this is the most recent day up to the given one.
+    """
+    partitions = load_manifest(s3, bucket, table)['partitions']
+    name = partition_name(values)
+    earlier = [n for n in partitions if n < name or (inclusive and n == name)]
+    return partitions[max(earlier)] if earlier else None
+
+
+def publish_partitions(s3, bucket, catalog, table, entries):
+    """Register entries with the catalog, then record them in the manifest."""
+    if not entries:
+        return
+    catalog.add_partitions(table, entries)
+    manifest = load_manifest(s3, bucket, table)
+    for entry in entries:
+        manifest['partitions'][partition_name(entry['values'])] = entry
+    save_manifest(s3, bucket, manifest)
+
+
+def retire_partitions(s3, bucket, catalog, table, names):
+    """Drop partitions (by name) from the catalog and the manifest."""
+    manifest = load_manifest(s3, bucket, table)
+    retired = [manifest['partitions'].pop(name) for name in names if name in manifest['partitions']]
+    if not retired:
+        return
+    catalog.drop_partitions(table, [entry['values'] for entry in retired])
+    save_manifest(s3, bucket, manifest)
+
+
+def rebuild_manifest(s3, bucket, catalog, table, prefix):
+    """Register and record every partition object under prefix by listing it once.
+
+    Row counts come from each object's Parquet footer.
+    """
+    entries = []
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        resp = s3.list_objects_v2(**kwargs)
+        for obj in resp.get('Contents', []):
+            key = obj['Key']
+            column, _, value = key[len(prefix):].split('/')[0].partition('=')
+            if not value:
+                continue
+            source = S3ObjectFile(s3, bucket, key)
+            rows = pq.read_metadata(source).num_rows
+            entries.append(partition_entry({column: value}, bucket, key, rows, source.size))
+        if not resp.get('IsTruncated'):
+            break
+        kwargs['ContinuationToken'] = resp['NextContinuationToken']
+    publish_partitions(s3, bucket, catalog, table, entries)
+    print(f"Recorded {len(entries)} partitions of {table} from s3://{bucket}/{prefix}")
+    return len(entries)
+
+
+def table_prefix(table):
+    """Where a Glue table's partitions live.
+
+    <t>_monthly is under compacted/, rollups (<t>_by_<dimension>, see
+    rollups.py) are under rollups/, lambda_function.py's extract_<t> under
+    <t>/ and the rest under curated/.
+    """
+    if table.endswith('_monthly'):
+        return f"compacted/{table[:-len('_monthly')]}/"
+    if '_by_' in table:
+        return f'rollups/{table}/'
+    if table.startswith('extract_'):
+        return f"{table[len('extract_'):]}/"
+    return f'curated/{table}/'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Register existing partitions and rebuild manifests.')
+    parser.add_argument('--tables', nargs='+', required=True, help='Glue table names')
+    args = parser.parse_args(argv)
+
+    s3 = sink_client(OUTPUT_SINK)
+    bucket = os.environ.get('S3_BUCKET', 'qivr-analytics-lake')
+    catalog = GlueCatalog(catalog_client(OUTPUT_SINK))
+    for table in args.tables:
+        rebuild_manifest(s3, bucket, catalog, table, table_prefix(table))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Checkpoints for ETL runs that outlive one Lambda invocation.
+A RunCheckpoint is a JSON object in the lake recording, per table, whether
+its export finished and which of its key-range chunks are already staged.
+It is saved after every committed chunk. An invocation whose Deadline is
+close stops before starting more work and hands the run to a continuation
+(itself, invoked again with the run id), which skips everything the
+checkpoint says is done and resumes at the next chunk.
+
+A Deadline wraps the Lambda context, so anything with
+get_remaining_time_in_millis() (see FakeContext) drives it locally.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+CHECKPOINT_PREFIX = 'state/runs'
+# No new chunk starts with less than this left; it must cover the longest chunk
+CHECKPOINT_RESERVE_SECONDS = int(os.environ.get('CHECKPOINT_RESERVE_SECONDS', '60'))
+# A run still unfinished after this many invocations is failed rather than continued
+CHECKPOINT_MAX_INVOCATIONS = int(os.environ.get('CHECKPOINT_MAX_INVOCATIONS', '10'))
+
+# Table statuses that need no more work in this run
+FINAL_STATUSES = ('succeeded', 'failed')
+
+
+class OutOfTime(Exception):
+    """Too little of the invocation is left to start the next piece of work."""
+
+
+class Deadline:
+    """When an invocation has to stop starting new work.
+
+    Without a context (a local run) it never expires.
+    """
+
+    def __init__(self, context=None, reserve_seconds=None):
+        self.context = context
+        self.reserve_seconds = CHECKPOINT_RESERVE_SECONDS if reserve_seconds is None else reserve_seconds
+
+    def remaining_seconds(self):
+        if self.context is None:
+            return None
+        return self.context.get_remaining_time_in_millis() / 1000
+
+    def expired(self):
+        remaining = self.remaining_seconds()
+        return remaining is not None and remaining < self.reserve_seconds
+
+    def check(self, work):
+        """Raise OutOfTime unless there is time to start work (a description for the log)."""
+        if self.expired():
+            raise OutOfTime(f"{self.remaining_seconds():.0f}s left, stopping before {work}")
+
+
+class FakeContext:
+    """Lambda context stand-in with a fixed time budget, for local runs."""
+
+    function_name = 'local'
+    invoked_function_arn = None
+
+    def __init__(self, seconds):
+        self._ends = time.monotonic() + seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._ends - time.monotonic()) * 1000))
+
+
+class RunCheckpoint:
+    """Progress of one run, keyed by run id (the partition date it exports).
+
+    Each table's entry holds its status, its export result and whatever
+    its exporter needs to resume (chunk plan, staged chunks, watermark).
+    Entries are only changed through update(), which saves the checkpoint,
+    so exporters running concurrently can share it.
+    """
+
+    def __init__(self, s3, bucket, run_id, date_str, tables, invocations=0, status='running'):
+        self.s3 = s3
+        self.bucket = bucket
+        self.run_id = run_id
+        self.date_str = date_str
+        self.tables = tables
+        self.invocations = invocations
+        self.status = status
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(run_id):
+        return f'{CHECKPOINT_PREFIX}/{run_id}.json'
+
+    @classmethod
+    def load(cls, s3, bucket, run_id):
+        """The saved checkpoint of a run, or None."""
+        try:
+            obj = s3.get_object(Bucket=bucket, Key=cls.key(run_id))
+        except s3.exceptions.NoSuchKey:
+            return None
+        data = json.loads(bytes(obj['Body'].read()))
+        return cls(s3, bucket, data['run_id'], data['date_str'], data['tables'],
+                   data['invocations'], data['status'])
+
+    @classmethod
+    def open(cls, s3, bucket, run_id, date_str, tables):
+        """The run's checkpoint if it is still running, else a fresh one for tables.
+
+        A run that ended with failures (Lambda retrying it) is reopened with
+        only its failed tables pending.
+        """
+        checkpoint = cls.load(s3, bucket, run_id)
+        if checkpoint is not None and checkpoint.status == 'failed':
+            for entry in checkpoint.tables.values():
+                if entry['status'] == 'failed':
+                    entry['status'] = 'pending'
+            checkpoint.status, checkpoint.invocations = 'running', 0
+        if checkpoint is None or checkpoint.status != 'running':
+            checkpoint = cls(s3, bucket, run_id, date_str, {table: {'status': 'pending'} for table in tables})
+        checkpoint.invocations += 1
+        checkpoint.save()
+        return checkpoint
+
+    def pending(self):
+        """Tables that still have work to do, in the order they were listed."""
+        return [table for table, entry in self.tables.items() if entry['status'] not in FINAL_STATUSES]
+
+    def update(self, table, **changes):
+        """Change a table's entry and save the checkpoint."""
+        with self._lock:
+            self.tables[table] = {**self.tables[table], **changes}
+            self._save()
+
+    def finish(self, failed=False):
+        with self._lock:
+            self.status = 'failed' if failed else 'complete'
+            self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        body = {
+            'run_id': self.run_id,
+            'date_str': self.date_str,
+            'status': self.status,
+            'invocations': self.invocations,
+            'updated_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'tables': self.tables,
+        }
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self.key(self.run_id),
+            Body=json.dumps(body, indent=2, sort_keys=True, default=str).encode('utf-8'),
+            ContentType='application/json',
+        )
+
+
+class TableProgress:
+    """One table's view of a RunCheckpoint and the Deadline its chunks run against."""
+
+    def __init__(self, checkpoint, table, deadline):
+        self.checkpoint = checkpoint
+        self.table = table
+        self.deadline = deadline
+
+    def get(self, name, default=None):
+        return self.checkpoint.tables[self.table].get(name, default)
+
+    def update(self, **changes):
+        self.checkpoint.update(self.table, **changes)
+
+    def check(self, work):
+        self.deadline.check(f'{self.table} {work}')
+
+
+def continue_run(lambda_client, context, event):
+    """Invoke this function again, asynchronously, with event; returns event.
+
+    A context without a function ARN (FakeContext) is a local run: nothing
+    is invoked, and the caller runs the returned continuation itself.
+    """
+    if getattr(context, 'invoked_function_arn', None):
+        lambda_client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps(event).encode('utf-8'),
+        )
+        print(f"Continuing run {event.get('resume')} in a new invocation")
+    return event
@@ -0,0 +1,196 @@
+"""
+Cohort aggregation for the anonymized PROM outcome exports.
+Exporters pull one de-identified row per PROM (region, type, gender, age in
+whole years and its scores) and CohortDefinitions turn those rows into
+aggregate tables in memory with pyarrow.compute group-bys: ages are bucketed
+by bracket edges, rows grouped by the definition's dimensions, and groups
+with fewer than k rows suppressed. Any number of definitions are computed
+from the same rows, batch by batch, so a new cohort cut never needs another
+scan of production.
+"""
+import os
+
+from coldstart import lazy_import
+from parquet_writer import arrow_schema
+
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+
+# Rows buffered before they are reduced to partial aggregates; group-bys over
+# small batches cost about as much per batch as over large ones
+COHORT_CHUNK_ROWS = int(os.environ.get('COHORT_CHUNK_ROWS', '262144'))
+# Partial aggregates of a definition are merged once this many have piled up
+MERGE_EVERY = 64
+
+# (output column, row column) of the averaged scores
+PROM_MEASURES = (('avg_baseline', 'baseline_score'), ('avg_final', 'final_score'))
+
+_COUNT = 'count_all'
+
+
+class CohortDefinition:
+    """One aggregate output over the PROM rows.
+
+    columns declares the output the way exporters declare tables: every
+    column that is not a measure or count_column is a dimension, and an
+    'age_bracket' dimension is the row's age bucketed by age_edges, labelled
+    '18-29', '30-44', ... '60+' for edges (18, 30, 45, 60). Ages below the
+    first edge fall into the first bracket and unknown ages into the last,
+    as the SQL CASE expressions this replaces did.
+
+    Groups of fewer than k rows are dropped. With complementary set, a
+    second cell is also dropped wherever a group of all dimensions but the
+    last would otherwise lose exactly one, so the dropped cell cannot be
+    recovered by subtracting the published ones from a coarser total.
+    """
+
+    def __init__(self, name, columns, k, age_edges=(18, 30, 45, 60), measures=PROM_MEASURES,
+                 count_column='patient_count', complementary=False):
+        self.name = name
+        self.columns = tuple(columns)
+        self.k = k
+        self.age_edges = tuple(age_edges)
+        self.measures = tuple(measures)
+        self.count_column = count_column
+        self.complementary = complementary
+        outputs = {name for name, _ in self.measures} | {count_column}
+        self.dimensions = tuple(name for name, _ in self.columns if name not in outputs)
+
+    def age_labels(self):
+        edges = self.age_edges
+        return [f'{low}-{high - 1}' for low, high in zip(edges, edges[1:])] + [f'{edges[-1]}+']
+
+    def age_brackets(self, ages):
+        """Bracket label of every age, computed column-wise."""
+        ages = pc.fill_null(ages, self.age_edges[-1])
+        index = pa.repeat(pa.scalar(0, pa.int8()), len(ages))
+        for edge in self.age_edges[1:]:
+            index = pc.add(index, pc.cast(pc.greater_equal(ages, edge), pa.int8()))
+        return pc.take(pa.array(self.age_labels(), pa.string()), index)
+
+    def partial(self, rows, brackets):
+        """Per-group score sums, score counts and row counts of one table of rows.
+
+        brackets caches age bracket columns by edges across the definitions
+        sharing these rows.
+        """
+        if 'age_bracket' in self.dimensions:
+            if self.age_edges not in brackets:
+                brackets[self.age_edges] = self.age_brackets(rows['age'])
+            rows = rows.append_column('age_bracket', brackets[self.age_edges])
+        aggregations = [(source, 'sum') for _, source in self.measures]
+        aggregations += [(source, 'count') for _, source in self.measures]
+        aggregations.append(([], 'count_all'))
+        # Single-threaded so sums are added in the same order every run
+        return rows.select(self.dimensions + tuple(s for _, s in self.measures)) \
+            .group_by(self.dimensions, use_threads=False).aggregate(aggregations)
+
+    def merge(self, partials):
+        """Combine partial aggregates into one, with the same column names."""
+        if len(partials) == 1:
+            return partials[0]
+        combined = pa.concat_tables(partials)
+        sums = [name for name in combined.column_names if name not in self.dimensions]
+        merged = combined.group_by(self.dimensions, use_threads=False).aggregate([(n, 'sum') for n in sums])
+        return merged.rename_columns([name if name in self.dimensions else name[:-len('_sum')]
+                                      for name in merged.column_names])
+
+    def finish(self, totals):
+        """The published table: averages and counts of every group that survives suppression."""
+        schema = arrow_schema(self.columns)
+        if totals is None or not totals.num_rows:
+            return schema.empty_table()
+        counts = totals[_COUNT]
+        keep = pc.greater_equal(counts, self.k)
+        if self.complementary and len(self.dimensions) > 1:
+            keep = pc.and_(keep, pc.invert(self._complementary(totals, keep)))
+        totals = totals.filter(keep)
+
+        columns = {name: totals[name] for name in self.dimensions}
+        for output, source in self.measures:
+            columns[output] = pc.divide(pc.cast(totals[f'{source}_sum'], pa.float64()),
+                                        totals[f'{source}_count'])
+        columns[self.count_column] = totals[_COUNT]
+        return pa.table([columns[field.name] for field in schema], names=schema.names).cast(schema)
+
+    def _complementary(self, totals, keep):
+        """Cells to drop so no parent group has exactly one suppressed cell.
+
+        In such a group the smallest surviving cell (every one tied for
+        smallest) goes too.
+        """
+        parents = totals.select(self.dimensions[:-1])
+        key = pc.binary_join_element_wise(
+            *[pc.cast(parents[name], pa.string()) for name in parents.column_names], '\x1f',
+            null_handling='replace', null_replacement='\x00',
+        )
+        group = pc.dictionary_encode(key.combine_chunks()).indices
+        suppressed = pc.cast(pc.invert(keep), pa.int64())
+        surviving_counts = pc.if_else(keep, totals[_COUNT], pa.scalar(None, totals[_COUNT].type))
+        per_group = pa.table({'group': group, 'suppressed': suppressed, 'count': surviving_counts}) \
+            .group_by('group', use_threads=False) \
+            .aggregate([('suppressed', 'sum'), ('count', 'min')]) \
+            .sort_by('group')
+        # Every group id occurs, so after sorting row i belongs to group i
+        lone = pc.equal(pc.take(per_group['suppressed_sum'], group), 1)
+        smallest = pc.equal(totals[_COUNT], pc.take(per_group['count_min'], group))
+        return pc.fill_null(pc.and_(pc.and_(lone, keep), smallest), False)
+
+
+class CohortAggregator:
+    """Several CohortDefinitions computed in one pass over batches of rows.
+
+    Batches are buffered up to COHORT_CHUNK_ROWS rows and then reduced to
+    small per-group partials, so memory is bounded by that chunk and the
+    number of groups rather than by the rows.
+    """
+
+    def __init__(self, definitions, chunk_rows=None):
+        self.definitions = list(definitions)
+        self.chunk_rows = chunk_rows or COHORT_CHUNK_ROWS
+        self.rows = 0
+        self._pending, self._pending_rows = [], 0
+        self._partials = {definition.name: [] for definition in self.definitions}
+
+    def add(self, batch):
+        """Fold a RecordBatch (or Table) of rows into every definition."""
+        rows = batch if isinstance(batch, pa.Table) else pa.Table.from_batches([batch])
+        self._pending.append(rows)
+        self._pending_rows += rows.num_rows
+        self.rows += rows.num_rows
+        if self._pending_rows >= self.chunk_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        rows = pa.concat_tables(self._pending)
+        self._pending, self._pending_rows = [], 0
+        brackets = {}
+        for definition in self.definitions:
+            partials = self._partials[definition.name]
+            partials.append(definition.partial(rows, brackets))
+            if len(partials) >= MERGE_EVERY:
+                partials[:] = [definition.merge(partials)]
+
+    def totals(self):
+        """{definition name: merged partial aggregates, before suppression (None without rows)}."""
+        self._flush()
+        return {
+            definition.name: definition.merge(self._partials[definition.name])
+            if self._partials[definition.name] else None
+            for definition in self.definitions
+        }
+
+    def results(self):
+        """{definition name: published table}."""
+        totals = self.totals()
+        return {definition.name: definition.finish(totals[definition.name]) for definition in self.definitions}
+
+
+def aggregate(rows, definitions):
+    """Every definition over rows (a Table or an iterable of RecordBatches); {name: table}."""
+    aggregator = CohortAggregator(definitions)
+    for batch in ([rows] if isinstance(rows, pa.Table) else rows):
+        aggregator.add(batch)
+    return aggregator.results()
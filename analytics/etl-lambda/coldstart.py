@@ -0,0 +1,84 @@
+"""
+Deferred imports and AWS clients for the ETL Lambda.
+Heavy modules (pyarrow, psycopg2, boto3) and AWS clients are stand-ins that
+load on first use instead of at import time, so a cold start only pays for
+what an invocation actually touches. Every load is timed, which gives the
+cold-start breakdown reported by the handler.
+"""
+import importlib
+import threading
+import time
+
+_timings = {'import': {}, 'client': {}}
+_lock = threading.RLock()
+
+
+class LazyModule:
+    """Module stand-in that imports the real module on first attribute access."""
+
+    def __init__(self, name):
+        self.__dict__.update(_name=name, _module=None)
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+    def _load(self):
+        with _lock:
+            if self._module is None:
+                started = time.perf_counter()
+                module = importlib.import_module(self._name)
+                _timings['import'][self._name] = _ms_since(started)
+                self.__dict__['_module'] = module
+        return self._module
+
+
+class LazyClient:
+    """boto3 client stand-in that constructs the client on first use."""
+
+    def __init__(self, service):
+        self.__dict__.update(_service=service, _client=None)
+
+    def __getattr__(self, attr):
+        return getattr(self._client or self._load(), attr)
+
+    def _load(self):
+        with _lock:
+            if self._client is None:
+                boto3 = lazy_import('boto3')
+                boto3.client  # import boto3 outside the client timing
+                started = time.perf_counter()
+                client = boto3.client(self._service)
+                _timings['client'][self._service] = _ms_since(started)
+                self.__dict__['_client'] = client
+        return self._client
+
+
+_modules = {}
+
+
+def lazy_import(name):
+    """Shared LazyModule for name, so every caller waits on the same import."""
+    with _lock:
+        if name not in _modules:
+            _modules[name] = LazyModule(name)
+        return _modules[name]
+
+
+def lazy_client(service):
+    return LazyClient(service)
+
+
+def record(phase, name, started):
+    """Record a duration measured from a time.perf_counter() start."""
+    with _lock:
+        _timings.setdefault(phase, {})[name] = _ms_since(started)
+
+
+def breakdown():
+    """Milliseconds spent per import and per client construction so far."""
+    with _lock:
+        return {phase: dict(timings) for phase, timings in _timings.items()}
+
+
+def _ms_since(started):
+    return round((time.perf_counter() - started) * 1000, 1)
@@ -0,0 +1,274 @@
+"""
+Qivr Analytics ETL Compaction
+Merges a month of daily curated/<table>/dt=YYYY-MM-DD/ partitions into one
+Parquet file under compacted/<table>/month=YYYY-MM/, so Athena opens one
+object per month instead of one per day.
+
+Row groups are copied one at a time through ranged S3 reads, each tagged with
+its day in a dt column, so memory is bounded by a row group rather than a
+month. Daily partitions are found through the table's manifest. The merged
+file is written under a staging key, checked against the expected row count
+and schema, and only then copied into place and registered in
+<table>_monthly; the days are then retired from the daily table and their
+objects deleted last. Re-running is safe: days already in the monthly file
+are kept, and days that still have a daily partition replace them.
+
+    python compact.py --tables usage tenants --months 2024-01 2024-02
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+import handler
+from coldstart import lazy_import
+from catalog import load_manifest, partition_entry, partition_name, publish_partitions, retire_partitions
+from parquet_writer import ParquetLayout, arrow_schema
+from s3_multipart import S3MultipartWriter, S3ObjectFile
+from watermarks import load_state
+
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+pq = lazy_import('pyarrow.parquet')
+
+STAGING_PREFIX = os.environ.get('COMPACT_STAGING_PREFIX', 'staging/compacted')
+
+# Column declarations and layouts of the daily partitions, per table
+COMPACT_TABLES = {
+    'tenants': (handler.TENANTS_COLUMNS, handler.TENANTS_LAYOUT),
+    'usage': (handler.USAGE_COLUMNS, handler.USAGE_LAYOUT),
+    'prom_outcomes': (handler.PROM_OUTCOMES_COLUMNS, handler.PROM_OUTCOMES_LAYOUT),
+}
+
+
+class CompactionError(Exception):
+    """A month could not be compacted safely; its daily partitions are left alone."""
+
+
+def monthly_key(table, month):
+    return f'compacted/{table}/month={month}/data.parquet'
+
+
+def daily_partitions(s3, bucket, table, month=''):
+    """{day: [keys]} of a table's daily partitions per its manifest, optionally within one month."""
+    days = defaultdict(list)
+    for entry in load_manifest(s3, bucket, table)['partitions'].values():
+        if entry['values']['dt'].startswith(month):
+            days[entry['values']['dt']].append(entry['key'])
+    return dict(days)
+
+
+def object_exists(s3, bucket, key):
+    resp = s3.list_objects_v2(Bucket=bucket, Prefix=key, MaxKeys=1)
+    return any(obj['Key'] == key for obj in resp.get('Contents', []))
+
+
+def monthly_schema(columns):
+    """Schema of a compacted file: the daily columns plus the day they came from."""
+    return arrow_schema(columns).append(pa.field('dt', pa.string()))
+
+
+def monthly_layout(layout):
+    """The daily layout with dt dictionary-encoded and carrying statistics.
+
+    Row groups are copied as they are, in day order, so each row group holds
+    one day and dt statistics let readers prune by day.
+    """
+    statistics = None if layout.statistics_columns is None else ('dt',) + layout.statistics_columns
+    return ParquetLayout(
+        dictionary_columns=('dt',) + layout.dictionary_columns,
+        statistics_columns=statistics,
+        row_group_size=layout.row_group_size,
+        compression=layout.compression,
+        compression_level=layout.compression_level,
+    )
+
+
+def _same_schema(actual, expected):
+    return actual.remove_metadata().equals(expected.remove_metadata())
+
+
+def _write_month(s3, bucket, table, month, days, staging_key):
+    """Stream the month's row groups into staging_key; returns the rows written."""
+    columns, layout = COMPACT_TABLES[table]
+    daily_schema = arrow_schema(columns)
+    schema = monthly_schema(columns)
+    final_key = monthly_key(table, month)
+    rows = 0
+
+    # (day, row group) of days compacted earlier that no daily partition replaces
+    existing, kept = None, []
+    if object_exists(s3, bucket, final_key):
+        existing = pq.ParquetFile(S3ObjectFile(s3, bucket, final_key))
+        if not _same_schema(existing.schema_arrow, schema):
+            raise CompactionError(f'{final_key} has schema {existing.schema_arrow}')
+        dt_index = existing.schema_arrow.get_field_index('dt')
+        for i in range(existing.num_row_groups):
+            stats = existing.metadata.row_group(i).column(dt_index).statistics
+            day = stats.min if stats is not None and stats.has_min_max else ''
+            kept.append((day, i))
+
+    replaced = pa.array(sorted(days), pa.string())
+    sources = sorted([(day, i, None) for day, i in kept] +
+                     [(day, 0, key) for day in sorted(days) for key in sorted(days[day])],
+                     key=lambda source: source[0])
+    with S3MultipartWriter(s3, bucket, staging_key) as sink:
+        with pq.ParquetWriter(sink, schema, **monthly_layout(layout).writer_options(schema)) as writer:
+            for day, i, key in sources:
+                if key is None:
+                    row_group = existing.read_row_group(i)
+                    row_group = row_group.filter(pc.invert(pc.is_in(row_group['dt'], value_set=replaced)))
+                    if row_group.num_rows:
+                        writer.write_table(row_group)
+                        rows += row_group.num_rows
+                    continue
+                source = pq.ParquetFile(S3ObjectFile(s3, bucket, key))
+                if not _same_schema(source.schema_arrow, daily_schema):
+                    raise CompactionError(f'{key} has schema {source.schema_arrow}')
+                for j in range(source.num_row_groups):
+                    row_group = source.read_row_group(j)
+                    row_group = row_group.append_column(
+                        schema.field('dt'), pa.repeat(pa.scalar(day, pa.string()), row_group.num_rows)
+                    )
+                    writer.write_table(row_group)
+                    rows += row_group.num_rows
+                    del row_group
+    return rows
+
+
+def _verify(s3, bucket, key, rows, schema):
+    """Raise CompactionError unless the object at key holds rows rows of schema."""
+    metadata = pq.read_metadata(S3ObjectFile(s3, bucket, key))
+    if metadata.num_rows != rows:
+        raise CompactionError(f'{key} has {metadata.num_rows} rows, expected {rows}')
+    if not _same_schema(metadata.schema.to_arrow_schema(), schema):
+        raise CompactionError(f'{key} has schema {metadata.schema.to_arrow_schema()}')
+
+
+def _delete(s3, bucket, keys):
+    """Delete keys in batches of 1000, raising if any deletion failed."""
+    for i in range(0, len(keys), 1000):
+        resp = s3.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': k} for k in keys[i:i + 1000]], 'Quiet': True},
+        )
+        if resp.get('Errors'):
+            raise CompactionError(f"Failed to delete {resp['Errors'][0]['Key']}: {resp['Errors'][0]['Message']}")
+
+
+def compact_month(s3, bucket, catalog, table, month, protected=()):
+    """Merge one month of a table's daily partitions into its monthly file.
+
+    The month is published to <table>_monthly and its days are retired from
+    the daily table (catalog and manifest) before their objects are deleted.
+    protected holds keys that must not be deleted (partitions the incremental
+    exporters still read), so a month containing one is skipped.
+    """
+    started = time.monotonic()
+    days = daily_partitions(s3, bucket, table, month + '-')
+    if not days:
+        return {'status': 'skipped', 'reason': 'no daily partitions'}
+    keys = [key for day_keys in days.values() for key in day_keys]
+    in_use = sorted(set(keys) & set(protected))
+    if in_use:
+        return {'status': 'skipped', 'reason': f'{in_use[0]} is an incremental export base'}
+
+    columns, _ = COMPACT_TABLES[table]
+    final_key = monthly_key(table, month)
+    staging_key = f'{STAGING_PREFIX}/{table}/month={month}/{uuid.uuid4().hex}.parquet'
+    try:
+        rows = _write_month(s3, bucket, table, month, days, staging_key)
+        _verify(s3, bucket, staging_key, rows, monthly_schema(columns))
+        s3.copy_object(Bucket=bucket, Key=final_key, CopySource={'Bucket': bucket, 'Key': staging_key})
+        size = s3.head_object(Bucket=bucket, Key=final_key)['ContentLength']
+        if size != S3ObjectFile(s3, bucket, staging_key).size:
+            raise CompactionError(f'{final_key} does not match {staging_key} after copy')
+    finally:
+        _delete(s3, bucket, [staging_key])
+
+    publish_partitions(s3, bucket, catalog, f'{table}_monthly',
+                       [partition_entry({'month': month}, bucket, final_key, rows, size)])
+    retire_partitions(s3, bucket, catalog, table, [partition_name({'dt': day}) for day in days])
+    _delete(s3, bucket, keys)
+    print(f"Compacted {len(days)} days ({rows} rows) of {table} into s3://{bucket}/{final_key}")
+    return {
+        'status': 'compacted',
+        'days': len(days),
+        'rows': rows,
+        'bytes': size,
+        'deleted': len(keys),
+        'seconds': round(time.monotonic() - started, 2),
+    }
+
+
+def completed_months(s3, bucket, table, today=None):
+    """Months before the current one that still have daily partitions."""
+    current = (today or datetime.utcnow().date()).strftime('%Y-%m')
+    return sorted({day[:7] for day in daily_partitions(s3, bucket, table) if day[:7] < current})
+
+
+def run_compaction(s3, bucket, catalog, tables=tuple(COMPACT_TABLES), months=None):
+    """Compact the given months (default: every completed month) of each table."""
+    unknown = set(tables) - set(COMPACT_TABLES)
+    if unknown:
+        raise ValueError(f"Unknown tables: {', '.join(sorted(unknown))}")
+    protected = {entry.get('partition') for entry in load_state(s3, bucket).values()}
+
+    results, failed = {}, []
+    for table in tables:
+        results[table] = {}
+        for month in months or completed_months(s3, bucket, table):
+            try:
+                results[table][month] = compact_month(s3, bucket, catalog, table, month, protected)
+            except Exception as e:
+                print(f"Compaction of {table} {month} failed: {e}")
+                results[table][month] = {'status': 'failed', 'error': str(e)}
+                failed.append(f'{table}/{month}')
+    return {'failed': failed, 'results': results}
+
+
+class CompactionFailed(Exception):
+    """A compaction run finished with failed months.
+
+    Raised rather than returned as a status code, as handler.ExportFailed
+    is, so Lambda counts the invocation in Errors and retries the event.
+    """
+
+
+def compact_handler(event, context):
+    """Lambda handler - compacts completed months after the ETL has run."""
+    event = event or {}
+    summary = run_compaction(
+        handler.s3, handler.S3_BUCKET, handler.partition_catalog,
+        tuple(event.get('tables', COMPACT_TABLES)),
+        event.get('months'),
+    )
+    response = {'statusCode': 200, 'body': json.dumps(summary)}
+    if summary['failed']:
+        # Months compacted are published; a retry finds only the failed ones left
+        print(response['body'])
+        raise CompactionFailed(f"Compaction failed: {', '.join(summary['failed'])}")
+    return response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Merge daily curated partitions into monthly files.')
+    parser.add_argument('--tables', nargs='+', default=list(COMPACT_TABLES), choices=COMPACT_TABLES)
+    parser.add_argument('--months', nargs='+', help='Months to compact (YYYY-MM); default every completed month')
+    parser.add_argument('--summary', help='Write the JSON summary to this path')
+    args = parser.parse_args(argv)
+
+    summary = run_compaction(handler.s3, handler.S3_BUCKET, handler.partition_catalog,
+                             args.tables, args.months)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,250 +3,1192 @@ Qivr Analytics ETL Lambda
 Exports data from RDS to S3 in Parquet format for Athena queries.
 Runs nightly via EventBridge schedule.
 """
+import time
+
+_import_started = time.perf_counter()
+
 import json
 import os
-import boto3
-import psycopg2
-import pyarrow as pa
-import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from io import BytesIO
+
+import coldstart
+import metrics
+from catalog import GlueCatalog, partition_entry, previous_partition, publish_partitions
+from checkpoint import CHECKPOINT_MAX_INVOCATIONS, Deadline, OutOfTime, RunCheckpoint, TableProgress, continue_run
+from cohorts import CohortAggregator, CohortDefinition
+from coldstart import lazy_client, lazy_import
+from pg_arrow import apply_defaults, iter_copy_batches, rows_to_batch, rows_to_table
+from parquet_writer import ParquetLayout, arrow_schema, content_hash, stream_parquet, write_parquet
+from quality import QualityCheck, QualityError, QualityRules
+from rollups import Rollup, previous_day_month, stage_input, update_rollups
+from s3_multipart import S3ObjectFile
+from sharding import ShardTimeout, TenantShard, TenantWeights, iter_shard_results, plan_shards
+from sinks import OUTPUT_SINK, catalog_client, sink_client
+from streaming import current_rss_mb, iter_row_batches, peak_rss_mb
+from warm_cache import ConnectionCache, SecretCache, stats_since
+from watermarks import get_high_water, load_state, merge_changes, save_state
 
 S3_BUCKET = os.environ.get('S3_BUCKET', 'qivr-analytics-lake')
 DB_SECRET_ARN = os.environ.get('DB_SECRET_ARN')
+STREAMING_EXPORT = os.environ.get('STREAMING_EXPORT', 'false').lower() == 'true'
+STREAMING_BATCH_SIZE = int(os.environ.get('STREAMING_BATCH_SIZE', '10000'))
+# Read query results with COPY straight into Arrow instead of through Python tuples
+COPY_INGEST = os.environ.get('COPY_INGEST', 'false').lower() == 'true'
+COPY_BLOCK_SIZE = int(os.environ.get('COPY_BLOCK_SIZE_MB', '4')) * 1024 * 1024
+EXPORT_CONCURRENCY = int(os.environ.get('EXPORT_CONCURRENCY', '3'))
+INCREMENTAL_EXPORT = os.environ.get('INCREMENTAL_EXPORT', 'true').lower() == 'true'
+# Overlap between runs so rows committed late with an older updated_at are not missed
+WATERMARK_LAG_SECONDS = int(os.environ.get('WATERMARK_LAG_SECONDS', '300'))
+PROM_FULL_REFRESH_DAYS = int(os.environ.get('PROM_FULL_REFRESH_DAYS', '7'))
+# S3 user-metadata key holding a snapshot partition's content hash
+CONTENT_HASH_KEY = 'content-sha256'
+# Run the per-tenant exports as one query per tenant shard (see sharding.py)
+SHARDED_EXPORT = os.environ.get('SHARDED_EXPORT', 'false').lower() == 'true'
+EXPORT_SHARDS = int(os.environ.get('EXPORT_SHARDS', '8'))
+SHARD_STRATEGY = os.environ.get('SHARD_STRATEGY', 'size')  # 'size' or 'hash'
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', '4'))
+SHARD_TIME_BUDGET_SECONDS = int(os.environ.get('SHARD_TIME_BUDGET_SECONDS', '60'))
+# Shards read from this replica's secret when set, the primary otherwise
+DB_REPLICA_SECRET_ARN = os.environ.get('DB_REPLICA_SECRET_ARN')
+# Export in checkpointed chunks that a later invocation resumes (see checkpoint.py)
+CHECKPOINTED_EXPORT = os.environ.get('CHECKPOINTED_EXPORT', 'false').lower() == 'true'
+# Merge each exported day into the monthly rollups (see rollups.py)
+UPDATE_ROLLUPS = os.environ.get('UPDATE_ROLLUPS', 'true').lower() == 'true'
+
+# Loaded on first use so cold starts only pay for what an invocation touches
+psycopg2 = lazy_import('psycopg2')
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+pq = lazy_import('pyarrow.parquet')
 
-s3 = boto3.client('s3')
-secrets = boto3.client('secretsmanager')
+# Output goes to OUTPUT_SINK unless an event names another (see sinks.py)
+s3 = sink_client(OUTPUT_SINK)
+secrets = lazy_client('secretsmanager')
+glue = catalog_client(OUTPUT_SINK)
+lambda_client = lazy_client('lambda')
+
+
+# Module-level so the secret and idle connections survive warm invocations
+secret_cache = SecretCache(secrets)
+
+
+def get_db_params(creds):
+    """Get database connection parameters from the database secret."""
+    return {
+        'host': creds['host'],
+        'port': creds.get('port', 5432),
+        'database': creds['dbname'],
+        'user': creds['username'],
+        'password': creds['password'],
+        'options': '-c statement_timeout=300000',  # 5 min timeout
+    }
 
 
 def get_db_connection():
-    """Get database connection from Secrets Manager."""
-    secret = secrets.get_secret_value(SecretId=DB_SECRET_ARN)
-    creds = json.loads(secret['SecretString'])
-    return psycopg2.connect(
-        host=creds['host'],
-        port=creds.get('port', 5432),
-        database=creds['dbname'],
-        user=creds['username'],
-        password=creds['password'],
-        options='-c statement_timeout=300000'  # 5 min timeout
-    )
+    """Open a database connection using the cached secret."""
+    return secret_cache.connect(DB_SECRET_ARN, lambda creds: psycopg2.connect(**get_db_params(creds)))
+
+
+def ping_connection(conn):
+    """Raise unless conn is open and still answering queries."""
+    if conn.closed:
+        raise psycopg2.InterfaceError('connection already closed')
+    with conn.cursor() as cur:
+        cur.execute('SELECT 1')
+    conn.rollback()
+
+
+connection_cache = ConnectionCache(get_db_connection, ping_connection)
+
+
+def get_replica_connection():
+    """Open a connection to the read replica shards are extracted from."""
+    return secret_cache.connect(DB_REPLICA_SECRET_ARN, lambda creds: psycopg2.connect(**get_db_params(creds)))
+
+
+replica_cache = ConnectionCache(get_replica_connection, ping_connection, max_idle=SHARD_WORKERS)
+
+
+def get_connection_pool(max_connections):
+    """Get the warm connection cache, keeping up to max_connections idle."""
+    connection_cache.max_idle = max_connections
+    return connection_cache
+
+
+def shard_pool():
+    """Connections shard queries run on: the replica's if one is configured."""
+    return replica_cache if DB_REPLICA_SECRET_ARN else connection_cache
+
+
+def cache_stats():
+    return {'secret': secret_cache.stats(), 'connection': connection_cache.stats(),
+            'replica': replica_cache.stats()}
+
 
+partition_catalog = GlueCatalog(glue)
 
-def write_parquet_to_s3(df_dict, schema, s3_key):
-    """Write data to S3 as Parquet."""
-    table = pa.Table.from_pydict(df_dict, schema=schema)
-    buffer = BytesIO()
-    pq.write_table(table, buffer, compression='snappy')
-    buffer.seek(0)
-    s3.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=buffer.getvalue())
-    print(f"Wrote {len(df_dict[list(df_dict.keys())[0]])} rows to s3://{S3_BUCKET}/{s3_key}")
-
-
-def export_tenants(conn, date_str):
-    """Export tenant metrics."""
-    query = """
-        SELECT 
-            t.id::text as id,
-            t.name,
-            t.slug,
-            t.status::text as status,
-            t.plan,
-            t.timezone as region,
-            t.created_at,
-            COUNT(DISTINCT CASE WHEN u.user_type = 'Patient' THEN u.id END) as patient_count,
-            COUNT(DISTINCT CASE WHEN u.user_type != 'Patient' THEN u.id END) as staff_count,
-            COALESCE(SUM(CASE 
-                WHEN t.plan = 'starter' THEN 99
-                WHEN t.plan = 'professional' THEN 299
-                WHEN t.plan = 'enterprise' THEN 599
-                ELSE 0
-            END), 0) as mrr
-        FROM tenants t
-        LEFT JOIN users u ON u.tenant_id = t.id AND u.deleted_at IS NULL
-        WHERE t.deleted_at IS NULL
-        GROUP BY t.id, t.name, t.slug, t.status, t.plan, t.timezone, t.created_at
+
+def use_sink(kind):
+    """Send this container's output and partition registrations to another sink."""
+    global s3, glue, partition_catalog
+    if sink_client(kind) is not s3:
+        s3, glue = sink_client(kind), catalog_client(kind)
+        partition_catalog = GlueCatalog(glue)
+
+
+def partition_key(table, date_str):
+    """S3 key of a table's dt= partition."""
+    return f'curated/{table}/dt={date_str}/data.parquet'
+
+
+def register_partitions(table, partitions):
+    """Register written dt= partitions with Glue and record them in the table's manifest.
+
+    partitions holds (date_str, rows) pairs; sizes and content hashes are
+    read back from S3. A single partition written under bound metrics also
+    records how long it took to write (or how long skipping it saved).
     """
-    
+    write_seconds = None
+    table_metrics = metrics.current()
+    if table_metrics is not None and len(partitions) == 1:
+        write_seconds = table_metrics.saved_seconds or (
+            table_metrics.stages.get('encode', 0.0) + table_metrics.stages.get('upload', 0.0)
+        )
+    entries = []
+    for date_str, rows in partitions:
+        key = partition_key(table, date_str)
+        head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+        entries.append(partition_entry(
+            {'dt': date_str}, S3_BUCKET, key, rows, head['ContentLength'],
+            content_hash=head.get('Metadata', {}).get(CONTENT_HASH_KEY),
+            write_seconds=write_seconds,
+        ))
+    publish_partitions(s3, S3_BUCKET, partition_catalog, table, entries)
+
+
+def write_table_to_s3(table, s3_key, layout, metadata=None):
+    """Write an Arrow table to S3 as Parquet in the table's layout."""
+    write_parquet(s3, S3_BUCKET, s3_key, table, layout, metadata)
+
+
+def write_snapshot_to_s3(name, table, date_str, layout):
+    """Write a snapshot table unless it matches the table's previous partition.
+
+    The content hash is stored with the object and in the manifest. When the
+    previous partition has the same hash, encoding and upload are skipped and
+    the partition is published with a server-side copy of it instead.
+    """
+    with metrics.stage('hash'):
+        digest = content_hash(table, layout)
+    s3_key = partition_key(name, date_str)
+    previous = previous_partition(s3, S3_BUCKET, name, {'dt': date_str})
+    if previous is not None and previous.get('content_hash') == digest:
+        carry_forward_partition(previous['key'], s3_key)
+        metrics.saved(bytes=previous['bytes'], seconds=previous.get('write_seconds') or 0.0)
+        return
+    write_table_to_s3(table, s3_key, layout, {CONTENT_HASH_KEY: digest})
+
+
+def quality_check(name, rules, date_str):
+    """A QualityCheck of a table's dt= partition, with drift measured against the day before."""
+    previous = previous_partition(s3, S3_BUCKET, name, {'dt': date_str}, inclusive=False)
+    return QualityCheck(name, rules, previous['rows'] if previous else None)
+
+
+def validate_table(name, table, rules, date_str):
+    """Raise QualityError unless a table about to be published passes its rules."""
+    check = quality_check(name, rules, date_str)
+    check.add(table)
+    check.finish()
+
+
+def read_partition(s3_key):
+    """Read a previously written Parquet partition, or None if it is missing."""
+    if not s3_key:
+        return None
+    with metrics.stage('read_previous'):
+        try:
+            obj = s3.get_object(Bucket=S3_BUCKET, Key=s3_key)
+        except s3.exceptions.NoSuchKey:
+            return None
+        return pq.read_table(pa.BufferReader(obj['Body'].read()))
+
+
+def carry_forward_partition(source_key, s3_key):
+    """Publish an unchanged snapshot under a new partition with a server-side copy."""
+    if source_key != s3_key:
+        with metrics.stage('upload'):
+            s3.copy_object(Bucket=S3_BUCKET, Key=s3_key, CopySource={'Bucket': S3_BUCKET, 'Key': source_key})
+    print(f"No changes; carried s3://{S3_BUCKET}/{source_key} forward to {s3_key}")
+
+
+def db_high_water(conn):
+    """Database time (UTC, minus the safety lag) up to which this run captures changes."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT (now() AT TIME ZONE 'UTC') - %s * interval '1 second'",
+            (WATERMARK_LAG_SECONDS,),
+        )
+        return cur.fetchone()[0]
+
+
+def read_table(conn, query, params, columns, defaults):
+    """Run a query into an Arrow table with column defaults applied."""
+    schema = arrow_schema(columns)
+    if COPY_INGEST:
+        batches = iter_export_batches(conn, query, params, schema, defaults, None, None)
+        return pa.Table.from_batches(list(batches), schema=schema)
     with conn.cursor() as cur:
-        cur.execute(query)
-        rows = cur.fetchall()
+        with metrics.stage('query'):
+            cur.execute(query, params)
+        with metrics.stage('fetch'):
+            rows = cur.fetchall()
+    with metrics.stage('convert'):
+        return rows_to_table(rows, schema, defaults)
+
+
+def iter_export_batches(conn, query, params, schema, defaults, batch_size, cursor_name):
+    """Yield RecordBatches of a query, via COPY or a server-side cursor.
+
+    Cursors and COPY only start returning rows once the query has run, so
+    the wait for the first batch is timed as the query stage.
+    """
+    if COPY_INGEST:
+        source = iter_copy_batches(conn, query, params, schema, COPY_BLOCK_SIZE)
+        convert = lambda batch: apply_defaults(batch, defaults)
+    else:
+        source = iter_row_batches(conn, query, params, batch_size, cursor_name)
+        convert = lambda rows: rows_to_batch(rows, schema, defaults)
+    try:
+        stage = 'query'
+        while True:
+            with metrics.stage(stage):
+                chunk = next(source, None)
+            if chunk is None:
+                return
+            stage = 'fetch'
+            with metrics.stage('convert'):
+                batch = convert(chunk)
+            del chunk
+            yield batch
+    finally:
+        source.close()
+
+
+def stream_parquet_to_s3(conn, query, params, columns, defaults, s3_key, layout, batch_size=None, check=None):
+    """Stream a query into Parquet on S3 one RecordBatch at a time.
+
+    Rows are pulled through a server-side cursor (or COPY_BLOCK_SIZE blocks
+    of a COPY stream), already sorted by the database in the layout's order,
+    converted per batch and appended to a ParquetWriter whose row groups
+    flow straight into an S3 multipart upload, so memory stays flat
+    regardless of result size. Nothing is published if the query returns no
+    rows, the QualityCheck check (if any) fails or any other step does.
+    Returns (row_count, peak_rss_mb).
+    """
+    schema = arrow_schema(columns)
+    batch_size = batch_size or STREAMING_BATCH_SIZE
+    cursor_name = 'export_' + s3_key.split('/')[1]
+    query = layout.order_by(query, schema)
+    batches = iter_export_batches(conn, query, params, schema, defaults, batch_size, cursor_name)
+    if check is not None:
+        batches = check.watch(batches)
+    return stream_parquet(s3, S3_BUCKET, s3_key, schema, batches, layout)
+
+
+# Tenant id column of each per-tenant table
+TENANT_ID_COLUMNS = {'tenants': 'id', 'usage': 'tenant_id'}
+
+
+def shard_weights(name, date_str, weight_columns):
+    """Per-tenant weights from a table's previous partition, or None without one.
+
+    A tenant weighs one plus its weight_columns, so the tenants with the
+    most rows behind them get the smallest shards.
+    """
+    previous = previous_partition(s3, S3_BUCKET, name, {'dt': date_str})
+    if previous is None:
+        return None
+    id_column = TENANT_ID_COLUMNS[name]
+    with metrics.stage('read_previous'):
+        table = pq.read_table(S3ObjectFile(s3, S3_BUCKET, previous['key']),
+                              columns=[id_column, *weight_columns])
+    weights = pa.repeat(pa.scalar(1, pa.int64()), table.num_rows)
+    for column in weight_columns:
+        weights = pc.add(weights, pc.fill_null(table[column], 0))
+    return TenantWeights(table[id_column].to_pylist(), weights.to_pylist())
+
+
+def run_shard(query_for, params, columns, defaults, layout, table_metrics, shard, budgeted):
+    """Read one tenant shard on its own pooled connection, in layout order.
+
+    With budgeted, the query is cancelled after SHARD_TIME_BUDGET_SECONDS
+    and ShardTimeout raised.
+    """
+    pool = shard_pool()
+    conn = pool.acquire()
+    failed = False
+    try:
+        with metrics.recording(table_metrics):
+            if budgeted:
+                with conn.cursor() as cur:
+                    cur.execute('SET LOCAL statement_timeout = %s', (SHARD_TIME_BUDGET_SECONDS * 1000,))
+            query = layout.order_by(query_for(shard), arrow_schema(columns))
+            table = read_table(conn, query, {**(params or {}), **shard.params()}, columns, defaults)
+        conn.commit()
+        return table
+    except psycopg2.extensions.QueryCanceledError:
+        conn.rollback()
+        if not budgeted:
+            raise
+        raise ShardTimeout(f"Shard {shard} ran over {SHARD_TIME_BUDGET_SECONDS}s")
+    except Exception:
+        failed = True
+        raise
+    finally:
+        pool.release(conn, discard=failed)
+
+
+def iter_sharded_batches(name, date_str, query_for, params, columns, defaults, layout, weight_columns):
+    """Yield a per-tenant query's rows shard by shard, in tenant id order.
+
+    query_for(shard) returns the query restricted to one shard. Shards are
+    planned by SHARD_STRATEGY and run SHARD_WORKERS at a time; each shard's
+    rows come back sorted, so the batches are in layout order overall.
+    """
+    weights = shard_weights(name, date_str, weight_columns) if SHARD_STRATEGY == 'size' else None
+    shards = plan_shards(EXPORT_SHARDS, weights)
+    table_metrics = metrics.current()
+    print(f"Extracting {name} in {len(shards)} {'size' if weights else 'hash'}-balanced shards")
+
+    def run(shard, budgeted):
+        return run_shard(query_for, params, columns, defaults, layout, table_metrics, shard, budgeted)
+
+    for _, table in iter_shard_results(shards, run, SHARD_WORKERS, weights):
+        yield from table.to_batches()
+
+
+def chunk_key(table, date_str, index):
+    """S3 key of one staged chunk of a table's dt= partition."""
+    return f'staging/{table}/dt={date_str}/chunk-{index:05d}.parquet'
+
+
+def export_chunks(name, date_str, progress, query_for, params, columns, defaults, layout, rules, weight_columns):
+    """Export a per-tenant table in tenant id chunks, resuming from progress.
+
+    The id space is planned into EXPORT_SHARDS ranges once per run and kept
+    in the checkpoint. Each range is read, staged as its own object and
+    recorded before the next one starts, so an invocation that runs out of
+    time (OutOfTime) loses at most the chunk in flight. Once every chunk is
+    staged they are streamed in id order, through the table's quality
+    rules, into the partition. The staged chunks are deleted afterwards,
+    and also when the quality rules reject them. Returns (row_count,
+    peak_rss_mb).
+    """
+    plan = progress.get('plan')
+    if plan is None:
+        weights = shard_weights(name, date_str, weight_columns) if SHARD_STRATEGY == 'size' else None
+        plan = [[shard.low, shard.high] for shard in plan_shards(EXPORT_SHARDS, weights)]
+        progress.update(plan=plan, chunks=[])
+    chunks = progress.get('chunks')
+    for index in range(len(chunks), len(plan)):
+        shard = TenantShard(*plan[index])
+        progress.check(f'chunk {index + 1}/{len(plan)} {shard}')
+        table = run_shard(query_for, params, columns, defaults, layout, metrics.current(), shard, False)
+        key = chunk_key(name, date_str, index) if table.num_rows else None
+        if key is not None:
+            write_table_to_s3(table, key, layout)
+        chunks = chunks + [{'key': key, 'rows': table.num_rows}]
+        progress.update(chunks=chunks)
+    print(f"{name}: all {len(plan)} chunks staged")
+
+    progress.check('assembly')
+    keys = [chunk['key'] for chunk in chunks if chunk['key'] is not None]
+    check = quality_check(name, rules, date_str)
+    try:
+        result = stream_parquet(s3, S3_BUCKET, partition_key(name, date_str), arrow_schema(columns),
+                                check.watch(iter_staged_batches(keys)), layout)
+    except QualityError:
+        # The staged rows are rejected: a retry plans and extracts the table afresh
+        delete_staged(keys)
+        progress.update(plan=None, chunks=[])
+        raise
+    delete_staged(keys)
+    return result
+
+
+def delete_staged(keys):
+    """Delete staged chunk objects."""
+    if keys:
+        s3.delete_objects(Bucket=S3_BUCKET, Delete={'Objects': [{'Key': key} for key in keys]})
+
+
+def iter_staged_batches(keys):
+    """Yield the RecordBatches of staged chunk objects, in order."""
+    for key in keys:
+        with metrics.stage('read_previous'):
+            source = pq.ParquetFile(S3ObjectFile(s3, S3_BUCKET, key))
+        yield from source.iter_batches()
+
+
+_TENANTS_SQL = """
+    SELECT 
+        t.id::text as id,
+        t.name,
+        t.slug,
+        t.status::text as status,
+        t.plan,
+        t.timezone as region,
+        t.created_at,
+        COUNT(DISTINCT CASE WHEN u.user_type = 'Patient' THEN u.id END) as patient_count,
+        COUNT(DISTINCT CASE WHEN u.user_type != 'Patient' THEN u.id END) as staff_count,
+        COALESCE(SUM(CASE 
+            WHEN t.plan = 'starter' THEN 99
+            WHEN t.plan = 'professional' THEN 299
+            WHEN t.plan = 'enterprise' THEN 599
+            ELSE 0
+        END), 0) as mrr
+    FROM tenants t
+    LEFT JOIN users u ON u.tenant_id = t.id AND {user_live}
+    WHERE {tenant_live} {tenant_filter}
+    GROUP BY t.id, t.name, t.slug, t.status, t.plan, t.timezone, t.created_at
+"""
+
+# Liveness predicates for "now" and for a point-in-time reconstruction at %(as_of)s
+LIVE_NOW = {
+    'tenant_live': 't.deleted_at IS NULL',
+    'user_live': 'u.deleted_at IS NULL',
+    'age': 'AGE(u.date_of_birth)',
+    'completed': "pi.status = 'Completed'",
+}
+LIVE_AS_OF = {
+    'tenant_live': 't.created_at < %(as_of)s AND (t.deleted_at IS NULL OR t.deleted_at >= %(as_of)s)',
+    'user_live': 'u.created_at < %(as_of)s AND (u.deleted_at IS NULL OR u.deleted_at >= %(as_of)s)',
+    'age': 'AGE(%(as_of)s, u.date_of_birth)',
+    'completed': 'pi.completed_at < %(as_of)s',
+}
+
+TENANTS_QUERY = _TENANTS_SQL.format(tenant_filter='', **LIVE_NOW)
+TENANTS_INCREMENTAL_QUERY = _TENANTS_SQL.format(tenant_filter='AND t.id = ANY(%(tenant_ids)s::uuid[])', **LIVE_NOW)
+TENANTS_AS_OF_QUERY = _TENANTS_SQL.format(tenant_filter='', **LIVE_AS_OF)
+
+# Tenants whose own row or any of whose users changed since the watermark
+TENANTS_CHANGED_QUERY = """
+    SELECT id::text FROM tenants
+    WHERE updated_at > %(since)s OR deleted_at > %(since)s
+    UNION
+    SELECT DISTINCT tenant_id::text FROM users
+    WHERE updated_at > %(since)s OR deleted_at > %(since)s
+"""
+
+TENANTS_COLUMNS = (
+    ('id', 'string'),
+    ('name', 'string'),
+    ('slug', 'string'),
+    ('status', 'string'),
+    ('plan', 'string'),
+    ('region', 'string'),
+    ('created_at', 'timestamp[us]'),
+    ('patient_count', 'int64'),
+    ('staff_count', 'int64'),
+    ('mrr', 'int64'),
+)
+
+
+# Values substituted for NULLs (and empty strings) when tenant rows become columns
+TENANTS_DEFAULTS = {
+    'region': 'Australia/Sydney',
+    'patient_count': 0,
+    'staff_count': 0,
+    'mrr': 0,
+}
+
+# Sorted by id in small row groups so lookups of one tenant touch one of them
+TENANTS_LAYOUT = ParquetLayout(
+    sort_by=('id',),
+    dictionary_columns=('status', 'plan', 'region'),
+    statistics_columns=('id', 'status', 'plan', 'region', 'created_at'),
+    row_group_size=16384,
+)
+
+TENANTS_QUALITY = QualityRules(
+    unique=('id',),
+    not_null=('id', 'name', 'slug', 'status', 'created_at'),
+    ranges={'patient_count': (0, None), 'staff_count': (0, None), 'mrr': (0, None)},
+)
+
+TENANTS_BY_PLAN_COLUMNS = (
+    ('plan', 'string'),
+    ('tenants', 'int64'),
+    ('patient_count', 'int64'),
+    ('staff_count', 'int64'),
+    ('mrr', 'int64'),
+    ('as_of', 'string'),
+)
+
+# Tenant counts and MRR per plan in each month's latest snapshot (as_of)
+TENANTS_BY_PLAN = Rollup(
+    'tenants_by_plan', 'tenants', TENANTS_BY_PLAN_COLUMNS, ParquetLayout(sort_by=('plan',)),
+    keys=('plan',), sums=('patient_count', 'staff_count', 'mrr'), count='tenants', snapshot='as_of',
+)
+
+
+def export_tenants(conn, date_str, streaming=False, watermark=None, as_of=None, progress=None):
+    """Export tenant metrics.
+
+    When a watermark entry is passed, only tenants changed since its
+    high-water mark are re-extracted and merged into the previous snapshot;
+    the entry is updated in place for the caller to persist on success.
+    Passing as_of instead rebuilds the snapshot as it stood at that time.
+    A full export with a TableProgress runs in resumable chunks.
+    """
+    s3_key = partition_key('tenants', date_str)
+    query, params, live = TENANTS_QUERY, None, LIVE_NOW
+    if as_of is not None:
+        query, params, live = TENANTS_AS_OF_QUERY, {'as_of': as_of}, LIVE_AS_OF
+    
+    if watermark is not None and as_of is None:
+        since = get_high_water(watermark)
+        previous_key = watermark.get('partition')
+        previous = read_partition(previous_key) if since else None
+        watermark.update(high_water=db_high_water(conn).isoformat(), partition=s3_key)
+        if previous is not None:
+            return export_tenants_incremental(conn, since, previous, previous_key, date_str)
+    
+    if progress is not None:
+        return export_chunks(
+            'tenants', date_str, progress, lambda shard: _TENANTS_SQL.format(tenant_filter=shard.predicate('t.id'), **live),
+            params, TENANTS_COLUMNS, TENANTS_DEFAULTS, TENANTS_LAYOUT, TENANTS_QUALITY, ('patient_count', 'staff_count'),
+        )
+    if SHARDED_EXPORT:
+        batches = iter_sharded_batches(
+            'tenants', date_str, lambda shard: _TENANTS_SQL.format(tenant_filter=shard.predicate('t.id'), **live),
+            params, TENANTS_COLUMNS, TENANTS_DEFAULTS, TENANTS_LAYOUT, ('patient_count', 'staff_count'),
+        )
+        if streaming:
+            check = quality_check('tenants', TENANTS_QUALITY, date_str)
+            return stream_parquet(s3, S3_BUCKET, s3_key, arrow_schema(TENANTS_COLUMNS), check.watch(batches),
+                                  TENANTS_LAYOUT)
+        table = pa.Table.from_batches(list(batches), schema=arrow_schema(TENANTS_COLUMNS))
+    elif streaming:
+        return stream_parquet_to_s3(conn, query, params, TENANTS_COLUMNS, TENANTS_DEFAULTS, s3_key, TENANTS_LAYOUT,
+                                    check=quality_check('tenants', TENANTS_QUALITY, date_str))
+    else:
+        table = read_table(conn, query, params, TENANTS_COLUMNS, TENANTS_DEFAULTS)
     
-    if not rows:
+    if not table.num_rows:
         print("No tenants to export")
-        return
+        return 0, current_rss_mb()
     
-    data = {
-        'id': [r[0] for r in rows],
-        'name': [r[1] for r in rows],
-        'slug': [r[2] for r in rows],
-        'status': [r[3] for r in rows],
-        'plan': [r[4] for r in rows],
-        'region': [r[5] or 'Australia/Sydney' for r in rows],
-        'created_at': [r[6] for r in rows],
-        'patient_count': [r[7] or 0 for r in rows],
-        'staff_count': [r[8] or 0 for r in rows],
-        'mrr': [r[9] or 0 for r in rows],
-    }
+    table = TENANTS_LAYOUT.sort(table)
+    validate_table('tenants', table, TENANTS_QUALITY, date_str)
+    write_snapshot_to_s3('tenants', table, date_str, TENANTS_LAYOUT)
+    return table.num_rows, current_rss_mb()
+
+
+def export_tenants_incremental(conn, since, previous, previous_key, date_str):
+    """Merge tenants changed since the last run into the previous snapshot."""
+    s3_key = partition_key('tenants', date_str)
+    with conn.cursor() as cur:
+        cur.execute(TENANTS_CHANGED_QUERY, {'since': since})
+        changed_ids = [r[0] for r in cur.fetchall() if r[0]]
+    
+    print(f"{len(changed_ids)} tenants changed since {since.isoformat()}")
+    if not changed_ids:
+        carry_forward_partition(previous_key, s3_key)
+        return previous.num_rows, current_rss_mb()
     
-    schema = pa.schema([
-        ('id', pa.string()),
-        ('name', pa.string()),
-        ('slug', pa.string()),
-        ('status', pa.string()),
-        ('plan', pa.string()),
-        ('region', pa.string()),
-        ('created_at', pa.timestamp('us')),
-        ('patient_count', pa.int64()),
-        ('staff_count', pa.int64()),
-        ('mrr', pa.int64()),
-    ])
-    
-    write_parquet_to_s3(data, schema, f'curated/tenants/dt={date_str}/data.parquet')
-
-
-def export_usage(conn, date_str):
-    """Export daily usage metrics per tenant."""
-    yesterday = (datetime.utcnow() - timedelta(days=1)).date()
-    
-    query = """
-        SELECT 
-            t.id::text as tenant_id,
-            %s::date as date,
-            COUNT(DISTINCT a.id) as appointments,
-            COUNT(DISTINCT CASE WHEN a.status = 'Completed' THEN a.id END) as completed_appointments,
-            COUNT(DISTINCT m.id) as messages,
-            0 as documents
-        FROM tenants t
-        LEFT JOIN appointments a ON a.tenant_id = t.id 
-            AND a.scheduled_start::date = %s
-        LEFT JOIN messages m ON m.tenant_id = t.id 
-            AND m.created_at::date = %s
-        WHERE t.deleted_at IS NULL
-        GROUP BY t.id
+    fresh = read_table(conn, TENANTS_INCREMENTAL_QUERY, {'tenant_ids': changed_ids},
+                       TENANTS_COLUMNS, TENANTS_DEFAULTS)
+    table = merge_changes(previous, fresh, ['id'], [(i,) for i in changed_ids])
+    table = TENANTS_LAYOUT.sort(table)
+    validate_table('tenants', table, TENANTS_QUALITY, date_str)
+    write_snapshot_to_s3('tenants', table, date_str, TENANTS_LAYOUT)
+    return table.num_rows, current_rss_mb()
+
+
+# Each source is aggregated on its own over a sargable [day_start, day_end) range
+# before joining to tenants, so appointments x messages x documents never fan out
+_USAGE_SQL = """
+    WITH per_source AS (
+        SELECT tenant_id,
+               COUNT(*) as appointments,
+               COUNT(*) FILTER (WHERE status = 'Completed') as completed_appointments,
+               0 as messages, 0 as documents
+        FROM appointments
+        WHERE scheduled_start >= %(day_start)s AND scheduled_start < %(day_end)s{source_filter}
+        GROUP BY tenant_id
+        UNION ALL
+        SELECT tenant_id, 0, 0, COUNT(*), 0
+        FROM messages
+        WHERE created_at >= %(day_start)s AND created_at < %(day_end)s{source_filter}
+        GROUP BY tenant_id
+        UNION ALL
+        SELECT tenant_id, 0, 0, 0, COUNT(*)
+        FROM documents
+        WHERE created_at >= %(day_start)s AND created_at < %(day_end)s{source_filter}
+        GROUP BY tenant_id
+    )
+    SELECT 
+        t.id::text as tenant_id,
+        %(day_start)s::date as date,
+        COALESCE(SUM(s.appointments), 0)::bigint as appointments,
+        COALESCE(SUM(s.completed_appointments), 0)::bigint as completed_appointments,
+        COALESCE(SUM(s.messages), 0)::bigint as messages,
+        COALESCE(SUM(s.documents), 0)::bigint as documents
+    FROM tenants t
+    LEFT JOIN per_source s ON s.tenant_id = t.id
+    WHERE t.deleted_at IS NULL{tenant_filter}
+    GROUP BY t.id
+"""
+
+USAGE_QUERY = _USAGE_SQL.format(source_filter='', tenant_filter='')
+
+
+def usage_shard_query(shard):
+    """USAGE_QUERY for one tenant shard, restricting every source to its tenants."""
+    return _USAGE_SQL.format(source_filter=shard.predicate('tenant_id'), tenant_filter=shard.predicate('t.id'))
+
+USAGE_COLUMNS = (
+    ('tenant_id', 'string'),
+    ('date', 'date32'),
+    ('appointments', 'int64'),
+    ('completed_appointments', 'int64'),
+    ('messages', 'int64'),
+    ('documents', 'int64'),
+)
+
+
+USAGE_DEFAULTS = {
+    'appointments': 0,
+    'completed_appointments': 0,
+    'messages': 0,
+    'documents': 0,
+}
+
+USAGE_LAYOUT = ParquetLayout(
+    sort_by=('tenant_id',),
+    dictionary_columns=('date',),
+    statistics_columns=('tenant_id', 'date'),
+    row_group_size=16384,
+)
+
+# A day with no appointments, messages or documents anywhere usually means a
+# broken source rather than a quiet day, but is not blocked
+USAGE_QUALITY = QualityRules(
+    unique=('tenant_id',),
+    not_null=('tenant_id', 'date'),
+    ranges={name: (0, None) for name in ('appointments', 'completed_appointments', 'messages', 'documents')},
+    nonzero=('appointments', 'messages', 'documents'),
+)
+
+USAGE_BY_MONTH_COLUMNS = (
+    ('tenant_id', 'string'),
+    ('appointments', 'int64'),
+    ('completed_appointments', 'int64'),
+    ('messages', 'int64'),
+    ('documents', 'int64'),
+    ('days', 'int64'),
+)
+
+# Each tenant's usage per calendar month; days counts the days merged for it
+USAGE_BY_MONTH = Rollup(
+    'usage_by_month', 'usage', USAGE_BY_MONTH_COLUMNS,
+    ParquetLayout(sort_by=('tenant_id',), statistics_columns=('tenant_id',)),
+    keys=('tenant_id',), sums=('appointments', 'completed_appointments', 'messages', 'documents'), count='days',
+    month_of=previous_day_month,
+)
+
+
+def export_usage(conn, date_str, streaming=False, watermark=None, progress=None):
+    """Export daily usage metrics per tenant.
+
+    The dt=<date_str> partition holds the usage of the day before, so past
+    partitions can be regenerated exactly. Usage is already a one-day delta,
+    so the watermark only records the last day captured. With a
+    TableProgress the export runs in resumable chunks.
     """
+    yesterday = (datetime.strptime(date_str, '%Y-%m-%d') - timedelta(days=1)).date()
+    params = {'day_start': yesterday, 'day_end': yesterday + timedelta(days=1)}
+    s3_key = partition_key('usage', date_str)
     
-    with conn.cursor() as cur:
-        cur.execute(query, (yesterday, yesterday, yesterday))
-        rows = cur.fetchall()
+    if watermark is not None:
+        watermark.update(high_water=datetime.combine(yesterday, datetime.max.time()).isoformat(), partition=s3_key)
     
-    if not rows:
-        print("No usage data to export")
-        return
+    if progress is not None:
+        return export_chunks('usage', date_str, progress, usage_shard_query, params, USAGE_COLUMNS, USAGE_DEFAULTS,
+                             USAGE_LAYOUT, USAGE_QUALITY, ('appointments', 'messages', 'documents'))
+    if SHARDED_EXPORT:
+        batches = iter_sharded_batches('usage', date_str, usage_shard_query, params, USAGE_COLUMNS,
+                                       USAGE_DEFAULTS, USAGE_LAYOUT, ('appointments', 'messages', 'documents'))
+        if streaming:
+            check = quality_check('usage', USAGE_QUALITY, date_str)
+            return stream_parquet(s3, S3_BUCKET, s3_key, arrow_schema(USAGE_COLUMNS), check.watch(batches),
+                                  USAGE_LAYOUT)
+        table = pa.Table.from_batches(list(batches), schema=arrow_schema(USAGE_COLUMNS))
+    elif streaming:
+        return stream_parquet_to_s3(conn, USAGE_QUERY, params, USAGE_COLUMNS, USAGE_DEFAULTS, s3_key, USAGE_LAYOUT,
+                                    check=quality_check('usage', USAGE_QUALITY, date_str))
+    else:
+        table = read_table(conn, USAGE_QUERY, params, USAGE_COLUMNS, USAGE_DEFAULTS)
     
-    data = {
-        'tenant_id': [r[0] for r in rows],
-        'date': [r[1] for r in rows],
-        'appointments': [r[2] or 0 for r in rows],
-        'completed_appointments': [r[3] or 0 for r in rows],
-        'messages': [r[4] or 0 for r in rows],
-        'documents': [r[5] or 0 for r in rows],
-    }
+    if not table.num_rows:
+        print("No usage data to export")
+        return 0, current_rss_mb()
     
-    schema = pa.schema([
-        ('tenant_id', pa.string()),
-        ('date', pa.date32()),
-        ('appointments', pa.int64()),
-        ('completed_appointments', pa.int64()),
-        ('messages', pa.int64()),
-        ('documents', pa.int64()),
-    ])
-    
-    write_parquet_to_s3(data, schema, f'curated/usage/dt={date_str}/data.parquet')
-
-
-def export_prom_outcomes(conn, date_str):
-    """Export anonymized PROM outcomes with k-anonymity (min 5 patients per group)."""
-    query = """
-        WITH prom_data AS (
-            SELECT 
-                t.timezone as region,
-                pt.name as prom_type,
-                CASE 
-                    WHEN EXTRACT(YEAR FROM AGE(u.date_of_birth)) < 30 THEN '18-29'
-                    WHEN EXTRACT(YEAR FROM AGE(u.date_of_birth)) < 45 THEN '30-44'
-                    WHEN EXTRACT(YEAR FROM AGE(u.date_of_birth)) < 60 THEN '45-59'
-                    ELSE '60+'
-                END as age_bracket,
-                COALESCE(u.gender, 'Unknown') as gender,
-                pi.baseline_score,
-                pi.current_score as final_score
-            FROM prom_instances pi
-            JOIN prom_templates pt ON pt.id = pi.template_id
-            JOIN users u ON u.id = pi.patient_id
-            JOIN tenants t ON t.id = u.tenant_id
-            WHERE pi.status = 'Completed'
-              AND pi.baseline_score IS NOT NULL
-              AND pi.current_score IS NOT NULL
-              AND t.deleted_at IS NULL
-        )
-        SELECT 
-            region,
-            prom_type,
-            age_bracket,
-            gender,
-            AVG(baseline_score) as avg_baseline,
-            AVG(final_score) as avg_final,
-            COUNT(*) as patient_count
-        FROM prom_data
-        GROUP BY region, prom_type, age_bracket, gender
-        HAVING COUNT(*) >= 5  -- K-anonymity threshold
+    table = USAGE_LAYOUT.sort(table)
+    validate_table('usage', table, USAGE_QUALITY, date_str)
+    write_table_to_s3(table, s3_key, USAGE_LAYOUT)
+    return table.num_rows, current_rss_mb()
+
+
+# One de-identified row per completed PROM; cohorts are aggregated from it in memory
+_PROM_ROWS_SQL = """
+    SELECT 
+        COALESCE(t.timezone, 'Unknown') as region,
+        pt.name as prom_type,
+        EXTRACT(YEAR FROM {age})::int as age,
+        COALESCE(u.gender, 'Unknown') as gender,
+        pi.baseline_score,
+        pi.current_score as final_score,
+        pi.completed_at::date as completed_on
+    FROM prom_instances pi
+    JOIN prom_templates pt ON pt.id = pi.template_id
+    JOIN users u ON u.id = pi.patient_id
+    JOIN tenants t ON t.id = u.tenant_id
+    WHERE {completed}
+      AND pi.baseline_score IS NOT NULL
+      AND pi.current_score IS NOT NULL
+      AND {tenant_live} {cohort_filter}
+"""
+
+PROM_ROWS_QUERY = _PROM_ROWS_SQL.format(cohort_filter='', **LIVE_NOW)
+PROM_ROWS_INCREMENTAL_QUERY = _PROM_ROWS_SQL.format(cohort_filter="""
+      AND (COALESCE(t.timezone, 'Unknown'), pt.name) IN (
+          SELECT * FROM unnest(%(regions)s::text[], %(prom_types)s::text[])
+      )""", **LIVE_NOW)
+PROM_ROWS_AS_OF_QUERY = _PROM_ROWS_SQL.format(cohort_filter='', **LIVE_AS_OF)
+
+PROM_ROWS_COLUMNS = (
+    ('region', 'string'),
+    ('prom_type', 'string'),
+    ('age', 'int32'),
+    ('gender', 'string'),
+    ('baseline_score', 'float64'),
+    ('final_score', 'float64'),
+    ('completed_on', 'date32'),
+)
+
+PROM_OUTCOMES_COLUMNS = (
+    ('region', 'string'),
+    ('prom_type', 'string'),
+    ('age_bracket', 'string'),
+    ('gender', 'string'),
+    ('avg_baseline', 'float64'),
+    ('avg_final', 'float64'),
+    ('patient_count', 'int64'),
+)
+
+# K-anonymity: cohorts of fewer than 5 PROMs are not published
+PROM_OUTCOMES_COHORT = CohortDefinition('prom_outcomes', PROM_OUTCOMES_COLUMNS, k=5, age_edges=(18, 30, 45, 60))
+
+PROM_OUTCOMES_BY_REGION_COLUMNS = (
+    ('region', 'string'),
+    ('prom_type', 'string'),
+    ('avg_baseline', 'float64'),
+    ('avg_final', 'float64'),
+    ('patient_count', 'int64'),
+)
+
+# PROMs completed per month, region and type; k is applied to whole months
+PROM_OUTCOMES_BY_REGION_COHORT = CohortDefinition('prom_outcomes_by_region', PROM_OUTCOMES_BY_REGION_COLUMNS,
+                                                  k=PROM_OUTCOMES_COHORT.k)
+
+# (region, prom_type) cohorts touched by PROM instances or patients changed since
+# the watermark, including patients whose birthday moved them to another bracket,
+# and every cohort with PROMs completed on the day the partition covers (the
+# day the prom_outcomes_by_region rollup merges, see stage_completed_proms)
+PROM_CHANGED_COHORTS_QUERY = """
+    SELECT DISTINCT COALESCE(t.timezone, 'Unknown') as region, pt.name as prom_type
+    FROM prom_instances pi
+    JOIN prom_templates pt ON pt.id = pi.template_id
+    JOIN users u ON u.id = pi.patient_id
+    JOIN tenants t ON t.id = u.tenant_id
+    WHERE pi.id IN (
+        SELECT id FROM prom_instances WHERE updated_at > %(since)s
+        UNION
+        SELECT id FROM prom_instances WHERE completed_at >= %(day_start)s AND completed_at < %(day_end)s
+        UNION
+        SELECT p.id FROM prom_instances p
+        JOIN users pu ON pu.id = p.patient_id
+        WHERE pu.updated_at > %(since)s{birthdays}
+    )
+""".format(birthdays=''.join(f"""
+           OR (pu.date_of_birth > (%(since)s - interval '{edge} years')::date
+               AND pu.date_of_birth <= (now() - interval '{edge} years')::date)"""
+                             for edge in PROM_OUTCOMES_COHORT.age_edges[1:]))
+
+# Tenant or template changes can move whole cohorts to keys we can no longer see
+PROM_REQUIRES_FULL_REFRESH_QUERY = """
+    SELECT EXISTS (SELECT 1 FROM tenants WHERE updated_at > %(since)s OR deleted_at > %(since)s)
+        OR EXISTS (SELECT 1 FROM prom_templates WHERE updated_at > %(since)s)
+"""
+
+# Every cohort key is low-cardinality; sorted in filter order (region first)
+PROM_OUTCOMES_LAYOUT = ParquetLayout(
+    sort_by=('region', 'prom_type', 'age_bracket', 'gender'),
+    dictionary_columns=('region', 'prom_type', 'age_bracket', 'gender'),
+    statistics_columns=('region', 'prom_type', 'age_bracket', 'gender'),
+)
+
+# A published cohort below k would re-identify patients, so it blocks publication
+PROM_OUTCOMES_QUALITY = QualityRules(
+    unique=PROM_OUTCOMES_LAYOUT.sort_by,
+    not_null=('region', 'prom_type', 'age_bracket', 'gender', 'patient_count'),
+    ranges={'patient_count': (PROM_OUTCOMES_COHORT.k, None)},
+)
+
+# Merged from the unsuppressed partials exporters stage; k is applied per month
+PROM_OUTCOMES_BY_REGION = Rollup(
+    'prom_outcomes_by_region', 'prom_outcomes', PROM_OUTCOMES_BY_REGION_COLUMNS,
+    ParquetLayout(sort_by=('region', 'prom_type'), dictionary_columns=('region', 'prom_type')),
+    cohort=PROM_OUTCOMES_BY_REGION_COHORT, month_of=previous_day_month,
+)
+
+
+def aggregate_prom_outcomes(conn, query, params, streaming=False, completed_on=None):
+    """Aggregate the PROM rows a query returns into the prom_outcomes cohorts.
+
+    Streaming reads the rows in STREAMING_BATCH_SIZE batches and folds each
+    into the running aggregates, so only the cohorts are held in memory.
+    The PROMs among them completed on completed_on (a date) are also
+    aggregated, unsuppressed, by PROM_OUTCOMES_BY_REGION_COHORT. Returns
+    the cohorts and those partial aggregates (None if there were none).
+    """
+    schema = arrow_schema(PROM_ROWS_COLUMNS)
+    if streaming:
+        batches = iter_export_batches(conn, query, params, schema, None, STREAMING_BATCH_SIZE, 'export_prom_rows')
+    else:
+        batches = [read_table(conn, query, params, PROM_ROWS_COLUMNS, None)]
+    aggregator = CohortAggregator([PROM_OUTCOMES_COHORT])
+    completed = CohortAggregator([PROM_OUTCOMES_BY_REGION_COHORT])
+    for batch in batches:
+        with metrics.stage('aggregate'):
+            aggregator.add(batch)
+            if completed_on is not None:
+                completed.add(batch.filter(pc.equal(batch['completed_on'], pa.scalar(completed_on, pa.date32()))))
+    with metrics.stage('aggregate'):
+        table = aggregator.results()[PROM_OUTCOMES_COHORT.name]
+        partials = completed.totals()[PROM_OUTCOMES_BY_REGION_COHORT.name]
+    print(f"Aggregated {aggregator.rows} PROMs into {table.num_rows} cohorts")
+    return table, partials if partials is not None and partials.num_rows else None
+
+
+def stage_completed_proms(date_str, partials):
+    """Stage the partials of PROMs completed on a partition's day for its rollup."""
+    if partials is not None:
+        stage_input(s3, S3_BUCKET, PROM_OUTCOMES_BY_REGION, date_str, partials)
+
+
+def export_prom_outcomes(conn, date_str, streaming=False, watermark=None, as_of=None):
+    """Export anonymized PROM outcomes with k-anonymity (see PROM_OUTCOMES_COHORT).
+
+    With a watermark entry, only the (region, prom_type) cohorts touched since
+    the last run are re-aggregated and merged into the previous partition. A
+    full recompute still happens every PROM_FULL_REFRESH_DAYS days, or when a
+    tenant or template changed, because those can move rows between cohorts.
+    Passing as_of instead rebuilds the cohorts from PROMs completed before it.
+    Like usage, the partition's day is the day before date_str: PROMs
+    completed then are staged for the prom_outcomes_by_region rollup.
     """
+    s3_key = partition_key('prom_outcomes', date_str)
+    yesterday = (datetime.strptime(date_str, '%Y-%m-%d') - timedelta(days=1)).date()
+    query, params = PROM_ROWS_QUERY, None
+    if as_of is not None:
+        query, params = PROM_ROWS_AS_OF_QUERY, {'as_of': as_of}
     
-    with conn.cursor() as cur:
-        cur.execute(query)
-        rows = cur.fetchall()
+    if watermark is not None and as_of is None:
+        since = get_high_water(watermark)
+        previous_key = watermark.get('partition')
+        last_full = watermark.get('full_refresh_at')
+        high_water = db_high_water(conn)
+        previous = None
+        if since and last_full and high_water - datetime.fromisoformat(last_full) < timedelta(days=PROM_FULL_REFRESH_DAYS):
+            with conn.cursor() as cur:
+                cur.execute(PROM_REQUIRES_FULL_REFRESH_QUERY, {'since': since})
+                if not cur.fetchone()[0]:
+                    previous = read_partition(previous_key)
+        watermark.update(high_water=high_water.isoformat(), partition=s3_key)
+        if previous is not None:
+            return export_prom_outcomes_incremental(conn, since, previous, previous_key, date_str)
+        watermark['full_refresh_at'] = high_water.isoformat()
+    
+    table, completed = aggregate_prom_outcomes(conn, query, params, streaming, yesterday)
+    stage_completed_proms(date_str, completed)
     
-    if not rows:
+    if not table.num_rows:
         print("No PROM outcomes to export (or none meet k-anonymity threshold)")
-        return
+        return 0, current_rss_mb()
     
-    data = {
-        'region': [r[0] or 'Unknown' for r in rows],
-        'prom_type': [r[1] for r in rows],
-        'age_bracket': [r[2] for r in rows],
-        'gender': [r[3] for r in rows],
-        'avg_baseline': [float(r[4]) if r[4] else 0.0 for r in rows],
-        'avg_final': [float(r[5]) if r[5] else 0.0 for r in rows],
-        'patient_count': [r[6] for r in rows],
-    }
+    table = PROM_OUTCOMES_LAYOUT.sort(table)
+    validate_table('prom_outcomes', table, PROM_OUTCOMES_QUALITY, date_str)
+    write_snapshot_to_s3('prom_outcomes', table, date_str, PROM_OUTCOMES_LAYOUT)
+    return table.num_rows, current_rss_mb()
+
+
+def export_prom_outcomes_incremental(conn, since, previous, previous_key, date_str):
+    """Re-aggregate cohorts changed since the last run and merge them in."""
+    s3_key = partition_key('prom_outcomes', date_str)
+    yesterday = (datetime.strptime(date_str, '%Y-%m-%d') - timedelta(days=1)).date()
+    with conn.cursor() as cur:
+        cur.execute(PROM_CHANGED_COHORTS_QUERY,
+                    {'since': since, 'day_start': yesterday, 'day_end': yesterday + timedelta(days=1)})
+        cohorts = cur.fetchall()
     
-    schema = pa.schema([
-        ('region', pa.string()),
-        ('prom_type', pa.string()),
-        ('age_bracket', pa.string()),
-        ('gender', pa.string()),
-        ('avg_baseline', pa.float64()),
-        ('avg_final', pa.float64()),
-        ('patient_count', pa.int64()),
-    ])
+    print(f"{len(cohorts)} PROM cohorts changed since {since.isoformat()}")
+    if not cohorts:
+        carry_forward_partition(previous_key, s3_key)
+        return previous.num_rows, current_rss_mb()
     
-    write_parquet_to_s3(data, schema, f'curated/prom_outcomes/dt={date_str}/data.parquet')
+    fresh, completed = aggregate_prom_outcomes(conn, PROM_ROWS_INCREMENTAL_QUERY, {
+        'regions': [c[0] for c in cohorts],
+        'prom_types': [c[1] for c in cohorts],
+    }, completed_on=yesterday)
+    stage_completed_proms(date_str, completed)
+    table = merge_changes(previous, fresh, ['region', 'prom_type'], cohorts)
+    table = PROM_OUTCOMES_LAYOUT.sort(table)
+    validate_table('prom_outcomes', table, PROM_OUTCOMES_QUALITY, date_str)
+    write_snapshot_to_s3('prom_outcomes', table, date_str, PROM_OUTCOMES_LAYOUT)
+    return table.num_rows, current_rss_mb()
+
+
+EXPORTERS = {
+    'tenants': export_tenants,
+    'usage': export_usage,
+    'prom_outcomes': export_prom_outcomes,
+}
+
+# Exporters that take a TableProgress and run in resumable chunks; the
+# others run whole within one invocation
+CHUNKED_EXPORTERS = ('tenants', 'usage')
+
+# Monthly rollups, each merged once its table's export succeeds
+ROLLUPS = (TENANTS_BY_PLAN, USAGE_BY_MONTH, PROM_OUTCOMES_BY_REGION)
+
+
+def run_export(pool, table, date_str, streaming, watermark=None, table_metrics=None, progress=None):
+    """Run one exporter on a pooled connection and report its outcome.
+
+    The written partition is registered with Glue and the table's manifest;
+    if that fails, or the partition fails its quality rules, the export
+    counts as failed, so its watermark is not advanced and the next run
+    publishes it again. Stage timings and
+    counters go to table_metrics when one is passed.
+
+    With a TableProgress, the export is 'paused' rather than failed when
+    the invocation runs out of time. The watermark entry as the export
+    first updated it is kept in the checkpoint, and the resumed export is
+    not given it again, so every chunk captures changes up to the same
+    high-water mark.
+    """
+    started = time.monotonic()
+    conn = None
+    failed = False
+    exporting = False
+    resumed = progress is not None and progress.get('watermark') is not None
+    try:
+        print(f"Exporting {table}...")
+        with metrics.recording(table_metrics):
+            if progress is not None:
+                progress.check('export')
+            with metrics.stage('connect'):
+                conn = pool.acquire()
+            kwargs = {'progress': progress} if progress is not None and table in CHUNKED_EXPORTERS else {}
+            exporting = True
+            rows, rss_mb = EXPORTERS[table](conn, date_str, streaming, None if resumed else watermark, **kwargs)
+            if rows:
+                with metrics.stage('register'):
+                    register_partitions(table, [(date_str, rows)])
+        conn.commit()
+        result = {
+            'status': 'succeeded',
+            'rows': rows,
+            'seconds': round(time.monotonic() - started, 2),
+            'rss_mb': round(rss_mb, 1),
+        }
+        if table_metrics is not None:
+            result.update(saved_bytes=table_metrics.saved_bytes,
+                          saved_seconds=round(table_metrics.saved_seconds, 3),
+                          quality_warnings=table_metrics.quality_warnings)
+        return result
+    except OutOfTime as e:
+        print(f"Export of {table} paused: {e}")
+        if conn is not None:
+            conn.rollback()
+        if exporting and not resumed:
+            progress.update(watermark=watermark)
+        return {
+            'status': 'paused',
+            'reason': str(e),
+            'seconds': round(time.monotonic() - started, 2),
+        }
+    except Exception as e:
+        failed = True
+        print(f"Export of {table} failed: {str(e)}")
+        return {
+            'status': 'failed',
+            'error': str(e),
+            'seconds': round(time.monotonic() - started, 2),
+        }
+    finally:
+        # Broken connections are discarded rather than kept for the next run
+        if conn is not None:
+            pool.release(conn, discard=failed)
+
+
+# Cleared by the first invocation in this container
+_cold_start = True
+
+
+class ExportFailed(Exception):
+    """A run finished with failed tables or rollups.
+
+    Raised rather than returned as a status code, so Lambda counts the
+    invocation in Errors and retries the nightly (asynchronous) event.
+    """
 
 
 def handler(event, context):
     """Lambda handler - runs nightly ETL."""
+    global _cold_start
+    cold, _cold_start = _cold_start, False
     print(f"Starting ETL at {datetime.utcnow().isoformat()}")
     
+    event = event or {}
     date_str = datetime.utcnow().strftime('%Y-%m-%d')
+    streaming = bool(event.get('streaming', STREAMING_EXPORT))
+    concurrency = max(1, min(int(event.get('concurrency', EXPORT_CONCURRENCY)), len(EXPORTERS)))
+    incremental = bool(event.get('incremental', INCREMENTAL_EXPORT))
+    sink = event.get('sink', OUTPUT_SINK)
+    checkpointed = bool(event.get('checkpointed', CHECKPOINTED_EXPORT))
+    rollups = bool(event.get('rollups', UPDATE_ROLLUPS))
+    cache_before = cache_stats()
+    run_metrics = metrics.RunMetrics()
     
     try:
-        conn = get_db_connection()
-        
-        print("Exporting tenants...")
-        export_tenants(conn, date_str)
-        
-        print("Exporting usage...")
-        export_usage(conn, date_str)
-        
-        print("Exporting PROM outcomes...")
-        export_prom_outcomes(conn, date_str)
-        
-        conn.close()
-        
-        print(f"ETL completed successfully at {datetime.utcnow().isoformat()}")
-        return {'statusCode': 200, 'body': 'ETL completed'}
-        
+        use_sink(sink)
+        checkpoint = None
+        if checkpointed:
+            # One run per partition date; continuations name it in 'resume'
+            checkpoint = RunCheckpoint.open(s3, S3_BUCKET, event.get('resume', date_str), date_str, list(EXPORTERS))
+            date_str = checkpoint.date_str
+        state = load_state(s3, S3_BUCKET) if incremental else {}
+        pool = get_connection_pool(concurrency)
     except Exception as e:
         print(f"ETL failed: {str(e)}")
         raise
+    
+    tables = checkpoint.pending() if checkpoint else list(EXPORTERS)
+    deadline = Deadline(context)
+    progress = {table: TableProgress(checkpoint, table, deadline) if checkpoint else None for table in tables}
+    # Each exporter updates its own copy; only successful ones are persisted.
+    # A resumed export keeps the entry it started with (see run_export)
+    watermarks = {}
+    for table in tables:
+        kept = progress[table].get('watermark') if progress[table] else None
+        watermarks[table] = kept if kept is not None else (dict(state.get(table, {})) if incremental else None)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            table: executor.submit(
+                run_export, pool, table, date_str, streaming, watermarks[table], run_metrics.table(table),
+                progress[table],
+            )
+            for table in tables
+        }
+        exports = {table: future.result() for table, future in futures.items()}
+    
+    succeeded = [table for table, result in exports.items() if result['status'] == 'succeeded']
+    if incremental:
+        state.update({table: watermarks[table] for table in succeeded})
+        save_state(s3, S3_BUCKET, state)
+    
+    continuation = None
+    if checkpoint is not None:
+        exhausted = checkpoint.invocations >= CHECKPOINT_MAX_INVOCATIONS
+        for table, result in exports.items():
+            if result['status'] == 'paused' and exhausted:
+                result = {**result, 'status': 'failed',
+                          'error': f"Unfinished after {checkpoint.invocations} invocations"}
+            checkpoint.update(table, status=result['status'], result=result)
+        if checkpoint.pending():
+            continuation = continue_run(lambda_client, context, {**event, 'resume': checkpoint.run_id})
+        else:
+            checkpoint.finish(failed=any(entry['status'] == 'failed' for entry in checkpoint.tables.values()))
+        # The whole run's outcome, including tables earlier invocations finished
+        exports = {table: checkpoint.tables[table].get('result', {'status': checkpoint.tables[table]['status']})
+                   for table in EXPORTERS}
+    
+    # Once the run is over; merging a day that is already merged changes nothing
+    merged = None
+    if rollups and continuation is None:
+        exported = [table for table, result in exports.items() if result['status'] == 'succeeded']
+        merged = update_rollups(s3, S3_BUCKET, partition_catalog, [r for r in ROLLUPS if r.table in exported],
+                                date_str, run_metrics)
+    
+    failed = [table for table, result in exports.items() if result['status'] == 'failed']
+    failed += [f'rollup/{name}' for name, result in (merged or {}).items() if result['status'] == 'failed']
+    if continuation is not None:
+        paused = [table for table, result in exports.items() if result['status'] == 'paused']
+        print(f"ETL paused ({', '.join(paused)}) after invocation {checkpoint.invocations} "
+              f"at {datetime.utcnow().isoformat()}")
+    elif failed:
+        print(f"ETL finished with failures ({', '.join(failed)}) at {datetime.utcnow().isoformat()}")
+    else:
+        print(f"ETL completed successfully at {datetime.utcnow().isoformat()}")
+    
+    # One EMF line per run; CloudWatch Logs extracts the metrics from it
+    metrics_record = run_metrics.to_emf(
+        mode='streaming' if streaming else 'buffered',
+        ingest='copy' if COPY_INGEST else 'cursor',
+        sink=sink,
+        failed=failed,
+    )
+    print(json.dumps(metrics_record))
+    
+    response = {
+        # 202 while a continuation still has the run's remaining work
+        'statusCode': 202 if continuation is not None else 500 if failed else 200,
+        'body': json.dumps({
+            'mode': 'streaming' if streaming else 'buffered',
+            'incremental': incremental,
+            'sink': sink,
+            'run': checkpoint and {
+                'id': checkpoint.run_id,
+                'invocation': checkpoint.invocations,
+                'continuation': continuation,
+            },
+            'concurrency': concurrency,
+            'exports': exports,
+            'rollups': merged,
+            # Encoding and upload skipped for snapshots whose content was unchanged
+            'saved': {
+                'bytes': sum(r.get('saved_bytes', 0) for r in exports.values()),
+                'seconds': round(sum(r.get('saved_seconds', 0) for r in exports.values()), 3),
+            },
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'cache': stats_since(cache_before, cache_stats()),
+            # Import and client construction times, including those deferred into this run
+            'cold_start': coldstart.breakdown() if cold else None,
+            'metrics': metrics_record,
+        }),
+    }
+    if failed and continuation is None:
+        # Everything that succeeded is published and recorded by now; a retry
+        # redoes the rest (a checkpointed one only its failed tables)
+        print(response['body'])
+        raise ExportFailed(f"ETL failed: {', '.join(failed)}")
+    return response
+
+
+coldstart.record('module', 'handler', _import_started)
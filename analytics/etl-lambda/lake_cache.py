@@ -0,0 +1,209 @@
+"""
+Local file cache of curated lake objects for the analytics read service.
+Partitions a query needs are downloaded once to LAKE_CACHE_DIR (on Lambda,
+/tmp outlives the invocation along with the execution environment) and
+scanned from there through memory maps, so a warm dashboard query makes no
+S3 GETs at all. The cache holds at most LAKE_CACHE_MAX_MB: files are
+evicted least recently used first to make room for the next download.
+
+Every cached file carries a version, and one with a different version is
+fetched again. A partition's version is derived from its manifest entry
+(location, size, content hash and write time), so anything the nightly run
+rewrites in place (a backfilled day, a rollup month merged again) is
+refetched the first time a query sees the new entry; objects outside the
+manifests are versioned by ETag. Manifests themselves are re-read when
+their ETag changes, checked at most every LAKE_MANIFEST_TTL_SECONDS.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from catalog import load_manifest, manifest_key
+
+LAKE_CACHE_DIR = os.environ.get('LAKE_CACHE_DIR', '/tmp/qivr-lake-cache')
+# Lambda's /tmp is 512 MB unless more ephemeral storage is configured
+LAKE_CACHE_MAX_MB = int(os.environ.get('LAKE_CACHE_MAX_MB', '400'))
+# How stale a manifest may be before its ETag is checked again
+LAKE_MANIFEST_TTL_SECONDS = int(os.environ.get('LAKE_MANIFEST_TTL_SECONDS', '60'))
+
+_PARTIAL_SUFFIX = '.partial'
+_CHUNK_BYTES = 1024 * 1024
+
+
+def entry_version(entry):
+    """Version of a manifest entry's object: anything republishing it changes this."""
+    fields = (entry['key'], entry.get('bytes'), entry.get('content_hash'), entry.get('updated_at'))
+    return json.dumps(fields)
+
+
+def _digest(version):
+    return hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]
+
+
+def _missing(s3, error):
+    """Whether a head_object error means the object does not exist."""
+    if isinstance(error, s3.exceptions.NoSuchKey):
+        return True
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+class PartitionCache:
+    """Objects of one bucket as local files, bounded in total size, evicted LRU.
+
+    A file is stored at <root>/<key>.<version digest>, so the index is
+    rebuilt from what is on disk when a new process starts, and nothing
+    stale is trusted: a different version never matches the digest. Files
+    a scan holds (see pinned) are not evicted; the cache can run over its
+    bound until the scan ends.
+    """
+
+    def __init__(self, s3, bucket, root=LAKE_CACHE_DIR, max_bytes=LAKE_CACHE_MAX_MB * 1024 * 1024,
+                 manifest_ttl=LAKE_MANIFEST_TTL_SECONDS):
+        self.s3 = s3
+        self.bucket = bucket
+        self.root = root
+        self.max_bytes = max_bytes
+        self.manifest_ttl = manifest_ttl
+        self._files = OrderedDict()  # key -> (digest, path, size), least recently used first
+        self._manifests = {}  # table -> (checked at, ETag, manifest)
+        self._fetching = {}  # key -> lock held while it downloads
+        self._pins = {}  # key -> scans holding it
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.bytes_fetched = 0
+        self._load_existing()
+
+    def _load_existing(self):
+        found = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                stem, _, digest = name.rpartition('.')
+                if name.endswith(_PARTIAL_SUFFIX) or not stem:
+                    os.remove(path)
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, stem), self.root).replace(os.sep, '/')
+                stat = os.stat(path)
+                found.append((stat.st_mtime, key, digest, path, stat.st_size))
+        for _, key, digest, path, size in sorted(found):
+            if key in self._files:
+                self._remove(key)
+            self._files[key] = (digest, path, size)
+            self.size += size
+
+    def directory(self, prefix):
+        """Local directory standing for a key prefix, e.g. a table's root for hive partitioning."""
+        return os.path.join(self.root, *prefix.rstrip('/').split('/'))
+
+    def manifest(self, table):
+        """A table's manifest, re-read only when its ETag has changed."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._manifests.get(table)
+        if cached is not None and now - cached[0] < self.manifest_ttl:
+            return cached[2]
+        try:
+            etag = self.s3.head_object(Bucket=self.bucket, Key=manifest_key(table)).get('ETag')
+        except Exception as e:
+            if not _missing(self.s3, e):
+                raise
+            etag = None
+        if cached is not None and etag is not None and etag == cached[1]:
+            manifest = cached[2]
+        else:
+            manifest = load_manifest(self.s3, self.bucket, table)
+        with self._lock:
+            self._manifests[table] = (now, etag, manifest)
+        return manifest
+
+    def partition(self, entry):
+        """Local path of a manifest entry's object, fetching it on a miss or a new version."""
+        return self.get(entry['key'], entry_version(entry))
+
+    @contextmanager
+    def pinned(self, entries):
+        """Local paths of manifest entries' objects, none of them evicted until the block exits."""
+        keys = [entry['key'] for entry in entries]
+        with self._lock:
+            for key in keys:
+                self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield [self.partition(entry) for entry in entries]
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._pins[key] -= 1
+                    if not self._pins[key]:
+                        del self._pins[key]
+
+    def get(self, key, version=None):
+        """Local path of the object at key; version defaults to its current ETag."""
+        if version is None:
+            version = self.s3.head_object(Bucket=self.bucket, Key=key)['ETag']
+        digest = _digest(version)
+        with self._lock:
+            key_lock = self._fetching.setdefault(key, threading.Lock())
+        # One download per key at a time; other readers wait and then hit
+        with key_lock:
+            with self._lock:
+                cached = self._files.get(key)
+                if cached is not None and cached[0] == digest:
+                    self._files.move_to_end(key)
+                    self.hits += 1
+                    return cached[1]
+                self.misses += 1
+                if cached is not None:
+                    self.stale += 1
+            return self._fetch(key, digest)
+
+    def _fetch(self, key, digest):
+        body = self.s3.get_object(Bucket=self.bucket, Key=key)['Body']
+        path = self.directory(key) + f'.{digest}'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Streamed to disk, so a partition is never held in memory whole
+        with open(path + _PARTIAL_SUFFIX, 'wb') as f:
+            shutil.copyfileobj(body, f, _CHUNK_BYTES)
+            size = f.tell()
+        os.replace(path + _PARTIAL_SUFFIX, path)
+        with self._lock:
+            if key in self._files:
+                self._remove(key)
+            self._evict(size)
+            self._files[key] = (digest, path, size)
+            self.size += size
+            self.bytes_fetched += size
+        return path
+
+    def _evict(self, incoming):
+        """Drop least recently used files until incoming bytes fit (caller holds the lock).
+
+        Files open in a running scan stay readable once unlinked.
+        """
+        unpinned = [key for key in self._files if key not in self._pins]
+        for key in unpinned:
+            if self.size + incoming <= self.max_bytes:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, path, size = self._files.pop(key)
+        self.size -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'stale': self.stale, 'evictions': self.evictions,
+                'files': len(self._files), 'bytes': self.size, 'bytes_fetched': self.bytes_fetched}
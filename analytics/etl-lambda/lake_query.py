@@ -0,0 +1,267 @@
+"""
+Read service for the admin portal's analytics pages.
+Answers the queries AdminAnalyticsController sends to Athena (dashboard
+totals, usage per tenant over recent days, PROM outcomes and the revenue
+trend) straight from the curated lake. The partitions a query needs are
+picked from the tables' manifests, kept locally by a PartitionCache and
+scanned with pyarrow.dataset over memory-mapped files, with the query's
+filters pushed down: dt= partitions are pruned by their paths and row
+groups by the statistics every curated layout keeps on its filter columns.
+A warm query costs a manifest ETag check at most, no Athena query and no
+S3 GET of data.
+
+Results have the column names of the Athena queries they replace. Runs as
+a Lambda (query_handler; the cache lives as long as its execution
+environment) or locally:
+
+    python lake_query.py usage --param days=30
+    python lake_query.py prom_outcomes --param region=Australia/Sydney --sink local
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+from catalog import table_prefix
+from coldstart import lazy_import
+from lake_cache import PartitionCache
+from sinks import OUTPUT_SINK, SINKS, sink_client
+from warm_cache import stats_since
+
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+ds = lazy_import('pyarrow.dataset')
+fs = lazy_import('pyarrow.fs')
+
+S3_BUCKET = os.environ.get('S3_BUCKET', 'qivr-analytics-lake')
+# The ETL's k-anonymity threshold, re-checked as the Athena query did
+PROM_MIN_PATIENTS = 5
+# tenants.status is the TenantStatus enum's integer, exported as text
+# (t.status::text), so Active (the first member) is '0' in the lake
+TENANT_STATUS_ACTIVE = '0'
+
+_cache = None
+
+
+def _local_fs():
+    return fs.LocalFileSystem(use_mmap=True)
+
+
+@lru_cache(maxsize=None)
+def _dt_partitioning():
+    return ds.partitioning(pa.schema([('dt', pa.string())]), flavor='hive')
+
+
+def _days(manifest):
+    """{dt: entry} of a daily table's manifest."""
+    return {entry['values']['dt']: entry for entry in manifest['partitions'].values()}
+
+
+def _months(manifest):
+    """{month: entry} of a compacted table's manifest."""
+    return {entry['values']['month']: entry for entry in manifest['partitions'].values()}
+
+
+def scan_days(cache, table, entries, columns, filter=None):
+    """Rows of daily partitions, with dt taken from their paths; None without any."""
+    if not entries:
+        return None
+    with cache.pinned(entries) as paths:
+        dataset = ds.dataset(paths, format='parquet', filesystem=_local_fs(), partitioning=_dt_partitioning(),
+                             partition_base_dir=cache.directory(table_prefix(table)))
+        return dataset.to_table(columns=columns, filter=filter)
+
+
+def scan_months(cache, entries, columns, filter=None):
+    """Rows of compacted months, whose dt is a column; None without any."""
+    if not entries:
+        return None
+    with cache.pinned(entries) as paths:
+        dataset = ds.dataset(paths, format='parquet', filesystem=_local_fs())
+        return dataset.to_table(columns=columns, filter=filter)
+
+
+def history(cache, table, columns, since=None, filter=None):
+    """A table's rows (with dt) from since on, from its daily partitions and compacted months.
+
+    A day still in the daily table is read from there only: compaction
+    publishes a month before it retires the month's days.
+    """
+    columns = list(columns) + ['dt']
+    days = {dt: entry for dt, entry in _days(cache.manifest(table)).items() if since is None or dt >= since}
+    months = [entry for month, entry in _months(cache.manifest(f'{table}_monthly')).items()
+              if since is None or month >= since[:7]]
+    month_filter = pc.invert(pc.field('dt').isin(pa.array(sorted(days), pa.string())))
+    if since is not None:
+        month_filter = month_filter & (pc.field('dt') >= since)
+    if filter is not None:
+        month_filter = month_filter & filter
+    parts = [scan_days(cache, table, list(days.values()), columns, filter),
+             scan_months(cache, months, columns, month_filter)]
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return None
+    schema = parts[0].schema
+    return pa.concat_tables([part.select(schema.names).cast(schema) for part in parts])
+
+
+def latest(cache, table, columns, filter=None):
+    """Rows of a table's latest day (its last dt= partition, else its last compacted day)."""
+    days = _days(cache.manifest(table))
+    if days:
+        return scan_days(cache, table, [days[max(days)]], columns, filter)
+    months = _months(cache.manifest(f'{table}_monthly'))
+    if not months:
+        return None
+    entry = months[max(months)]
+    last = pc.max(scan_months(cache, [entry], ['dt'])['dt']).as_py()
+    day = pc.field('dt') == last
+    return scan_months(cache, [entry], columns, day if filter is None else day & filter)
+
+
+def _total(column):
+    return pc.sum(column).as_py() or 0
+
+
+def dashboard(cache):
+    """Tenant, patient and staff totals and MRR from the latest tenants snapshot."""
+    rows = latest(cache, 'tenants', ['status', 'patient_count', 'staff_count', 'mrr'])
+    if rows is None:
+        return pa.table({name: pa.array([], pa.int64()) for name in
+                         ('total_tenants', 'active_tenants', 'total_patients', 'total_staff', 'mrr')})
+    active = pc.equal(rows['status'], TENANT_STATUS_ACTIVE)
+    return pa.table({
+        'total_tenants': [rows.num_rows],
+        'active_tenants': [_total(pc.cast(active, pa.int64()))],
+        'total_patients': [_total(rows['patient_count'])],
+        'total_staff': [_total(rows['staff_count'])],
+        'mrr': [_total(rows['mrr'])],
+    })
+
+
+def usage(cache, days=30, today=None):
+    """Usage per tenant summed over the partitions of the last days days."""
+    since = ((today or date.today()) - timedelta(days=days)).isoformat()
+    counters = ['appointments', 'completed_appointments', 'messages', 'documents']
+    rows = history(cache, 'usage', ['tenant_id'] + counters, since=since)
+    if rows is None:
+        return pa.table({'tenant_id': pa.array([], pa.string())})
+    totals = rows.group_by('tenant_id', use_threads=False).aggregate([(name, 'sum') for name in counters])
+    names = {f'{name}_sum': name for name in counters}
+    names['completed_appointments_sum'] = 'completed'
+    return totals.rename_columns([names.get(name, name) for name in totals.column_names]).sort_by('tenant_id')
+
+
+def prom_outcomes(cache, region=None, prom_type=None):
+    """The latest PROM outcome cohorts, optionally of one region and PROM type, largest first."""
+    filter = pc.field('patient_count') >= PROM_MIN_PATIENTS
+    if region:
+        filter = filter & (pc.field('region') == region)
+    if prom_type:
+        filter = filter & (pc.field('prom_type') == prom_type)
+    columns = ['region', 'prom_type', 'age_bracket', 'gender', 'avg_baseline', 'avg_final', 'patient_count']
+    rows = latest(cache, 'prom_outcomes', columns, filter)
+    if rows is None:
+        return pa.table({name: pa.array([], pa.null()) for name in columns})
+    baseline = pc.if_else(pc.equal(rows['avg_baseline'], 0), pa.scalar(None, pa.float64()), rows['avg_baseline'])
+    change = pc.multiply(pc.divide(pc.subtract(rows['avg_final'], baseline), baseline), 100)
+    rows = rows.append_column('improvement_pct', pc.round(change, 1))
+    return rows.sort_by([('patient_count', 'descending')])
+
+
+def _months_before(day, months):
+    """The same day of the month months earlier, clamped to that month's length."""
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    following = date(year + (month + 1) // 12, (month + 1) % 12 + 1, 1)
+    return day.replace(year=year, month=month + 1, day=min(day.day, (following - timedelta(days=1)).day))
+
+
+def revenue_trend(cache, months=6, today=None):
+    """New tenants and their MRR per month of creation, over the last months months."""
+    since = datetime.combine(_months_before(today or date.today(), months), datetime.min.time())
+    rows = latest(cache, 'tenants', ['created_at', 'mrr'],
+                  pc.field('created_at') >= pa.scalar(since, pa.timestamp('us')))
+    if rows is None:
+        return pa.table({'month': pa.array([], pa.string())})
+    rows = pa.table({'month': pc.strftime(rows['created_at'], format='%Y-%m'), 'mrr': rows['mrr']})
+    totals = rows.group_by('month', use_threads=False).aggregate([([], 'count_all'), ('mrr', 'sum')])
+    totals = totals.rename_columns([{'count_all': 'new_tenants', 'mrr_sum': 'mrr_added'}.get(name, name)
+                                    for name in totals.column_names])
+    return totals.select(['month', 'new_tenants', 'mrr_added']).sort_by('month')
+
+
+# name -> (query, {parameter: type})
+QUERIES = {
+    'dashboard': (dashboard, {}),
+    'usage': (usage, {'days': int}),
+    'prom_outcomes': (prom_outcomes, {'region': str, 'prom_type': str}),
+    'revenue_trend': (revenue_trend, {'months': int}),
+}
+
+
+def run_query(cache, name, params=None):
+    """Result table of a named query; ValueError for an unknown query or parameter."""
+    if name not in QUERIES:
+        raise ValueError(f"Unknown query {name!r}; expected one of {', '.join(QUERIES)}")
+    query, types = QUERIES[name]
+    kwargs = {}
+    for param, value in (params or {}).items():
+        if param not in types:
+            raise ValueError(f"Unknown parameter {param!r} for {name}")
+        if value is not None and value != '':
+            kwargs[param] = types[param](value)
+    return query(cache, **kwargs)
+
+
+def lake_cache():
+    """The module-level cache, kept across warm invocations."""
+    global _cache
+    if _cache is None:
+        _cache = PartitionCache(sink_client(OUTPUT_SINK), S3_BUCKET)
+    return _cache
+
+
+def query_handler(event, context):
+    """Lambda entry point: {'query': name, 'params': {...}} -> rows as JSON."""
+    cache = lake_cache()
+    before = {'lake': cache.stats()}
+    started = time.perf_counter()
+    try:
+        result = run_query(cache, event.get('query'), event.get('params'))
+    except ValueError as e:
+        return {'statusCode': 400, 'body': json.dumps({'error': str(e)})}
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'query': event['query'],
+            'rows': result.to_pylist(),
+            'ms': round((time.perf_counter() - started) * 1000, 2),
+            'cache': stats_since(before, {'lake': cache.stats()})['lake'],
+        }, default=str),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('query', choices=sorted(QUERIES))
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE')
+    parser.add_argument('--sink', choices=SINKS, default=OUTPUT_SINK, help='Where to read the lake from')
+    parser.add_argument('--bucket', default=S3_BUCKET)
+    args = parser.parse_args(argv)
+
+    cache = PartitionCache(sink_client(args.sink), args.bucket)
+    params = dict(param.split('=', 1) for param in args.param)
+    started = time.perf_counter()
+    result = run_query(cache, args.query, params)
+    for row in result.to_pylist():
+        print(json.dumps(row, default=str))
+    print(f"{result.num_rows} rows in {(time.perf_counter() - started) * 1000:.1f} ms; cache {cache.stats()}",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
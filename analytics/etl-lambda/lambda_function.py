@@ -1,24 +1,52 @@
 """
 ETL Lambda: Extract tenant and usage data from Production RDS to Data Lake.
-Runs nightly via EventBridge.
+Runs nightly via EventBridge and writes Parquet through the writer shared
+with handler.py: snapshots under <table>/dt=<run date>/, usage_stats under
+usage_stats/dt=<day>/ for each whole day it covers. Every partition is
+registered with the Glue table extract_<table> and its manifest.
 """
+import time
+
+_import_started = time.perf_counter()
+
 import json
 import os
-import boto3
-import pg8000.native
 from datetime import datetime, timedelta
 
-s3 = boto3.client('s3')
-secrets = boto3.client('secretsmanager')
+import coldstart
+from catalog import GlueCatalog, partition_entry, publish_partitions
+from coldstart import lazy_client, lazy_import
+from cohorts import CohortDefinition, aggregate
+from parquet_writer import ParquetLayout, arrow_schema, write_parquet
+from pg_arrow import rows_to_table
+from sinks import OUTPUT_SINK, catalog_client, sink_client
+from warm_cache import ConnectionCache, SecretCache, stats_since
+from watermarks import get_high_water, load_state, save_state
+
+# Loaded on first use so cold starts only pay for what an invocation touches
+pg8000_native = lazy_import('pg8000.native')
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+
+# Output goes to OUTPUT_SINK unless an event names another (see sinks.py)
+s3 = sink_client(OUTPUT_SINK)
+# Partitions are registered with Glue as they are written (no MSCK REPAIR TABLE)
+partition_catalog = GlueCatalog(catalog_client(OUTPUT_SINK))
+secrets = lazy_client('secretsmanager')
 
 BUCKET = os.environ.get('DATA_LAKE_BUCKET', 'qivr-analytics-lake')
 SECRET_ID = os.environ.get('DB_SECRET_ID', 'qivr/production')
+PROM_LOOKBACK_DAYS = int(os.environ.get('PROM_LOOKBACK_DAYS', '365'))
+# This function's watermarks, kept apart from handler.py's state object so the
+# two never overwrite each other's entries
+STATE_KEY = 'state/extract_watermarks.json'
 
-def get_db_connection():
-    """Get read-only connection to production DB."""
-    secret = secrets.get_secret_value(SecretId=SECRET_ID)
-    creds = json.loads(secret['SecretString'])
-    return pg8000.native.Connection(
+# Module-level so the secret and connection survive warm invocations
+secret_cache = SecretCache(secrets)
+
+def open_connection(creds):
+    """Open a pg8000 connection with the given credentials."""
+    return pg8000_native.Connection(
         host=creds['host'],
         database=creds.get('database', creds.get('dbname', 'qivr')),
         user=creds['username'],
@@ -26,6 +54,15 @@ def get_db_connection():
         port=int(creds.get('port', 5432))
     )
 
+def get_db_connection():
+    """Get read-only connection to production DB."""
+    return secret_cache.connect(SECRET_ID, open_connection)
+
+connection_cache = ConnectionCache(get_db_connection, lambda conn: conn.run('SELECT 1'))
+
+def cache_stats():
+    return {'secret': secret_cache.stats(), 'connection': connection_cache.stats()}
+
 def extract_tenants(conn):
     """Extract tenant data with usage counts (sanitized - no PHI)."""
     return conn.run("""
@@ -38,92 +75,249 @@ def extract_tenants(conn):
             t.state as region,
             COUNT(DISTINCT CASE WHEN u.role = 'Patient' THEN u.id END)::int as patient_count,
             COUNT(DISTINCT CASE WHEN u.role != 'Patient' THEN u.id END)::int as staff_count,
-            t.created_at::text
+            t.created_at
         FROM tenants t
         LEFT JOIN users u ON u.tenant_id = t.id
         WHERE t.is_active = true
         GROUP BY t.id, t.name, t.slug, t.is_active, t.settings, t.state, t.created_at
     """)
 
-def extract_usage_stats(conn, start_date):
-    """Extract usage metrics per tenant."""
-    return conn.run("""
-        SELECT 
-            t.id::text as tenant_id,
-            DATE(a.created_at)::text as date,
-            COUNT(DISTINCT a.id)::int as appointments,
-            COUNT(DISTINCT d.id)::int as documents,
-            COUNT(DISTINCT m.id)::int as messages,
-            COUNT(DISTINCT CASE WHEN a.status = 'Completed' THEN a.id END)::int as completed
-        FROM tenants t
-        LEFT JOIN appointments a ON a.tenant_id = t.id AND a.created_at >= :start
-        LEFT JOIN documents d ON d.tenant_id = t.id AND d.created_at >= :start
-        LEFT JOIN messages m ON m.tenant_id = t.id AND m.created_at >= :start
-        WHERE t.deleted_at IS NULL
-        GROUP BY t.id, DATE(a.created_at)
-    """, start=start_date)
+TENANTS_COLUMNS = (
+    ('id', 'string'),
+    ('name', 'string'),
+    ('slug', 'string'),
+    ('status', 'string'),
+    ('plan', 'string'),
+    ('region', 'string'),
+    ('patient_count', 'int32'),
+    ('staff_count', 'int32'),
+    ('created_at', 'timestamp[us]'),
+)
+
+TENANTS_LAYOUT = ParquetLayout(
+    sort_by=('id',),
+    dictionary_columns=('status', 'plan', 'region'),
+    statistics_columns=('id', 'status', 'plan', 'region', 'created_at'),
+    row_group_size=16384,
+)
+
+def usage_stats_start_date():
+    """First day whose usage has not been captured by a previous run.
+
+    The high-water mark is the (exclusive) end of the last window written,
+    see save_usage_stats_watermark; on the first run this falls back to
+    yesterday.
+    """
+    high_water = get_high_water(load_state(s3, BUCKET, STATE_KEY).get('usage_stats'))
+    return (high_water or datetime.utcnow() - timedelta(days=1)).date()
+
+def usage_stats_end_date():
+    """Exclusive end of the usage window: today, the first day not yet over."""
+    return datetime.utcnow().date()
+
+def save_usage_stats_watermark(end_date):
+    """Record that usage before end_date is exported, once its partitions are written."""
+    state = load_state(s3, BUCKET, STATE_KEY)
+    state['usage_stats'] = {'high_water': datetime.combine(end_date, datetime.min.time()).isoformat()}
+    save_state(s3, BUCKET, state, STATE_KEY)
+
+# Each source is aggregated on its own over a sargable created_at range and the
+# per-day counts are summed afterwards, so rows never fan out across tables.
+# The range is [start, end), whole days only, so a day is exported once complete
+USAGE_STATS_QUERY = """
+    WITH per_source AS (
+        SELECT tenant_id, created_at::date as day,
+               COUNT(*) as appointments,
+               COUNT(*) FILTER (WHERE status = 'Completed') as completed,
+               0 as documents, 0 as messages
+        FROM appointments
+        WHERE created_at >= :start AND created_at < :end
+        GROUP BY tenant_id, created_at::date
+        UNION ALL
+        SELECT tenant_id, created_at::date, 0, 0, COUNT(*), 0
+        FROM documents
+        WHERE created_at >= :start AND created_at < :end
+        GROUP BY tenant_id, created_at::date
+        UNION ALL
+        SELECT tenant_id, created_at::date, 0, 0, 0, COUNT(*)
+        FROM messages
+        WHERE created_at >= :start AND created_at < :end
+        GROUP BY tenant_id, created_at::date
+    )
+    SELECT 
+        t.id::text as tenant_id,
+        s.day as date,
+        SUM(s.appointments)::int as appointments,
+        SUM(s.documents)::int as documents,
+        SUM(s.messages)::int as messages,
+        SUM(s.completed)::int as completed
+    FROM per_source s
+    JOIN tenants t ON t.id = s.tenant_id
+    WHERE t.deleted_at IS NULL
+    GROUP BY t.id, s.day
+"""
+
+USAGE_STATS_COLUMNS = (
+    ('tenant_id', 'string'),
+    ('date', 'date32'),
+    ('appointments', 'int32'),
+    ('documents', 'int32'),
+    ('messages', 'int32'),
+    ('completed', 'int32'),
+)
+
+# Written one dt= partition per day of activity (see EXPORTS)
+USAGE_STATS_LAYOUT = ParquetLayout(
+    sort_by=('date', 'tenant_id'),
+    dictionary_columns=('date',),
+    statistics_columns=('tenant_id', 'date'),
+    row_group_size=16384,
+)
+
+def extract_usage_stats(conn, start_date=None, end_date=None):
+    """Extract per-day usage metrics per tenant over [start_date, end_date).
+
+    start_date defaults to the usage watermark and end_date to today.
+    """
+    if start_date is None:
+        start_date = usage_stats_start_date()
+    if end_date is None:
+        end_date = usage_stats_end_date()
+    return conn.run(USAGE_STATS_QUERY, start=start_date, end=end_date)
+
+# One de-identified row per evaluation; cohorts are aggregated from it in memory
+PROM_ROWS_QUERY = """
+    SELECT 
+        t.state as region,
+        e.prom_type,
+        EXTRACT(YEAR FROM AGE(u.date_of_birth))::int as age,
+        u.gender,
+        e.baseline_score::float as baseline_score,
+        e.final_score::float as final_score
+    FROM evaluations e
+    JOIN users u ON u.id = e.patient_id
+    JOIN tenants t ON t.id = e.tenant_id
+    WHERE e.created_at >= :start
+      AND e.baseline_score IS NOT NULL
+      AND e.final_score IS NOT NULL
+"""
+
+PROM_ROWS_COLUMNS = (
+    ('region', 'string'),
+    ('prom_type', 'string'),
+    ('age', 'int32'),
+    ('gender', 'string'),
+    ('baseline_score', 'float64'),
+    ('final_score', 'float64'),
+)
+
+PROM_OUTCOMES_COLUMNS = (
+    ('region', 'string'),
+    ('prom_type', 'string'),
+    ('age_bracket', 'string'),
+    ('gender', 'string'),
+    ('avg_baseline', 'float64'),
+    ('avg_final', 'float64'),
+    ('patient_count', 'int32'),
+)
+
+# K-anonymity: cohorts of fewer than 10 evaluations are not published
+PROM_OUTCOMES_COHORT = CohortDefinition(
+    'prom_outcomes', PROM_OUTCOMES_COLUMNS, k=10, age_edges=(18, 25, 35, 45, 55, 65)
+)
 
 def extract_prom_outcomes(conn, start_date):
-    """Extract anonymized PROM outcomes."""
-    return conn.run("""
-        SELECT 
-            t.state as region,
-            e.prom_type,
-            CASE 
-                WHEN EXTRACT(YEAR FROM AGE(u.date_of_birth)) < 25 THEN '18-24'
-                WHEN EXTRACT(YEAR FROM AGE(u.date_of_birth)) < 35 THEN '25-34'
-                WHEN EXTRACT(YEAR FROM AGE(u.date_of_birth)) < 45 THEN '35-44'
-                WHEN EXTRACT(YEAR FROM AGE(u.date_of_birth)) < 55 THEN '45-54'
-                WHEN EXTRACT(YEAR FROM AGE(u.date_of_birth)) < 65 THEN '55-64'
-                ELSE '65+'
-            END as age_bracket,
-            u.gender,
-            AVG(e.baseline_score)::float as avg_baseline,
-            AVG(e.final_score)::float as avg_final,
-            COUNT(*)::int as patient_count
-        FROM evaluations e
-        JOIN users u ON u.id = e.patient_id
-        JOIN tenants t ON t.id = e.tenant_id
-        WHERE e.created_at >= :start
-          AND e.baseline_score IS NOT NULL
-          AND e.final_score IS NOT NULL
-        GROUP BY t.state, e.prom_type, age_bracket, u.gender
-        HAVING COUNT(*) >= 10
-    """, start=start_date)
-
-def write_to_s3(data, prefix, filename):
-    """Write data as JSON lines to S3."""
-    body = '\n'.join(json.dumps(row, default=str) for row in data)
-    key = f"{prefix}/{datetime.utcnow().strftime('%Y-%m-%d')}/{filename}"
-    s3.put_object(Bucket=BUCKET, Key=key, Body=body, ContentType='application/jsonl')
+    """Extract anonymized PROM outcomes as a table, aggregated from evaluation rows since start_date."""
+    rows = rows_to_table(conn.run(PROM_ROWS_QUERY, start=start_date), arrow_schema(PROM_ROWS_COLUMNS))
+    return aggregate(rows, [PROM_OUTCOMES_COHORT])[PROM_OUTCOMES_COHORT.name]
+
+PROM_OUTCOMES_LAYOUT = ParquetLayout(
+    sort_by=('region', 'prom_type', 'age_bracket', 'gender'),
+    dictionary_columns=('region', 'prom_type', 'age_bracket', 'gender'),
+    statistics_columns=('region', 'prom_type', 'age_bracket', 'gender'),
+)
+
+def prom_outcomes_start_date():
+    """Start of the window PROM outcomes are aggregated over."""
+    return (datetime.utcnow() - timedelta(days=PROM_LOOKBACK_DAYS)).date()
+
+# Exported tables: extract(conn, today) -> rows (or a table of them), the
+# column types of those rows, their layout and the date column splitting them
+# into dt= partitions. Without one the rows are a snapshot, written to the
+# run's day. usage_stats is split by its date, so re-extracting a day replaces
+# that day's partition rather than adding a second copy of its counts under
+# another dt.
+EXPORTS = {
+    'tenants': (lambda conn, today: extract_tenants(conn), TENANTS_COLUMNS, TENANTS_LAYOUT, None),
+    'usage_stats': (lambda conn, today: extract_usage_stats(conn, end_date=today),
+                    USAGE_STATS_COLUMNS, USAGE_STATS_LAYOUT, 'date'),
+    'prom_outcomes': (lambda conn, today: extract_prom_outcomes(conn, prom_outcomes_start_date()),
+                      PROM_OUTCOMES_COLUMNS, PROM_OUTCOMES_LAYOUT, None),
+}
+
+def as_table(rows, columns):
+    """rows as a table of the columns' schema; extracts aggregated in Arrow already are one."""
+    return rows if isinstance(rows, pa.Table) else rows_to_table(rows, arrow_schema(columns))
+
+def partition_rows(rows, columns, partition_by, today):
+    """{dt: table} of rows: split by a date column's values, else all under today."""
+    table = as_table(rows, columns)
+    if not table.num_rows:
+        return {}
+    if partition_by is None:
+        return {today.isoformat(): table}
+    dates = table[partition_by]
+    return {day.as_py().isoformat(): table.filter(pc.equal(dates, day)) for day in pc.unique(dates)}
+
+def catalog_table(prefix):
+    """Glue table of an export's partitions (see athena-queries/create_tables.sql)."""
+    return f'extract_{prefix}'
+
+def write_to_s3(rows, columns, prefix, layout, dt, filename='data.parquet'):
+    """Write rows (or a table of them) to S3 as the dt= partition's typed, compressed Parquet file and register it."""
+    key = f"{prefix}/dt={dt}/{filename}"
+    table = as_table(rows, columns)
+    size = write_parquet(s3, BUCKET, key, table, layout)
+    publish_partitions(s3, BUCKET, partition_catalog, catalog_table(prefix),
+                       [partition_entry({'dt': dt}, BUCKET, key, table.num_rows, size)])
     return f"s3://{BUCKET}/{key}"
 
+def use_sink(kind):
+    """Send this container's output and partition registrations to another sink."""
+    global s3, partition_catalog
+    if sink_client(kind) is not s3:
+        s3, partition_catalog = sink_client(kind), GlueCatalog(catalog_client(kind))
+
 def handler(event, context):
     """Lambda handler - triggered nightly."""
-    conn = get_db_connection()
-    results = {}
+    use_sink((event or {}).get('sink', OUTPUT_SINK))
+    cache_before = cache_stats()
+    conn = connection_cache.acquire()
+    # One date for the whole run, so the usage window written is the one recorded
+    today = usage_stats_end_date()
+    exports = {}
+    failed = True
     
     try:
-        # Extract tenants (sanitized)
-        tenants = extract_tenants(conn)
-        tenant_dicts = [
-            {
-                'id': t[0],
-                'name': t[1],
-                'slug': t[2],
-                'status': t[3],
-                'plan': t[4],
-                'region': t[5],
-                'patient_count': t[6],
-                'staff_count': t[7],
-                'created_at': t[8]
-            }
-            for t in tenants
-        ]
-        results['tenants'] = write_to_s3(tenant_dicts, 'tenants', 'data.jsonl')
-        results['tenant_count'] = len(tenant_dicts)
+        for name, (extract, columns, layout, partition_by) in EXPORTS.items():
+            rows = extract(conn, today)
+            partitions = partition_rows(rows, columns, partition_by, today)
+            uris = [write_to_s3(part, columns, name, layout, dt) for dt, part in sorted(partitions.items())]
+            exports[name] = {'uris': uris, 'rows': len(rows)}
+        save_usage_stats_watermark(today)
+        failed = False
         
     finally:
-        conn.close()
+        # Kept open for the next warm invocation unless this run broke it
+        connection_cache.release(conn, discard=failed)
     
+    # tenants and tenant_count as before every export was reported
+    results = {
+        'tenants': (exports['tenants']['uris'] or [None])[0],
+        'tenant_count': exports['tenants']['rows'],
+        'exports': exports,
+        'cache': stats_since(cache_before, cache_stats()),
+    }
     return {'statusCode': 200, 'body': json.dumps(results)}
+
+coldstart.record('module', 'lambda_function', _import_started)
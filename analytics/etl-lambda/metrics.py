@@ -0,0 +1,153 @@
+"""
+Per-run metrics for the analytics ETL.
+Exporters time their stages (query, fetch, convert, encode, upload) and count
+rows and encoded bytes into the TableMetrics bound to their thread; the
+handler renders everything as one CloudWatch Embedded Metric Format record,
+which CloudWatch Logs turns into metrics without any PutMetricData calls. The
+record has a metric directive per table, as one directive takes at most 100
+metrics.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from streaming import current_rss_mb
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Qivr/AnalyticsETL')
+
+# Emitted in this order; anything else an exporter times is appended after
+STAGES = ('connect', 'read_previous', 'query', 'fetch', 'convert', 'aggregate', 'validate', 'hash', 'encode', 'upload', 'register')
+
+_local = threading.local()
+
+
+class TableMetrics:
+    """Stage timings and counters for one exported table."""
+
+    def __init__(self, table):
+        self.table = table
+        self.stages = {}
+        self.rows = 0
+        self.bytes = 0
+        # Encoding and upload skipped because the content was unchanged
+        self.saved_bytes = 0
+        self.saved_seconds = 0.0
+        # Quality rules that flagged the partition without blocking it
+        self.quality_warnings = 0
+        self.peak_rss_mb = current_rss_mb()
+        # Sharded exports time stages from several threads
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+
+    def add_counts(self, rows=0, bytes=0, quality_warnings=0):
+        with self._lock:
+            self.rows += rows
+            self.bytes += bytes
+            self.quality_warnings += quality_warnings
+
+    def add_saved(self, bytes=0, seconds=0.0):
+        with self._lock:
+            self.saved_bytes += bytes
+            self.saved_seconds += seconds
+
+    def to_dict(self):
+        ordered = [s for s in STAGES if s in self.stages] + [s for s in self.stages if s not in STAGES]
+        return {
+            'stages': {name: round(self.stages[name], 3) for name in ordered},
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'saved_bytes': self.saved_bytes,
+            'saved_seconds': round(self.saved_seconds, 3),
+            'quality_warnings': self.quality_warnings,
+            # Process-wide RSS, so concurrent exporters see each other's memory
+            'peak_rss_mb': round(self.peak_rss_mb, 1),
+        }
+
+
+class RunMetrics:
+    """Every table's metrics for one handler run."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.tables = {}
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        with self._lock:
+            if name not in self.tables:
+                self.tables[name] = TableMetrics(name)
+            return self.tables[name]
+
+    def to_emf(self, **properties):
+        """Render the run as one EMF record, a metric directive per table; properties are logged alongside."""
+        record = {'RunSeconds': round(time.time() - self.started, 3)}
+        directives = [[{'Name': 'RunSeconds', 'Unit': 'Seconds'}]]
+        for table, metrics in self.tables.items():
+            values = metrics.to_dict()
+            definitions = []
+            directives.append(definitions)
+            for stage, seconds in values['stages'].items():
+                record[f'{table}.{stage}_seconds'] = seconds
+                definitions.append({'Name': f'{table}.{stage}_seconds', 'Unit': 'Seconds'})
+            for name, unit in (('rows', 'Count'), ('bytes', 'Bytes'), ('saved_bytes', 'Bytes'),
+                               ('saved_seconds', 'Seconds'), ('quality_warnings', 'Count'),
+                               ('peak_rss_mb', 'Megabytes')):
+                record[f'{table}.{name}'] = values[name]
+                definitions.append({'Name': f'{table}.{name}', 'Unit': unit})
+        record.update(properties)
+        record['tables'] = {table: metrics.to_dict() for table, metrics in self.tables.items()}
+        record['_aws'] = {
+            'Timestamp': int(self.started * 1000),
+            'CloudWatchMetrics': [
+                {'Namespace': METRICS_NAMESPACE, 'Dimensions': [[]], 'Metrics': definitions}
+                for definitions in directives
+            ],
+        }
+        return record
+
+
+@contextmanager
+def recording(table_metrics):
+    """Bind table_metrics to this thread for stage() and count() calls."""
+    previous = getattr(_local, 'current', None)
+    _local.current = table_metrics
+    try:
+        yield table_metrics
+    finally:
+        _local.current = previous
+
+
+@contextmanager
+def stage(name):
+    """Add the wall time of the block to the current table's stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current = getattr(_local, 'current', None)
+        if current is not None:
+            current.add_stage(name, time.perf_counter() - started)
+
+
+def current():
+    """The TableMetrics bound to this thread, or None."""
+    return getattr(_local, 'current', None)
+
+
+def saved(bytes=0, seconds=0.0):
+    """Add to the current table's bytes and seconds saved by skipping a write."""
+    table_metrics = current()
+    if table_metrics is not None:
+        table_metrics.add_saved(bytes, seconds)
+
+
+def count(rows=0, bytes=0, quality_warnings=0):
+    """Add to the current table's row, encoded-byte and quality-warning counters."""
+    table_metrics = current()
+    if table_metrics is not None:
+        table_metrics.add_counts(rows, bytes, quality_warnings)
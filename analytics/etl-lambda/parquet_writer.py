@@ -0,0 +1,213 @@
+"""
+Schema-driven Parquet writer shared by the ETL Lambdas.
+Tables are declared as (name, type alias) column pairs and encoded to Parquet
+straight into an S3 multipart upload, either from a whole Arrow table or
+from a stream of RecordBatches. A ParquetLayout per table decides codec,
+row-group size, dictionary encoding, sort order and statistics.
+"""
+import hashlib
+import os
+from functools import lru_cache
+
+import metrics
+from coldstart import lazy_import
+from s3_multipart import S3MultipartWriter
+from streaming import current_rss_mb
+
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+pq = lazy_import('pyarrow.parquet')
+
+PARQUET_COMPRESSION = os.environ.get('PARQUET_COMPRESSION', 'zstd')
+PARQUET_COMPRESSION_LEVEL = int(os.environ.get('PARQUET_COMPRESSION_LEVEL', '3'))
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get('PARQUET_ROW_GROUP_SIZE', '131072'))
+
+# Codecs that take a compression level
+_LEVELLED_CODECS = ('zstd', 'gzip', 'brotli')
+
+
+class ParquetLayout:
+    """How one table is laid out in its Parquet files.
+
+    Rows are sorted by sort_by, so the min/max statistics of each row group
+    and page (the page index) are tight on those columns and Athena can skip
+    whatever a filter on them rules out. Only dictionary_columns are
+    dictionary-encoded; high-cardinality strings are cheaper written plain.
+    statistics_columns limits statistics to the columns queries filter on
+    (None keeps them for every column).
+    """
+
+    def __init__(self, sort_by=(), dictionary_columns=(), statistics_columns=None,
+                 row_group_size=None, compression=None, compression_level=None):
+        self.sort_by = tuple(sort_by)
+        self.dictionary_columns = tuple(dictionary_columns)
+        self.statistics_columns = None if statistics_columns is None else tuple(statistics_columns)
+        self.row_group_size = row_group_size or PARQUET_ROW_GROUP_SIZE
+        self.compression = compression or PARQUET_COMPRESSION
+        self.compression_level = compression_level
+        if compression_level is None and self.compression in _LEVELLED_CODECS:
+            self.compression_level = PARQUET_COMPRESSION_LEVEL
+
+    def sort(self, table):
+        """Table in this layout's row order."""
+        if not self.sort_by or rows_ordered(table, self.sort_by):
+            return table
+        return table.sort_by([(name, 'ascending') for name in self.sort_by])
+
+    def order_by(self, query, schema):
+        """Query wrapped so the database returns rows in this layout's order.
+
+        Strings are compared bytewise (COLLATE "C"), as Arrow and the Parquet
+        statistics compare them.
+        """
+        if not self.sort_by:
+            return query
+        keys = [
+            f'{name} COLLATE "C"' if pa.types.is_string(schema.field(name).type) else name
+            for name in self.sort_by
+        ]
+        return f"SELECT * FROM ({query}\n) q ORDER BY {', '.join(keys)}"
+
+    def writer_options(self, schema):
+        """Keyword arguments for pq.ParquetWriter."""
+        statistics = True if self.statistics_columns is None else list(self.statistics_columns)
+        return {
+            'compression': self.compression,
+            'compression_level': self.compression_level,
+            'use_dictionary': list(self.dictionary_columns),
+            'write_statistics': statistics,
+            'write_page_index': True,
+            'sorting_columns': [
+                pq.SortingColumn(schema.get_field_index(name)) for name in self.sort_by
+            ] or None,
+        }
+
+
+DEFAULT_LAYOUT = ParquetLayout()
+
+
+def rows_ordered(table, keys, strict=False):
+    """Whether rows are in ascending order of keys (strictly: no two rows equal).
+
+    Each row is compared with the next, column by column, so this is one
+    linear pass. A null key counts as out of order.
+    """
+    if table.num_rows < 2:
+        return True
+    head, tail = table.slice(0, table.num_rows - 1), table.slice(1)
+    before = equal = None
+    for i, key in enumerate(keys):
+        less = pc.less(head[key], tail[key])
+        before = less if before is None else pc.or_(before, pc.and_(equal, less))
+        # Ties on the last key only matter when equal rows are allowed
+        if i < len(keys) - 1 or not strict:
+            same = pc.equal(head[key], tail[key])
+            equal = same if equal is None else pc.and_(equal, same)
+    ordered = before if strict else pc.or_(before, equal)
+    return ordered.null_count == 0 and pc.all(ordered).as_py()
+
+
+@lru_cache(maxsize=None)
+def arrow_schema(columns):
+    """Arrow schema for (name, type alias) column pairs, built on first use."""
+    return pa.schema([(name, pa.type_for_alias(alias)) for name, alias in columns])
+
+
+def content_hash(table, layout=DEFAULT_LAYOUT):
+    """SHA-256 of a table's content, independent of its row order and chunking.
+
+    Rows are put in a canonical order (the layout's sort keys, then every
+    other column) and the resulting contiguous column buffers are hashed as
+    one Arrow IPC stream, so no Python code touches individual rows.
+    """
+    keys = list(layout.sort_by) + [name for name in table.column_names if name not in layout.sort_by]
+    canonical = table.replace_schema_metadata(None)
+    canonical = canonical.sort_by([(name, 'ascending') for name in keys]).combine_chunks()
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, canonical.schema) as writer:
+        writer.write_table(canonical)
+    return hashlib.sha256(sink.getvalue()).hexdigest()
+
+
+def write_parquet(s3, bucket, key, table, layout=DEFAULT_LAYOUT, metadata=None):
+    """Write an Arrow table to S3 as Parquet; returns the encoded size in bytes.
+
+    metadata is stored as S3 user metadata on the object.
+    """
+    with S3MultipartWriter(s3, bucket, key, metadata=metadata) as sink:
+        with metrics.stage('encode'):
+            encode_parquet(layout.sort(table), sink, layout)
+        with metrics.stage('upload'):
+            sink.close()
+    metrics.count(rows=table.num_rows, bytes=sink.bytes_written)
+    print(f"Wrote {table.num_rows} rows to s3://{bucket}/{key}")
+    return sink.bytes_written
+
+
+def encode_parquet(table, sink, layout=DEFAULT_LAYOUT):
+    """Encode an Arrow table (already in layout order) to a file-like sink."""
+    with pq.ParquetWriter(sink, table.schema, **layout.writer_options(table.schema)) as writer:
+        writer.write_table(table, row_group_size=layout.row_group_size)
+
+
+def stream_parquet(s3, bucket, key, schema, batches, layout=DEFAULT_LAYOUT):
+    """Append RecordBatches to a Parquet file on S3 as they arrive.
+
+    Batches are buffered until they fill a row group of layout.row_group_size
+    rows, and row groups flow straight into the multipart upload, so memory
+    stays flat regardless of result size. Batches must already be in layout
+    order (see ParquetLayout.order_by). Nothing is published if batches is
+    empty or any step fails; batches is closed on failure.
+    Returns (row_count, peak_rss_mb).
+    """
+    row_count = 0
+    peak_mb = current_rss_mb()
+
+    sink = S3MultipartWriter(s3, bucket, key)
+    writer = None
+    pending, pending_rows = [], 0
+    try:
+        for batch in batches:
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            row_count += batch.num_rows
+            del batch
+            if pending_rows >= layout.row_group_size:
+                with metrics.stage('encode'):
+                    if writer is None:
+                        writer = pq.ParquetWriter(sink, schema, **layout.writer_options(schema))
+                    pending = _write_row_groups(writer, pending, layout.row_group_size)
+                    pending_rows = sum(b.num_rows for b in pending)
+            peak_mb = max(peak_mb, current_rss_mb())
+        if pending_rows:
+            with metrics.stage('encode'):
+                if writer is None:
+                    writer = pq.ParquetWriter(sink, schema, **layout.writer_options(schema))
+                writer.write_table(pa.Table.from_batches(pending, schema=schema),
+                                   row_group_size=layout.row_group_size)
+        if writer is not None:
+            with metrics.stage('encode'):
+                writer.close()
+            with metrics.stage('upload'):
+                sink.close()
+            metrics.count(rows=row_count, bytes=sink.bytes_written)
+        else:
+            sink.abort()
+    except Exception:
+        if hasattr(batches, 'close'):
+            batches.close()
+        sink.abort()
+        raise
+
+    if row_count:
+        print(f"Streamed {row_count} rows to s3://{bucket}/{key} "
+              f"in {sink.parts_uploaded} parts (peak RSS {peak_mb:.1f} MB)")
+    return row_count, peak_mb
+
+
+def _write_row_groups(writer, batches, row_group_size):
+    """Write every full row group in batches; returns the leftover batches."""
+    table = pa.Table.from_batches(batches)
+    full = table.num_rows - table.num_rows % row_group_size
+    writer.write_table(table.slice(0, full), row_group_size=row_group_size)
+    return table.slice(full).to_batches()
@@ -0,0 +1,153 @@
+"""
+Native Arrow ingestion for the analytics ETL.
+Runs queries through COPY ... TO STDOUT and parses the stream with Arrow's
+CSV reader in fixed-size blocks, so result rows never become Python objects.
+Null defaults are applied per column with pyarrow.compute afterwards.
+"""
+import os
+import threading
+
+from coldstart import lazy_import
+
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+pacsv = lazy_import('pyarrow.csv')
+
+# Postgres has no date/timestamp text format Arrow parses in every DateStyle,
+# so temporal columns travel as integers from the Unix epoch and are cast back.
+# Entries are (pyarrow.types predicate, wire type alias, SQL cast).
+_WIRE_TYPES = [
+    ('is_timestamp', 'int64', "(extract(epoch from q.{col}) * 1000000)::int8"),
+    ('is_date32', 'int32', "(q.{col}::date - date '1970-01-01')"),
+    ('is_int64', 'int64', 'q.{col}::int8'),
+    ('is_int32', 'int32', 'q.{col}::int4'),
+    ('is_floating', 'float64', 'q.{col}::float8'),
+    ('is_string', 'string', 'q.{col}::text'),
+]
+
+
+def _wire_type(field):
+    for predicate, alias, cast in _WIRE_TYPES:
+        if getattr(pa.types, predicate)(field.type):
+            return pa.type_for_alias(alias), cast
+    raise TypeError(f"No COPY wire type for column {field.name} ({field.type})")
+
+
+def copy_statement(cur, query, params, schema):
+    """Wrap a query in COPY TO STDOUT, casting each column to its wire type."""
+    columns = ', '.join(
+        _wire_type(field)[1].format(col=f'"{field.name}"') for field in schema
+    )
+    bound = cur.mogrify(query, params).decode()
+    return f"COPY (SELECT {columns} FROM ({bound}\n) q) TO STDOUT WITH (FORMAT csv)"
+
+
+def iter_copy_batches(conn, query, params, schema, block_size=4 << 20):
+    """Yield RecordBatches of schema decoded natively from a COPY stream.
+
+    COPY runs on a helper thread that writes into a pipe the CSV reader
+    consumes, so at most about one block of text plus one batch is held in
+    memory. Unquoted empty fields are NULL and quoted ones are empty strings,
+    matching how Postgres writes CSV.
+    """
+    wire_types = {field.name: _wire_type(field)[0] for field in schema}
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    with conn.cursor() as cur:
+        statement = copy_statement(cur, query, params, schema)
+
+    def pump():
+        try:
+            with os.fdopen(write_fd, 'wb') as out, conn.cursor() as cur:
+                cur.copy_expert(statement, out)
+        except Exception as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=pump, name='copy-' + schema.names[0], daemon=True)
+    producer.start()
+    source = os.fdopen(read_fd, 'rb')
+    try:
+        # The CSV reader rejects an empty stream, which is just an empty result here
+        if source.peek(1):
+            reader = pacsv.open_csv(
+                source,
+                read_options=pacsv.ReadOptions(column_names=schema.names, block_size=block_size),
+                # Free-text columns can hold newlines, quoted, and a block may end inside one
+                parse_options=pacsv.ParseOptions(newlines_in_values=True),
+                convert_options=pacsv.ConvertOptions(
+                    column_types=wire_types,
+                    null_values=[''],
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                ),
+            )
+            for batch in reader:
+                yield pa.RecordBatch.from_arrays(
+                    [pc.cast(column, field.type) for column, field in zip(batch.columns, schema)],
+                    schema=schema,
+                )
+    except pa.ArrowInvalid:
+        # A failed COPY truncates the stream; report the database error instead
+        producer.join()
+        if errors:
+            raise errors[0]
+        raise
+    finally:
+        # Closing the read end unblocks a producer still writing if we stopped early
+        source.close()
+        producer.join()
+    if errors:
+        raise errors[0]
+
+
+def read_copy_table(conn, query, params, schema, defaults=None, block_size=4 << 20):
+    """Read a whole query result into an Arrow table through COPY."""
+    batches = [
+        apply_defaults(batch, defaults)
+        for batch in iter_copy_batches(conn, query, params, schema, block_size)
+    ]
+    return pa.Table.from_batches(batches, schema=schema)
+
+
+def rows_to_batch(rows, schema, defaults=None):
+    """Build a RecordBatch from DB-API row tuples, applying column defaults."""
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    batch = pa.RecordBatch.from_arrays(
+        [_to_array(column, field.type) for column, field in zip(columns, schema)],
+        schema=schema,
+    )
+    return apply_defaults(batch, defaults)
+
+
+def rows_to_table(rows, schema, defaults=None):
+    """rows_to_batch, as a single-batch Table."""
+    return pa.Table.from_batches([rows_to_batch(rows, schema, defaults)])
+
+
+def _to_array(values, type):
+    if pa.types.is_floating(type):
+        # AVG() over numeric comes back as Decimal, which Arrow will not coerce to double
+        return pc.cast(pa.array(values), type)
+    return pa.array(values, type=type)
+
+
+def apply_defaults(batch, defaults):
+    """Replace missing values column by column.
+
+    Numeric columns default their NULLs; string columns also default empty
+    strings, as the `value or default` rules they replace did.
+    """
+    if not defaults:
+        return batch
+    columns = []
+    for column, field in zip(batch.columns, batch.schema):
+        default = defaults.get(field.name)
+        if default is not None:
+            default = pa.scalar(default, field.type)
+            if pa.types.is_string(field.type):
+                column = pc.if_else(pc.fill_null(pc.equal(column, ''), True), default, column)
+            else:
+                column = pc.fill_null(column, default)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=batch.schema)
@@ -0,0 +1,214 @@
+"""
+Data-quality gate for exported partitions.
+Each table declares QualityRules next to its layout: unique keys, required
+columns, null-rate ceilings, value ranges, counters expected to be nonzero
+and row-count drift against the previous partition. A QualityCheck
+evaluates them column-wise with pyarrow.compute, over a whole table or
+batch by batch while a partition streams out, and raises QualityError
+before anything is published when a rule fails. Softer signals (counters
+that are zero everywhere, moderate drift) are logged as warnings.
+
+Key uniqueness is checked by comparing each row's key with the next one,
+which is a single linear pass for rows already in key order (exporters
+sort by the same keys for their Parquet layouts). While they stay in
+order only the first and last key seen are kept, so a streamed partition
+costs no memory for it. Keys from the batch where the order breaks on are
+kept for a hash group-by instead.
+"""
+import os
+
+import metrics
+from coldstart import lazy_import
+from parquet_writer import rows_ordered
+
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+
+# With false, failed rules are logged as warnings and the partition is still published
+QUALITY_ENFORCE = os.environ.get('QUALITY_ENFORCE', 'true').lower() == 'true'
+# Day-over-day change in row count (a fraction of the previous partition's rows)
+# that is logged, and that blocks publication
+QUALITY_DRIFT_WARN = float(os.environ.get('QUALITY_DRIFT_WARN', '0.2'))
+QUALITY_DRIFT_FAIL = float(os.environ.get('QUALITY_DRIFT_FAIL', '0.5'))
+# Previous partitions smaller than this are too noisy to measure drift against
+QUALITY_DRIFT_MIN_ROWS = int(os.environ.get('QUALITY_DRIFT_MIN_ROWS', '10'))
+
+
+class QualityError(Exception):
+    """A partition failed a quality rule and was not published."""
+
+
+class QualityRules:
+    """What a table's partitions must satisfy.
+
+    unique: columns that together identify a row. not_null: columns that
+    may never be null; max_null_fraction caps the share of nulls in others.
+    ranges maps a column to inclusive (min, max) bounds, either of which
+    may be None. nonzero: counters that should not be zero in every row.
+    row_drift is the (warn, fail) fraction of day-over-day row-count change.
+    """
+
+    def __init__(self, unique=(), not_null=(), max_null_fraction=None, ranges=None, nonzero=(),
+                 row_drift=None):
+        self.unique = tuple(unique)
+        self.not_null = tuple(not_null)
+        self.max_null_fraction = dict(max_null_fraction or {})
+        self.ranges = dict(ranges or {})
+        self.nonzero = tuple(nonzero)
+        self.row_drift = row_drift or (QUALITY_DRIFT_WARN, QUALITY_DRIFT_FAIL)
+
+
+class QualityCheck:
+    """Running evaluation of one partition against its table's rules.
+
+    Feed it the partition's rows with add() (or wrap a batch iterator with
+    watch()) and call finish() before publishing. previous_rows is the row
+    count of the table's previous partition, if any.
+    """
+
+    def __init__(self, table, rules, previous_rows=None):
+        self.table = table
+        self.rules = rules
+        self.previous_rows = previous_rows
+        self.rows = 0
+        self._nulls = {name: 0 for name in set(rules.not_null) | set(rules.max_null_fraction)}
+        self._bounded = tuple(dict.fromkeys(tuple(rules.ranges) + rules.nonzero))
+        self._bounds = {}
+        # First and last key of the rows added while every key was greater than the one before
+        self._first_key = None
+        self._last_key = None
+        # Keys from where that order broke on, for _duplicate_key
+        self._unordered = []
+        # A key after the break within the ordered rows' range, which may repeat one of them
+        self._unchecked = None
+
+    def add(self, batch):
+        """Fold a RecordBatch (or Table) of the partition's rows into the check."""
+        with metrics.stage('validate'):
+            self.rows += batch.num_rows
+            for name in self._nulls:
+                self._nulls[name] += batch.column(name).null_count
+            # Counters are nonzero somewhere unless their min and max are both zero
+            for name in self._bounded:
+                low, high = pc.min_max(batch.column(name)).values()
+                if low.is_valid:
+                    seen = self._bounds.get(name)
+                    self._bounds[name] = (low.as_py(), high.as_py()) if seen is None else \
+                        (min(seen[0], low.as_py()), max(seen[1], high.as_py()))
+            if self.rules.unique and batch.num_rows:
+                self._add_keys(batch)
+
+    def _add_keys(self, batch):
+        names = self.rules.unique
+        keys = batch.select(names)
+        keys = keys if isinstance(keys, pa.Table) else pa.Table.from_batches([keys])
+        if not self._unordered:
+            # Within the batch, and across the boundary with the last key before it
+            boundary = pa.concat_tables([self._last_key, keys.slice(0, 1)]) if self._last_key is not None else None
+            if rows_ordered(keys, names, strict=True) and (
+                    boundary is None or rows_ordered(boundary, names, strict=True)):
+                if self._first_key is None:
+                    self._first_key = keys.slice(0, 1)
+                self._last_key = keys.slice(keys.num_rows - 1)
+                return
+            # The last ordered key is kept too, so a repeat of it is still found
+            if self._last_key is not None:
+                self._unordered.append(self._last_key)
+        if self._first_key is not None and self._unchecked is None:
+            inside = pc.and_(pc.invert(_keys_before(keys, self._first_key, names)),
+                             _keys_before(keys, self._last_key, names))
+            inside = pc.fill_null(inside, True)
+            if pc.any(inside).as_py():
+                row = pc.index(inside, True).as_py()
+                self._unchecked = {name: keys[name][row].as_py() for name in names}
+        self._unordered.append(keys)
+
+    def watch(self, batches):
+        """Yield batches unchanged, checking each; finish() runs after the last one.
+
+        A failure raises out of the iteration, so a streaming writer aborts
+        its upload instead of publishing the partition. An empty stream
+        publishes nothing and is not checked. batches is closed either way.
+        """
+        try:
+            for batch in batches:
+                self.add(batch)
+                yield batch
+            if self.rows:
+                self.finish()
+        finally:
+            if hasattr(batches, 'close'):
+                batches.close()
+
+    def finish(self):
+        """Raise QualityError if any rule failed; returns the warnings logged."""
+        with metrics.stage('validate'):
+            failures, warnings = self._failures(), self._warnings()
+        if failures and not QUALITY_ENFORCE:
+            warnings, failures = failures + warnings, []
+        for warning in warnings:
+            print(f"Quality warning for {self.table}: {warning}")
+        metrics.count(quality_warnings=len(warnings))
+        if failures:
+            raise QualityError(f"{self.table} failed quality checks: {'; '.join(failures)}")
+        return warnings
+
+    def _failures(self):
+        rules, failures = self.rules, []
+        for name in rules.not_null:
+            if self._nulls[name]:
+                failures.append(f"{name} has {self._nulls[name]} nulls")
+        for name, limit in rules.max_null_fraction.items():
+            if self.rows and self._nulls[name] / self.rows > limit:
+                failures.append(f"{name} is {self._nulls[name] / self.rows:.1%} null (limit {limit:.1%})")
+        for name, (low, high) in rules.ranges.items():
+            if name not in self._bounds:
+                continue
+            seen_low, seen_high = self._bounds[name]
+            if (low is not None and seen_low < low) or (high is not None and seen_high > high):
+                failures.append(f"{name} ranges from {seen_low} to {seen_high}, outside [{low}, {high}]")
+        if rules.unique and self._unordered:
+            duplicate = self._duplicate_key()
+            if duplicate is not None:
+                failures.append(f"key ({', '.join(rules.unique)}) is not unique, e.g. {duplicate}")
+            elif self._unchecked is not None:
+                failures.append(f"key ({', '.join(rules.unique)}) is out of order, e.g. {self._unchecked}, "
+                                f"so it could repeat a key of an earlier batch")
+        drift = self._drift()
+        if drift is not None and drift > rules.row_drift[1]:
+            failures.append(f"{self.rows} rows is {drift:.0%} off the previous partition's {self.previous_rows}")
+        return failures
+
+    def _warnings(self):
+        warnings = [f"{name} is zero in every row" for name in self.rules.nonzero
+                    if self._bounds.get(name, (0, 0)) == (0, 0)]
+        drift = self._drift()
+        if drift is not None and self.rules.row_drift[0] < drift <= self.rules.row_drift[1]:
+            warnings.append(f"{self.rows} rows is {drift:.0%} off the previous partition's {self.previous_rows}")
+        return warnings
+
+    def _drift(self):
+        if not self.previous_rows or self.previous_rows < QUALITY_DRIFT_MIN_ROWS:
+            return None
+        return abs(self.rows - self.previous_rows) / self.previous_rows
+
+    def _duplicate_key(self):
+        """The first key occurring more than once, found with a hash group-by; None if unique."""
+        keys = pa.concat_tables(self._unordered)
+        counts = keys.group_by(self.rules.unique, use_threads=False).aggregate([([], 'count_all')])
+        repeated = counts.filter(pc.greater(counts['count_all'], 1))
+        if not repeated.num_rows:
+            return None
+        return {name: repeated[name][0].as_py() for name in self.rules.unique}
+
+
+def _keys_before(keys, bound, names):
+    """Mask of the rows whose key sorts before that of the one-row table bound."""
+    before = equal = None
+    for name in names:
+        value = bound[name][0]
+        less = pc.less(keys[name], value)
+        before = less if before is None else pc.or_(before, pc.and_(equal, less))
+        same = pc.equal(keys[name], value)
+        equal = same if equal is None else pc.and_(equal, same)
+    return before
@@ -0,0 +1,262 @@
+"""
+Monthly rollups of the curated tables, maintained a day at a time.
+Dashboards want months: usage per tenant, PROM outcomes per region, tenant
+counts and MRR per plan. Instead of scanning every daily partition for
+them, each Rollup keeps one small file per month under
+rollups/<rollup>/month=YYYY-MM/, and after every export the day's new
+input is merged into its month: one read of the day, and one read and
+rewrite of a file of a few kilobytes.
+
+A month's merged state is kept under state/rollups/, with the days it
+contains in its schema metadata, so merging a day twice changes nothing.
+The published file is derived from that state: the PROM rollup merges
+unsuppressed partial aggregates and re-applies k-anonymity to the merged
+month only when publishing it, so cohorts too small on any single day
+still count once the month's days add up. Months are registered in the
+catalog and manifest like any other partition.
+
+Days regenerated by a backfill are stale in the rollups until their
+months are rebuilt from the inputs still in the lake (rebuild_month).
+"""
+import io
+import json
+import time
+from datetime import date, timedelta
+
+import metrics
+from catalog import load_manifest, partition_entry, publish_partitions, table_prefix
+from coldstart import lazy_import
+from parquet_writer import arrow_schema, write_parquet
+from s3_multipart import S3ObjectFile
+
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+pq = lazy_import('pyarrow.parquet')
+
+ROLLUP_PREFIX = 'rollups'
+ROLLUP_STATE_PREFIX = 'state/rollups'
+# Schema metadata of a month's state listing the days merged into it
+DAYS_KEY = b'qivr.rollup.days'
+
+
+def partition_month(date_str):
+    """Month of a dt= partition, for snapshots taken that day."""
+    return date_str[:7]
+
+
+def previous_day_month(date_str):
+    """Month of the day before a dt= partition, the day usage partitions cover."""
+    return (date.fromisoformat(date_str) - timedelta(days=1)).isoformat()[:7]
+
+
+class Rollup:
+    """A monthly table merged together from the days of an exported table.
+
+    By default each day's dt= partition of table is summed per keys (sums,
+    plus the number of rows summed as count), and the month's days are
+    summed again. With snapshot, days are snapshots of the same thing, so
+    the month holds its latest day, whose date goes in the snapshot column.
+    With cohort (a CohortDefinition), a day's input is instead the partial
+    aggregates its exporter staged (see stage_input): they are merged by the
+    cohort, and its k-anonymity threshold is applied when the merged month
+    is published. month_of(date_str) is the month a partition's day counts
+    towards.
+    """
+
+    def __init__(self, name, table, columns, layout, keys=(), sums=(), count=None, snapshot=None,
+                 cohort=None, month_of=partition_month):
+        self.name = name
+        self.table = table
+        self.columns = tuple(columns)
+        self.layout = layout
+        self.keys = tuple(keys)
+        self.sums = tuple(sums)
+        self.count = count
+        self.snapshot = snapshot
+        self.cohort = cohort
+        self.month_of = month_of
+
+    def reduce(self, rows, date_str):
+        """One day's input as that day's state."""
+        if self.cohort is not None:
+            return rows
+        day = sum_rows(rows, self.keys, self.sums, self.count)
+        if self.snapshot is not None:
+            day = day.append_column(self.snapshot, pa.repeat(pa.scalar(date_str), day.num_rows))
+        return day
+
+    def merge(self, states):
+        """The states of several days (or a month so far and a day) as one."""
+        states = _aligned(states)
+        if self.cohort is not None:
+            return self.cohort.merge(states)
+        combined = pa.concat_tables(states)
+        if self.snapshot is not None:
+            return combined.filter(pc.equal(combined[self.snapshot], pc.max(combined[self.snapshot])))
+        return sum_rows(combined, self.keys, self.sums + ((self.count,) if self.count else ()))
+
+    def publish(self, state):
+        """The published table of a month's state."""
+        if self.cohort is not None:
+            return self.cohort.finish(state)
+        schema = arrow_schema(self.columns)
+        return state.select(schema.names).cast(schema)
+
+    def input_key(self, date_str):
+        """Key of a day's input: its staged partials, or the table's dt= partition."""
+        if self.cohort is not None:
+            return f'{ROLLUP_STATE_PREFIX}/{self.name}/dt={date_str}.parquet'
+        return f'{table_prefix(self.table)}dt={date_str}/data.parquet'
+
+
+def sum_rows(table, keys, columns, count=None):
+    """Sums of columns per group of keys, with the group's row count as count if named."""
+    aggregations = [(name, 'sum') for name in columns] + ([([], 'count_all')] if count else [])
+    totals = table.group_by(list(keys), use_threads=False).aggregate(aggregations)
+    names = {f'{name}_sum': name for name in columns}
+    names['count_all'] = count
+    return totals.rename_columns([names.get(name, name) for name in totals.column_names])
+
+
+def _aligned(tables):
+    """Tables with the same columns (in any order), all in the first one's schema."""
+    schema = tables[0].schema.remove_metadata()
+    return [table.select(schema.names).cast(schema) for table in tables]
+
+
+def rollup_key(name, month):
+    return f'{ROLLUP_PREFIX}/{name}/month={month}/data.parquet'
+
+
+def state_key(name, month):
+    return f'{ROLLUP_STATE_PREFIX}/{name}/month={month}.parquet'
+
+
+def _get(s3, bucket, key):
+    """Parquet object as a table, or None if it is missing."""
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return None
+    return pq.read_table(pa.BufferReader(obj['Body'].read()))
+
+
+def _put(s3, bucket, key, table):
+    """Write a small table to key in one put_object."""
+    sink = io.BytesIO()
+    pq.write_table(table, sink, compression='zstd')
+    s3.put_object(Bucket=bucket, Key=key, Body=sink.getvalue())
+
+
+def stage_input(s3, bucket, rollup, date_str, partials):
+    """Stage a cohort rollup's partial aggregates for a partition day."""
+    _put(s3, bucket, rollup.input_key(date_str), partials)
+
+
+def read_input(s3, bucket, rollup, date_str):
+    """A day's input, or None if there is none.
+
+    Partitions already compacted are read from their month's file, one day
+    of row groups at a time.
+    """
+    with metrics.stage('read_previous'):
+        rows = _get(s3, bucket, rollup.input_key(date_str))
+        if rows is not None or rollup.cohort is not None:
+            return rows
+        monthly = load_manifest(s3, bucket, f'{rollup.table}_monthly')['partitions'].get(
+            f'month={date_str[:7]}')
+        if monthly is None:
+            return None
+        rows = pq.read_table(S3ObjectFile(s3, bucket, monthly['key']), filters=[('dt', '=', date_str)])
+        return rows.drop_columns(['dt']) if rows.num_rows else None
+
+
+def read_state(s3, bucket, rollup, month):
+    """A month's state and the days merged into it; (None, []) before its first day."""
+    with metrics.stage('read_previous'):
+        state = _get(s3, bucket, state_key(rollup.name, month))
+    if state is None:
+        return None, []
+    return state, json.loads(state.schema.metadata[DAYS_KEY])
+
+
+def publish_month(s3, bucket, catalog, rollup, month, state, days):
+    """Write a month's published file and register it, then save its state.
+
+    The state is saved last: until it is, its new days count as not merged,
+    and merging them again publishes the same month.
+    """
+    table = rollup.layout.sort(rollup.publish(state))
+    key = rollup_key(rollup.name, month)
+    size = write_parquet(s3, bucket, key, table, rollup.layout)
+    with metrics.stage('register'):
+        publish_partitions(s3, bucket, catalog, rollup.name,
+                           [partition_entry({'month': month}, bucket, key, table.num_rows, size)])
+    with metrics.stage('upload'):
+        _put(s3, bucket, state_key(rollup.name, month),
+             state.replace_schema_metadata({DAYS_KEY: json.dumps(sorted(days))}))
+    return {'status': 'merged', 'month': month, 'days': len(days), 'rows': table.num_rows, 'bytes': size}
+
+
+def merge_day(s3, bucket, catalog, rollup, date_str):
+    """Merge one dt= partition's day into its month of a rollup."""
+    month = rollup.month_of(date_str)
+    state, days = read_state(s3, bucket, rollup, month)
+    if date_str in days:
+        return {'status': 'skipped', 'month': month, 'reason': f'{date_str} already merged'}
+    rows = read_input(s3, bucket, rollup, date_str)
+    if rows is None:
+        return {'status': 'skipped', 'month': month, 'reason': f'no input for {date_str}'}
+    with metrics.stage('aggregate'):
+        day = rollup.reduce(rows, date_str)
+        state = day if state is None else rollup.merge([state, day])
+    return publish_month(s3, bucket, catalog, rollup, month, state, days + [date_str])
+
+
+def month_days(rollup, month):
+    """Every partition date whose day counts towards month."""
+    first = date.fromisoformat(f'{month}-01')
+    candidates = (first + timedelta(days=i) for i in range(33))
+    return [d.isoformat() for d in candidates if rollup.month_of(d.isoformat()) == month]
+
+
+def rebuild_month(s3, bucket, catalog, rollup, month):
+    """Recompute a month from scratch from every day's input still in the lake."""
+    days, states = [], []
+    for date_str in month_days(rollup, month):
+        rows = read_input(s3, bucket, rollup, date_str)
+        if rows is not None:
+            with metrics.stage('aggregate'):
+                states.append(rollup.reduce(rows, date_str))
+            days.append(date_str)
+    if not states:
+        return {'status': 'skipped', 'month': month, 'reason': 'no inputs'}
+    with metrics.stage('aggregate'):
+        state = rollup.merge(states)
+    return publish_month(s3, bucket, catalog, rollup, month, state, days)
+
+
+def update_rollups(s3, bucket, catalog, rollups, date_str, run_metrics=None, rebuild=False):
+    """Merge a partition date into each rollup (or rebuild its month); {name: result}.
+
+    One rollup failing does not stop the others. Stage timings and counters
+    go to run_metrics, one table per rollup, when one is passed.
+    """
+    results = {}
+    for rollup in rollups:
+        started = time.monotonic()
+        table_metrics = run_metrics.table(rollup.name) if run_metrics is not None else None
+        try:
+            with metrics.recording(table_metrics):
+                if rebuild:
+                    result = rebuild_month(s3, bucket, catalog, rollup, rollup.month_of(date_str))
+                else:
+                    result = merge_day(s3, bucket, catalog, rollup, date_str)
+        except Exception as e:
+            print(f"Rollup {rollup.name} for {date_str} failed: {e}")
+            result = {'status': 'failed', 'error': str(e)}
+        result['seconds'] = round(time.monotonic() - started, 2)
+        if result['status'] == 'skipped':
+            print(f"Rollup {rollup.name} {result['month']}: {result['reason']}")
+        results[rollup.name] = result
+    return results
@@ -0,0 +1,217 @@
+"""
+Streaming S3 multipart upload sink.
+A write-only file object that ships bytes to S3 as they are produced, so a
+ParquetWriter (or any writer) can stream row groups straight into a multipart
+upload without the whole file ever being buffered in memory. S3ObjectFile is
+the read-side counterpart, fetching byte ranges on demand.
+"""
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+S3_PART_SIZE_MB = int(os.environ.get('S3_PART_SIZE_MB', '8'))
+S3_UPLOAD_CONCURRENCY = int(os.environ.get('S3_UPLOAD_CONCURRENCY', '4'))
+S3_PART_RETRIES = int(os.environ.get('S3_PART_RETRIES', '3'))
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+
+
+class S3MultipartWriter:
+    """File-like sink that uploads fixed-size parts in parallel.
+
+    At most `concurrency` parts are in flight plus the one being filled, which
+    bounds memory at roughly (concurrency + 1) * part_size. Each part is
+    retried with exponential backoff; if any part ultimately fails the upload
+    is aborted so no orphaned parts are left behind. Outputs smaller than one
+    part are sent with a single put_object.
+
+    Use as a context manager: a clean exit completes the upload, an exception
+    aborts it.
+    """
+
+    def __init__(self, s3, bucket, key, part_size=None, concurrency=None, retries=None,
+                 content_type='application/octet-stream', metadata=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size or S3_PART_SIZE_MB * 1024 * 1024, MIN_PART_SIZE)
+        self.concurrency = max(1, concurrency or S3_UPLOAD_CONCURRENCY)
+        self.retries = S3_PART_RETRIES if retries is None else retries
+        self.content_type = content_type
+        self.metadata = dict(metadata or {})
+        self.closed = False
+        self.bytes_written = 0
+        self.parts_uploaded = 0
+
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._executor = None
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed S3MultipartWriter')
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            # Hand the filled buffer itself to the upload; only the tail is copied
+            part, self._buffer = self._buffer, self._buffer[self.part_size:]
+            del part[self.part_size:]
+            self._submit_part(part)
+        return len(data)
+
+    def close(self):
+        """Upload the remaining bytes and complete the upload."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._upload_id is None:
+                self.s3.put_object(
+                    Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),
+                    ContentType=self.content_type, Metadata=self.metadata,
+                )
+                self.parts_uploaded = 1
+                return
+            if self._buffer:
+                self._submit_part(self._buffer)
+            self._buffer = bytearray()
+            parts = [future.result() for future in self._futures]
+            self.parts_uploaded = len(parts)
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        except Exception:
+            self._abort()
+            raise
+        finally:
+            self._shutdown()
+
+    def abort(self):
+        """Discard everything written so far."""
+        if self.closed:
+            return
+        self.closed = True
+        self._buffer = bytearray()
+        self._abort()
+        self._shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _submit_part(self, body):
+        if self._upload_id is None:
+            resp = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type, Metadata=self.metadata
+            )
+            self._upload_id = resp['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        # Fail fast instead of queueing more parts behind a broken upload
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        self._slots.acquire()
+        part_number = len(self._futures) + 1
+        self._futures.append(self._executor.submit(self._upload_part, part_number, body))
+
+    def _upload_part(self, part_number, body):
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    resp = self.s3.upload_part(
+                        Bucket=self.bucket,
+                        Key=self.key,
+                        UploadId=self._upload_id,
+                        PartNumber=part_number,
+                        Body=body,
+                    )
+                    return {'PartNumber': part_number, 'ETag': resp['ETag']}
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    delay = 0.2 * 2 ** attempt
+                    print(f"Part {part_number} of s3://{self.bucket}/{self.key} failed ({e}); "
+                          f"retrying in {delay:.1f}s")
+                    time.sleep(delay)
+        finally:
+            self._slots.release()
+
+    def _abort(self):
+        if self._upload_id is None:
+            return
+        for future in self._futures:
+            future.cancel()
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            print(f"Aborted multipart upload of s3://{self.bucket}/{self.key}")
+        except Exception as e:
+            print(f"Failed to abort multipart upload of s3://{self.bucket}/{self.key}: {e}")
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class S3ObjectFile(io.RawIOBase):
+    """Read-only, seekable view of an S3 object that fetches byte ranges on demand.
+
+    Lets pyarrow read a Parquet footer and then single row groups without
+    downloading the whole object.
+    """
+
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, b):
+        if self._pos >= self.size or not len(b):
+            return 0
+        end = min(self._pos + len(b), self.size) - 1
+        data = self.s3.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f'bytes={self._pos}-{end}'
+        )['Body'].read()
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
@@ -0,0 +1,137 @@
+"""
+Tenant-sharded extraction for the per-tenant exports.
+A whole-fleet aggregate runs as one statement, so the largest clinic decides
+when it finishes and statement_timeout applies to every tenant at once.
+Sharded exports split the tenant id space into contiguous ranges, run each
+range as its own query on parallel connections, and hand the results back
+in id order, so they stream into one sorted Parquet file. A shard that runs
+past its time budget is cancelled, split in two and both halves retried.
+
+Ranges are either even slices of the UUID space ('hash': tenant ids are
+random UUIDs, so this balances tenant counts the way hashing would) or cut
+at equal shares of a per-tenant weight ('size'), such as each tenant's row
+counts in the previous partition.
+"""
+import bisect
+import os
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Times a shard may be halved after running over budget before it runs unbudgeted
+SHARD_MAX_SPLITS = int(os.environ.get('SHARD_MAX_SPLITS', '4'))
+
+_ID_SPACE = 1 << 128
+
+
+class ShardTimeout(Exception):
+    """A shard's query ran past its time budget."""
+
+
+class TenantWeights:
+    """Per-tenant weights, kept sorted by id for cutting ranges."""
+
+    def __init__(self, ids, weights):
+        pairs = sorted(zip(ids, weights))
+        self.ids = [uuid.UUID(i).int for i, _ in pairs]
+        self.cumulative = []
+        total = 0
+        for _, weight in pairs:
+            total += weight
+            self.cumulative.append(total)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def cut(self, low, high, share):
+        """The id in [low, high) where share of that range's weight is reached.
+
+        None if fewer than two known tenants fall in the range.
+        """
+        start = bisect.bisect_left(self.ids, low)
+        end = bisect.bisect_left(self.ids, high)
+        if end - start < 2:
+            return None
+        before = self.cumulative[start - 1] if start else 0
+        target = before + (self.cumulative[end - 1] - before) * share
+        # The first tenant always stays below the cut, so neither side is empty
+        index = max(start + 1, min(end - 1, bisect.bisect_left(self.cumulative, target, start, end)))
+        return self.ids[index]
+
+
+class TenantShard:
+    """Tenants with ids in [low, high); None leaves that end of the range open."""
+
+    def __init__(self, low=None, high=None, splits=0):
+        self.low = low
+        self.high = high
+        self.splits = splits
+
+    def predicate(self, column):
+        """SQL restricting a uuid column to this shard, to append to a WHERE clause."""
+        clauses = ''
+        if self.low is not None:
+            clauses += f' AND {column} >= %(shard_low)s::uuid'
+        if self.high is not None:
+            clauses += f' AND {column} < %(shard_high)s::uuid'
+        return clauses
+
+    def params(self):
+        return {'shard_low': self.low, 'shard_high': self.high}
+
+    def split(self, weights=None):
+        """Two shards covering this one, cut by weight where known; None if it cannot be split."""
+        low = uuid.UUID(self.low).int if self.low is not None else 0
+        high = uuid.UUID(self.high).int if self.high is not None else _ID_SPACE
+        cut = weights.cut(low, high, 0.5) if weights is not None else None
+        if cut is None:
+            if high - low < 2:
+                return None
+            cut = (low + high) // 2
+        middle = str(uuid.UUID(int=cut))
+        return (TenantShard(self.low, middle, self.splits + 1),
+                TenantShard(middle, self.high, self.splits + 1))
+
+    def __repr__(self):
+        return f"[{self.low or '-'}, {self.high or '-'})"
+
+
+def plan_shards(count, weights=None):
+    """count shards covering every tenant id, balanced by weights when given."""
+    if weights is not None and len(weights) >= count:
+        cuts = [weights.cut(0, _ID_SPACE, i / count) for i in range(1, count)]
+    else:
+        cuts = [_ID_SPACE * i // count for i in range(1, count)]
+    bounds = [None] + [str(uuid.UUID(int=c)) for c in sorted(set(cuts)) if c] + [None]
+    return [TenantShard(low, high) for low, high in zip(bounds, bounds[1:])]
+
+
+def iter_shard_results(shards, run, workers, weights=None, max_splits=SHARD_MAX_SPLITS):
+    """Yield (shard, result) in id order, running up to workers shards at once.
+
+    run(shard, budgeted) returns a shard's result; when budgeted it may raise
+    ShardTimeout instead, and the shard is split and both halves are run in
+    its place. A shard split max_splits times, or that cannot be split, is
+    run once more without a budget.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shard') as pool:
+        pending = deque((shard, pool.submit(run, shard, True)) for shard in shards)
+        try:
+            while pending:
+                shard, future = pending.popleft()
+                try:
+                    result = future.result()
+                except ShardTimeout:
+                    halves = shard.split(weights) if shard.splits < max_splits else None
+                    if halves is None:
+                        print(f"Shard {shard} is over its time budget; running it without one")
+                        pending.appendleft((shard, pool.submit(run, shard, False)))
+                    else:
+                        print(f"Shard {shard} is over its time budget; splitting it")
+                        for half in reversed(halves):
+                            pending.appendleft((half, pool.submit(run, half, True)))
+                    continue
+                yield shard, result
+        finally:
+            for _, future in pending:
+                future.cancel()
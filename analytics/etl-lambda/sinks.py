@@ -0,0 +1,313 @@
+"""
+Output sinks for the ETL.
+Writers and readers take an S3 client and call a small subset of it
+(objects, multipart uploads, listings). A sink is anything with that
+subset:
+
+- 's3': boto3's client, writing to the data lake
+- 'local': a directory standing in for the buckets, as <root>/<bucket>/<key>,
+  optionally read back through memory maps: a body's read() is then a
+  memoryview over the map rather than a copy of the bytes
+- 'null': keeps each object's size and metadata and discards its bytes, so
+  extraction and encoding can be profiled with no upload at all
+
+Readers take whatever a body's read() returns as a bytes-like object (for
+Parquet, through pa.BufferReader, which does not copy it).
+
+The Lambdas pick theirs with OUTPUT_SINK or the event's 'sink' field. Every
+sink but 's3' comes with an in-memory Glue catalog, so a dry run never
+registers partitions in the real one.
+"""
+import mmap
+import os
+import shutil
+import threading
+import uuid
+from functools import lru_cache
+
+from coldstart import lazy_client
+
+OUTPUT_SINK = os.environ.get('OUTPUT_SINK', 's3')  # 's3', 'local' or 'null'
+# Root directory of the 'local' sink; /tmp is the only writable path on Lambda
+OUTPUT_ROOT = os.environ.get('OUTPUT_ROOT', '/tmp/qivr-lake')
+# Read objects in the 'local' sink back through memory maps instead of file reads
+OUTPUT_MEMORY_MAP = os.environ.get('OUTPUT_MEMORY_MAP', 'false').lower() == 'true'
+
+SINKS = ('s3', 'local', 'null')
+
+
+class _Exceptions:
+    class NoSuchKey(Exception):
+        pass
+
+
+class _Body:
+    """A file's bytes start to end (inclusive), read all at once or amt at a time like botocore's.
+
+    Memory-mapped, read() returns a memoryview over the map instead of
+    bytes; the map stays open as long as any view of it does.
+    """
+
+    def __init__(self, path, start=0, end=None, memory_map=False):
+        self._path = path
+        self._pos = start
+        self._end = end
+        self._memory_map = memory_map
+
+    def read(self, amt=None):
+        with open(self._path, 'rb') as f:
+            end = os.fstat(f.fileno()).st_size if self._end is None else self._end + 1
+            if amt is not None:
+                end = min(end, self._pos + amt)
+            start, self._pos = self._pos, max(self._pos, end)
+            if self._memory_map and end > start:
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))[start:end]
+            f.seek(start)
+            return f.read(max(0, end - start))
+
+
+def _etag(path):
+    """Stand-in ETag of a local file, changing whenever it is rewritten."""
+    stat = os.stat(path)
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+class LocalSink:
+    """The subset of boto3's S3 client the ETL uses, over a local directory.
+
+    User metadata is kept in memory, so it lasts as long as the sink does.
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self, root, memory_map=False):
+        self.root = root
+        self.memory_map = memory_map
+        self._uploads = {}
+        self._metadata = {}
+        self._lock = threading.Lock()
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def _write(self, bucket, key, body):
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(body)
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self._write(Bucket, Key, bytes(Body))
+        self._metadata[Bucket, Key] = dict(Metadata or {})
+        return {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        path = self.path(Bucket, Key)
+        if not os.path.exists(path):
+            raise self.exceptions.NoSuchKey(Key)
+        if Range is None:
+            return {'Body': _Body(path, memory_map=self.memory_map), 'ETag': _etag(path)}
+        start, end = Range[len('bytes='):].split('-')
+        return {'Body': _Body(path, int(start), int(end), self.memory_map), 'ETag': _etag(path)}
+
+    def head_object(self, Bucket, Key):
+        path = self.path(Bucket, Key)
+        if not os.path.exists(path):
+            raise self.exceptions.NoSuchKey(Key)
+        return {'ContentLength': os.path.getsize(path), 'ETag': _etag(path),
+                'Metadata': self._metadata.get((Bucket, Key), {})}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            path = self.path(Bucket, obj['Key'])
+            if os.path.exists(path):
+                os.remove(path)
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource):
+        source = self.path(CopySource['Bucket'], CopySource['Key'])
+        target = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source, target)
+        self._metadata[Bucket, Key] = self._metadata.get((CopySource['Bucket'], CopySource['Key']), {})
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, **kwargs):
+        base = os.path.join(self.root, Bucket)
+        keys = []
+        for dirpath, _, files in os.walk(base):
+            for name in files:
+                key = os.path.relpath(os.path.join(dirpath, name), base).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    keys.append(key)
+        keys = sorted(keys)[:MaxKeys]
+        return {'KeyCount': len(keys), 'Contents': [{'Key': k, 'Size': os.path.getsize(self.path(Bucket, k))}
+                                                    for k in keys]}
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {}
+            self._metadata[Bucket, Key] = dict(Metadata or {})
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self._lock:
+            self._uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        with self._lock:
+            parts = self._uploads.pop(UploadId)
+        self._write(Bucket, Key, b''.join(parts[p['PartNumber']] for p in MultipartUpload['Parts']))
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def prefix_bytes(self, bucket, prefix):
+        """Total size of every object under a key prefix."""
+        return sum(obj['Size'] for obj in self.list_objects_v2(bucket, prefix, MaxKeys=10 ** 9)['Contents'])
+
+
+class NullSink:
+    """The subset of boto3's S3 client the ETL uses, discarding every object's bytes.
+
+    Sizes and metadata are kept, so anything that only heads or lists what
+    was written still works; reading an object back raises NoSuchKey.
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self):
+        self.bytes_discarded = 0
+        self._objects = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def _record(self, bucket, key, size, metadata):
+        with self._lock:
+            self._objects[bucket, key] = (size, dict(metadata or {}))
+            self.bytes_discarded += size
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self._record(Bucket, Key, len(Body), Metadata)
+        return {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        raise self.exceptions.NoSuchKey(Key)
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self._objects:
+            raise self.exceptions.NoSuchKey(Key)
+        size, metadata = self._objects[Bucket, Key]
+        return {'ContentLength': size, 'Metadata': metadata}
+
+    def delete_objects(self, Bucket, Delete):
+        with self._lock:
+            for obj in Delete['Objects']:
+                self._objects.pop((Bucket, obj['Key']), None)
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource):
+        source = self.head_object(CopySource['Bucket'], CopySource['Key'])
+        self._record(Bucket, Key, source['ContentLength'], source['Metadata'])
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, **kwargs):
+        keys = sorted(k for b, k in self._objects if b == Bucket and k.startswith(Prefix))[:MaxKeys]
+        return {'KeyCount': len(keys), 'Contents': [{'Key': k, 'Size': self._objects[Bucket, k][0]}
+                                                    for k in keys]}
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = (dict(Metadata or {}), {})
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self._lock:
+            self._uploads[UploadId][1][PartNumber] = len(Body)
+        return {'ETag': f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        with self._lock:
+            metadata, sizes = self._uploads.pop(UploadId)
+        self._record(Bucket, Key, sum(sizes[p['PartNumber']] for p in MultipartUpload['Parts']), metadata)
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def prefix_bytes(self, bucket, prefix):
+        """Total size of every object under a key prefix."""
+        return sum(obj['Size'] for obj in self.list_objects_v2(bucket, prefix, MaxKeys=10 ** 9)['Contents'])
+
+
+class MemoryGlue:
+    """The subset of boto3's Glue client catalog.GlueCatalog uses, in memory.
+
+    Every table exists with a minimal storage descriptor; partitions are
+    kept per table so dry runs and benchmarks can check what was registered.
+    """
+
+    def __init__(self):
+        self.partitions = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_table(self, DatabaseName, Name):
+        return {'Table': {'Name': Name, 'StorageDescriptor': {
+            'Location': f's3://local/{Name}/',
+            'InputFormat': 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
+        }}}
+
+    def batch_create_partition(self, DatabaseName, TableName, PartitionInputList):
+        errors = []
+        with self._lock:
+            self.calls += 1
+            table = self.partitions.setdefault(TableName, {})
+            for partition in PartitionInputList:
+                values = tuple(partition['Values'])
+                if values in table:
+                    errors.append({'PartitionValues': list(values),
+                                   'ErrorDetail': {'ErrorCode': 'AlreadyExistsException'}})
+                else:
+                    table[values] = partition['StorageDescriptor']['Location']
+        return {'Errors': errors}
+
+    def batch_delete_partition(self, DatabaseName, TableName, PartitionsToDelete):
+        errors = []
+        with self._lock:
+            self.calls += 1
+            table = self.partitions.setdefault(TableName, {})
+            for partition in PartitionsToDelete:
+                values = tuple(partition['Values'])
+                if table.pop(values, None) is None:
+                    errors.append({'PartitionValues': list(values),
+                                   'ErrorDetail': {'ErrorCode': 'EntityNotFoundException'}})
+        return {'Errors': errors}
+
+
+@lru_cache(maxsize=None)
+def sink_client(kind=OUTPUT_SINK, root=OUTPUT_ROOT, memory_map=OUTPUT_MEMORY_MAP):
+    """The S3 client (or stand-in) for a sink; one per sink, so warm runs reuse it."""
+    if kind == 's3':
+        return lazy_client('s3')
+    if kind == 'local':
+        return LocalSink(root, memory_map)
+    if kind == 'null':
+        return NullSink()
+    raise ValueError(f"Unknown output sink {kind!r}; expected one of {', '.join(SINKS)}")
+
+
+@lru_cache(maxsize=None)
+def catalog_client(kind=OUTPUT_SINK):
+    """The Glue client partitions written to a sink are registered with."""
+    if kind not in SINKS:
+        raise ValueError(f"Unknown output sink {kind!r}; expected one of {', '.join(SINKS)}")
+    return lazy_client('glue') if kind == 's3' else MemoryGlue()
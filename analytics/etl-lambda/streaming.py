@@ -0,0 +1,36 @@
+"""
+Streaming helpers for the analytics ETL.
+Reads query results through server-side cursors in fixed-size batches so the
+full result set never has to sit in Lambda memory at once.
+"""
+import os
+import resource
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def iter_row_batches(conn, query, params=None, batch_size=10000, name='etl_export'):
+    """Yield lists of rows from a named (server-side) cursor."""
+    with conn.cursor(name=name) as cur:
+        cur.itersize = batch_size
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def current_rss_mb():
+    """Resident set size of this process right now, in MB."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """High-water resident set size of this process, in MB."""
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
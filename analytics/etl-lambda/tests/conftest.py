@@ -0,0 +1,43 @@
+"""
+Shared fixtures for the ETL tests.
+The modules under test import each other by bare name, as they do on Lambda,
+so etl-lambda/ goes on the path. The lake is a LocalSink in a temporary
+directory and the Glue catalog an in-memory one; nothing reaches AWS.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-2')
+
+import sinks  # noqa: E402
+from catalog import GlueCatalog  # noqa: E402
+
+
+@pytest.fixture
+def lake(tmp_path):
+    """A local sink standing in for the data lake bucket."""
+    return sinks.LocalSink(str(tmp_path / 'lake'))
+
+
+@pytest.fixture
+def handler(lake, monkeypatch):
+    """handler.py writing to the local lake whatever sink an event names, registering partitions in memory."""
+    import handler as module
+    monkeypatch.setattr(module, 's3', lake)
+    monkeypatch.setattr(module, 'sink_client', lambda kind: lake)
+    monkeypatch.setattr(module, 'glue', sinks.MemoryGlue())
+    monkeypatch.setattr(module, 'partition_catalog', GlueCatalog(module.glue))
+    return module
+
+
+@pytest.fixture
+def lambda_function(lake, monkeypatch):
+    """lambda_function.py writing to the local lake whatever sink an event names."""
+    import lambda_function as module
+    monkeypatch.setattr(module, 's3', lake)
+    monkeypatch.setattr(module, 'partition_catalog', GlueCatalog(sinks.MemoryGlue()))
+    monkeypatch.setattr(module, 'sink_client', lambda kind: lake)
+    return module
@@ -0,0 +1,91 @@
+"""Stand-ins for the database, Secrets Manager and the Lambda context."""
+import json
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.itersize = None
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        if self.conn.closed:
+            raise self.conn.error('connection already closed')
+        self.conn.queries.append((query, params))
+        self._rows = list(self.conn.respond(query, params))
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+
+class FakeConnection:
+    """A psycopg2- or pg8000.native-style connection whose queries are answered by respond(query, params) -> rows."""
+
+    error = ConnectionError
+
+    def __init__(self, respond=lambda query, params: [], creds=None):
+        self.respond = respond
+        self.creds = creds
+        self.queries = []
+        self.closed = 0
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def run(self, query, **params):
+        if self.closed:
+            raise self.error('connection already closed')
+        self.queries.append((query, params))
+        return list(self.respond(query, params))
+
+    def rollback(self):
+        if self.closed:
+            raise self.error('connection already closed')
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeSecrets:
+    """Secrets Manager's get_secret_value over a dict of secrets, counting calls."""
+
+    def __init__(self, secrets):
+        self.secrets = dict(secrets)
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        return {'SecretString': json.dumps(self.secrets[SecretId])}
+
+
+class FakeContext:
+    """A Lambda context whose remaining time runs down by step_ms at every call."""
+
+    function_name = 'qivr-analytics-etl'
+    aws_request_id = 'test-request'
+
+    def __init__(self, remaining_ms, step_ms=0):
+        self.remaining_ms = remaining_ms
+        self.step_ms = step_ms
+
+    def get_remaining_time_in_millis(self):
+        remaining = self.remaining_ms
+        self.remaining_ms -= self.step_ms
+        return remaining
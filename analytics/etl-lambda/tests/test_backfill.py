@@ -0,0 +1,60 @@
+"""backfill.py's per-day runs on pooled connections."""
+from datetime import date
+
+import pytest
+
+import backfill
+from fakes import FakeConnection
+from warm_cache import ConnectionCache
+
+DAY = date(2024, 3, 2)
+
+
+@pytest.fixture
+def connections(handler, monkeypatch):
+    """The connections a worker's cache opens, in order."""
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    def ping(conn):
+        if conn.closed:
+            raise conn.error('connection already closed')
+    monkeypatch.setattr(handler, 'connection_cache', ConnectionCache(connect, ping))
+    return opened
+
+
+def test_dropped_connection_is_replaced_for_the_next_table_and_day(connections, monkeypatch):
+    def export(conn, table, day, streaming):
+        if table == 'tenants':
+            conn.close()
+            raise conn.error('server closed the connection unexpectedly')
+        return 3, None
+    monkeypatch.setattr(backfill, 'export_partition', export)
+
+    result = backfill.backfill_day(DAY, ['tenants', 'usage'])
+    assert result['tables']['tenants']['status'] == 'failed'
+    assert result['tables']['usage']['status'] == 'succeeded'
+    assert len(connections) == 2
+
+    # The live connection is kept for the worker's next day
+    assert backfill.backfill_day(DAY, ['usage'])['tables']['usage']['status'] == 'succeeded'
+    assert len(connections) == 2
+
+
+def test_day_fails_alone_when_no_connection_opens(handler, monkeypatch):
+    def connect():
+        raise ConnectionError('could not connect to server')
+    monkeypatch.setattr(handler, 'connection_cache', ConnectionCache(connect, lambda conn: None))
+
+    result = backfill.backfill_day(DAY, ['tenants', 'usage'], skip=('usage',))
+    assert result['tables'] == {'tenants': {'status': 'failed', 'error': 'could not connect to server'},
+                                'usage': {'status': 'skipped'}}
+
+
+def test_skipped_tables_need_no_connection(connections):
+    result = backfill.backfill_day(DAY, ['tenants'], skip=('tenants',))
+    assert result == {'date': '2024-03-02', 'tables': {'tenants': {'status': 'skipped'}}}
+    assert connections == []
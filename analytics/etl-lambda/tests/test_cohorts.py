@@ -0,0 +1,94 @@
+"""CohortDefinition's age brackets and k-anonymity suppression, and CohortAggregator's batched merging."""
+from collections import Counter
+
+import pyarrow as pa
+import pytest
+
+import cohorts
+from cohorts import CohortAggregator, CohortDefinition, aggregate
+
+COLUMNS = (
+    ('region', 'string'),
+    ('gender', 'string'),
+    ('avg_baseline', 'float64'),
+    ('avg_final', 'float64'),
+    ('patient_count', 'int32'),
+)
+
+
+def prom_rows(cells, age=40):
+    """One row per patient of {(region, gender): patients}, scores 1.0 to n."""
+    rows = [(region, gender, float(i), float(i + 1)) for (region, gender), n in cells.items() for i in range(n)]
+    return pa.table({
+        'region': [r[0] for r in rows], 'prom_type': ['ODI'] * len(rows),
+        'age': pa.array([age] * len(rows), pa.int32()), 'gender': [r[1] for r in rows],
+        'baseline_score': [r[2] for r in rows], 'final_score': [r[3] for r in rows],
+    })
+
+
+def published(definition, rows):
+    table = aggregate(rows, [definition])[definition.name]
+    return {(row['region'], row['gender']): row['patient_count'] for row in table.to_pylist()}
+
+
+@pytest.mark.parametrize('age, bracket', [
+    (0, '18-29'), (17, '18-29'), (18, '18-29'), (29, '18-29'), (30, '30-44'),
+    (44, '30-44'), (45, '45-59'), (59, '45-59'), (60, '60+'), (104, '60+'), (None, '60+'),
+])
+def test_age_bracket_boundaries_and_unknown_ages(age, bracket):
+    definition = CohortDefinition('outcomes', [('age_bracket', 'string'), ('patient_count', 'int32')], k=1)
+    assert definition.age_brackets(pa.array([age], pa.int32())).to_pylist() == [bracket]
+
+
+def test_cohorts_below_k_are_suppressed():
+    definition = CohortDefinition('outcomes', COLUMNS, k=5)
+    assert published(definition, prom_rows({('NSW', 'F'): 5, ('NSW', 'M'): 4, ('VIC', 'F'): 9})) == {
+        ('NSW', 'F'): 5, ('VIC', 'F'): 9,
+    }
+
+
+def test_published_averages_are_over_the_cohorts_rows():
+    definition = CohortDefinition('outcomes', COLUMNS, k=1)
+    row = aggregate(prom_rows({('NSW', 'F'): 3}), [definition])['outcomes'].to_pylist()[0]
+    assert (row['avg_baseline'], row['avg_final'], row['patient_count']) == (1.0, 2.0, 3)
+
+
+def test_complementary_suppression_leaves_no_lone_suppressed_cell():
+    definition = CohortDefinition('outcomes', COLUMNS, k=5, complementary=True)
+    cells = {('NSW', 'F'): 9, ('NSW', 'M'): 2, ('NSW', 'X'): 6, ('VIC', 'F'): 7, ('VIC', 'M'): 8}
+    kept = published(definition, prom_rows(cells))
+    # NSW/M is below k; NSW/X, the smallest cell left in NSW, goes with it so
+    # the NSW total minus the published cells does not reveal NSW/M
+    assert kept == {('NSW', 'F'): 9, ('VIC', 'F'): 7, ('VIC', 'M'): 8}
+    suppressed = Counter(region for region, gender in cells if (region, gender) not in kept)
+    assert all(n != 1 for n in suppressed.values())
+
+
+def test_complementary_suppression_drops_every_cell_tied_for_smallest():
+    definition = CohortDefinition('outcomes', COLUMNS, k=5, complementary=True)
+    cells = {('NSW', 'F'): 6, ('NSW', 'M'): 1, ('NSW', 'X'): 6, ('NSW', 'U'): 8}
+    assert published(definition, prom_rows(cells)) == {('NSW', 'U'): 8}
+
+
+def test_batched_merges_equal_a_single_pass(monkeypatch):
+    monkeypatch.setattr(cohorts, 'MERGE_EVERY', 2)
+    definitions = [
+        CohortDefinition('outcomes', COLUMNS, k=3, complementary=True),
+        CohortDefinition('by_age', [('age_bracket', 'string'), ('patient_count', 'int32')], k=1),
+    ]
+    cells = {(region, gender): 1 + (i * 7) % 11 for i, (region, gender) in
+             enumerate((r, g) for r in ('NSW', 'QLD', 'VIC', 'WA') for g in ('F', 'M', 'X'))}
+    rows = pa.concat_tables([prom_rows(cells, age=age) for age in (17, 30, 64, 80)])
+
+    single = CohortAggregator(definitions, chunk_rows=rows.num_rows)
+    single.add(rows)
+    batched = CohortAggregator(definitions, chunk_rows=7)
+    for batch in rows.to_batches(max_chunksize=5):
+        batched.add(batch)
+
+    assert batched.rows == single.rows == rows.num_rows
+    batched_totals, batched_results = batched.totals(), batched.results()
+    for definition in definitions:
+        keys = [(name, 'ascending') for name in definition.dimensions]
+        assert batched_totals[definition.name].sort_by(keys).equals(single.totals()[definition.name].sort_by(keys))
+        assert batched_results[definition.name].sort_by(keys).equals(single.results()[definition.name].sort_by(keys))
@@ -0,0 +1,41 @@
+"""Cold-start budget of the Lambda entry modules, measured in fresh interpreters.
+
+The same measurement as benchmarks/bench_cold_start.py, held to
+COLD_START_BUDGET_MS (default 150 ms) for the median of a few imports.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import pytest
+
+COLD_START_BUDGET_MS = float(os.environ.get('COLD_START_BUDGET_MS', '150'))
+ETL_LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('pyarrow', 'psycopg2', 'pg8000', 'boto3', 'botocore')
+RUNS = 3
+
+# Runs in the child interpreter; prints one JSON line with its measurements
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+import_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({{'import_ms': import_ms, 'eager': sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+
+def probe(module):
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'ap-southeast-2'))
+    out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                         cwd=ETL_LAMBDA_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('module', ['handler', 'lambda_function', 'lake_query'])
+def test_import_stays_within_the_cold_start_budget(module):
+    results = [probe(module) for _ in range(RUNS)]
+    assert all(result['eager'] == [] for result in results), f"{module} imported eagerly: {results[0]['eager']}"
+    median = statistics.median(result['import_ms'] for result in results)
+    assert median <= COLD_START_BUDGET_MS, f"{module} imports in {median:.1f} ms"
@@ -0,0 +1,56 @@
+"""compact_month over a local lake: days merged into the monthly file with their dt."""
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import compact
+from parquet_writer import write_parquet
+
+
+def usage_day(handler, day, tenants):
+    return pa.table({
+        'tenant_id': [f'{i:08x}-0000-4000-8000-{i:012x}' for i in range(tenants)],
+        'date': pa.array([day] * tenants, pa.date32()),
+        'appointments': pa.array(range(tenants), pa.int64()),
+        'completed_appointments': pa.array([0] * tenants, pa.int64()),
+        'messages': pa.array([1] * tenants, pa.int64()),
+        'documents': pa.array([2] * tenants, pa.int64()),
+    }, schema=handler.arrow_schema(handler.USAGE_COLUMNS))
+
+
+def test_month_keeps_each_rows_day(handler, lake):
+    days = {'2024-03-02': 3, '2024-03-03': 5}
+    for date_str, tenants in days.items():
+        table = usage_day(handler, date.fromisoformat(date_str), tenants)
+        write_parquet(lake, handler.S3_BUCKET, handler.partition_key('usage', date_str), table, handler.USAGE_LAYOUT)
+        handler.register_partitions('usage', [(date_str, tenants)])
+
+    result = compact.compact_month(lake, handler.S3_BUCKET, handler.partition_catalog, 'usage', '2024-03')
+    assert result['status'] == 'compacted', result
+
+    body = lake.get_object(Bucket=handler.S3_BUCKET, Key=compact.monthly_key('usage', '2024-03'))['Body']
+    month = pq.read_table(pa.BufferReader(body.read()))
+    assert month.schema.field('dt').type == pa.string()
+    counts = month.group_by('dt').aggregate([([], 'count_all')]).sort_by('dt')
+    assert counts.to_pylist() == [{'dt': dt, 'count_all': n} for dt, n in days.items()]
+
+
+def test_failed_month_fails_the_invocation(handler, lake, monkeypatch):
+    compact_month = compact.compact_month
+
+    def failing(s3, bucket, catalog, table, month, protected=()):
+        if month == '2024-02':
+            raise RuntimeError('SlowDown')
+        return compact_month(s3, bucket, catalog, table, month, protected)
+    monkeypatch.setattr(compact, 'compact_month', failing)
+    for date_str in ('2024-02-10', '2024-03-02'):
+        write_parquet(lake, handler.S3_BUCKET, handler.partition_key('usage', date_str),
+                      usage_day(handler, date.fromisoformat(date_str), 2), handler.USAGE_LAYOUT)
+        handler.register_partitions('usage', [(date_str, 2)])
+
+    with pytest.raises(compact.CompactionFailed, match='usage/2024-02'):
+        compact.compact_handler({'tables': ['usage'], 'months': ['2024-02', '2024-03']}, None)
+    # The month that succeeded is still published
+    assert lake.head_object(Bucket=handler.S3_BUCKET, Key=compact.monthly_key('usage', '2024-03'))
@@ -0,0 +1,47 @@
+"""handler.py's outcome when exports fail: raised for Lambda to retry."""
+import pytest
+
+from checkpoint import RunCheckpoint
+
+
+@pytest.fixture
+def exports(handler, monkeypatch):
+    """run_export replaced by one failing the tables in exports['failing']; records the tables run."""
+    state = {'failing': set(), 'runs': []}
+
+    def run_export(pool, table, date_str, *args):
+        state['runs'].append(table)
+        if table in state['failing']:
+            return {'status': 'failed', 'error': 'statement timeout'}
+        return {'status': 'succeeded', 'rows': 1}
+    monkeypatch.setattr(handler, 'run_export', run_export)
+    monkeypatch.setattr(handler, 'get_connection_pool', lambda concurrency: None)
+    return state
+
+
+def test_a_clean_run_returns(handler, exports):
+    response = handler.handler({'incremental': False, 'rollups': False}, None)
+    assert response['statusCode'] == 200
+
+
+def test_a_failed_table_raises_after_the_rest_is_recorded(handler, exports, lake):
+    exports['failing'] = {'usage'}
+    with pytest.raises(handler.ExportFailed, match='usage'):
+        handler.handler({'rollups': False}, None)
+    # The tables that succeeded still moved their watermarks
+    state = handler.load_state(lake, handler.S3_BUCKET)
+    assert set(state) == set(handler.EXPORTERS) - {'usage'}
+
+
+def test_a_retried_checkpointed_run_redoes_only_failed_tables(handler, exports, lake):
+    event = {'checkpointed': True, 'incremental': False, 'rollups': False, 'resume': '2024-03-02'}
+    exports['failing'] = {'usage'}
+    with pytest.raises(handler.ExportFailed):
+        handler.handler(event, None)
+    assert RunCheckpoint.load(lake, handler.S3_BUCKET, '2024-03-02').status == 'failed'
+
+    exports['failing'], exports['runs'] = set(), []
+    response = handler.handler(event, None)
+    assert response['statusCode'] == 200
+    assert exports['runs'] == ['usage']
+    assert RunCheckpoint.load(lake, handler.S3_BUCKET, '2024-03-02').status == 'complete'
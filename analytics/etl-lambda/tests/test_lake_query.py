@@ -0,0 +1,59 @@
+"""lake_query.py over partitions written by the real exporters."""
+from datetime import datetime
+
+import pytest
+
+import lake_query
+from fakes import FakeConnection
+from lake_cache import PartitionCache
+
+DATE = '2024-03-02'
+
+# TENANTS_QUERY rows as Postgres returns them: tenants.status is an integer
+# column (TenantStatus), selected as t.status::text
+TENANT_ROWS = [
+    ('00000000-0000-4000-8000-000000000001', 'Active Clinic', 'active', '0', 'starter', 'Australia/Sydney',
+     datetime(2024, 1, 5), 40, 4, 99),
+    ('00000000-0000-4000-8000-000000000002', 'Other Clinic', 'other', '0', 'enterprise', 'Australia/Perth',
+     datetime(2024, 2, 9), 60, 6, 599),
+    ('00000000-0000-4000-8000-000000000003', 'Suspended Clinic', 'suspended', '1', 'professional',
+     'Australia/Sydney', datetime(2023, 6, 1), 10, 1, 299),
+]
+
+
+@pytest.fixture
+def cache(handler, lake, tmp_path):
+    conn = FakeConnection(lambda query, params: TENANT_ROWS)
+    rows, _ = handler.export_tenants(conn, DATE)
+    handler.register_partitions('tenants', [(DATE, rows)])
+    return PartitionCache(lake, handler.S3_BUCKET, root=str(tmp_path / 'cache'))
+
+
+def test_dashboard_counts_active_tenants_of_exported_partition(cache):
+    assert lake_query.dashboard(cache).to_pylist() == [{
+        'total_tenants': 3, 'active_tenants': 2, 'total_patients': 110, 'total_staff': 11, 'mrr': 997,
+    }]
+
+
+def test_warm_dashboard_reads_no_objects(cache):
+    lake_query.dashboard(cache)
+    fetched = cache.stats()['bytes_fetched']
+    lake_query.dashboard(cache)
+    assert cache.stats()['bytes_fetched'] == fetched
+    assert cache.stats()['hits'] == 1
+
+
+def test_unknown_parameter_is_rejected(cache):
+    with pytest.raises(ValueError):
+        lake_query.run_query(cache, 'dashboard', {'days': '3'})
+
+
+def test_cache_streams_objects_larger_than_a_chunk(lake, tmp_path, monkeypatch):
+    import lake_cache
+    monkeypatch.setattr(lake_cache, '_CHUNK_BYTES', 1000)
+    data = bytes(range(256)) * 20
+    lake.put_object(Bucket='bucket', Key='curated/blob.bin', Body=data)
+    cache = PartitionCache(lake, 'bucket', root=str(tmp_path / 'cache'))
+    with open(cache.get('curated/blob.bin'), 'rb') as f:
+        assert f.read() == data
+    assert cache.stats()['bytes'] == cache.stats()['bytes_fetched'] == len(data)
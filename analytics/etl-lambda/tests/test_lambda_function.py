@@ -0,0 +1,124 @@
+"""lambda_function.py's usage window, its watermark and dt= partitions."""
+import json
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from catalog import load_manifest
+from fakes import FakeConnection
+from warm_cache import ConnectionCache
+
+DAY_ONE, DAY_TWO = date(2024, 3, 1), date(2024, 3, 2)
+TENANT = '11111111-1111-4111-8111-111111111111'
+
+
+def respond(query, params):
+    if 'per_source' in query:
+        return [[TENANT, day, 4, 1, 2, 3] for day in (DAY_ONE, DAY_TWO)
+                if params['start'] <= day < params['end']]
+    if 'evaluations' in query:
+        # One cohort of 12 evaluations, one of 3 (below k)
+        return [['NSW', 'ODI', 40, 'F', 30.0, 20.0]] * 12 + [['VIC', 'ODI', 70, 'M', 30.0, 10.0]] * 3
+    return []
+
+
+def run(lambda_function, monkeypatch, conn):
+    monkeypatch.setattr(lambda_function, 'connection_cache', ConnectionCache(lambda: conn, lambda c: None))
+    return lambda_function.handler({}, None)
+
+
+def test_usage_window_excludes_the_current_day(lambda_function):
+    conn = FakeConnection(respond)
+    lambda_function.extract_usage_stats(conn, DAY_ONE, DAY_TWO)
+    query, params = conn.queries[-1]
+    assert query.count('created_at < :end') == 3
+    assert params == {'start': DAY_ONE, 'end': DAY_TWO}
+
+
+def test_usage_stats_are_written_one_partition_per_day(lambda_function, lake, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'usage_stats_start_date', lambda: DAY_ONE)
+    monkeypatch.setattr(lambda_function, 'usage_stats_end_date', lambda: date(2024, 3, 3))
+    run(lambda_function, monkeypatch, FakeConnection(respond))
+    # Re-running the window rewrites the same two partitions instead of adding a third
+    run(lambda_function, monkeypatch, FakeConnection(respond))
+
+    listed = lake.list_objects_v2(Bucket=lambda_function.BUCKET, Prefix='usage_stats/')['Contents']
+    assert sorted(obj['Key'] for obj in listed) == [
+        'usage_stats/dt=2024-03-01/data.parquet', 'usage_stats/dt=2024-03-02/data.parquet']
+    for day in (DAY_ONE, DAY_TWO):
+        body = lake.get_object(Bucket=lambda_function.BUCKET, Key=f'usage_stats/dt={day}/data.parquet')['Body']
+        table = pq.read_table(pa.BufferReader(body.read()))
+        assert table['date'].to_pylist() == [day]
+
+
+def test_the_next_run_starts_where_the_last_window_ended(lambda_function, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'usage_stats_end_date', lambda: DAY_TWO)
+    first = FakeConnection(respond)
+    run(lambda_function, monkeypatch, first)
+    assert lambda_function.usage_stats_start_date() == DAY_TWO
+
+    monkeypatch.setattr(lambda_function, 'usage_stats_end_date', lambda: date(2024, 3, 3))
+    second = FakeConnection(respond)
+    run(lambda_function, monkeypatch, second)
+    usage = [params for query, params in second.queries if 'per_source' in query]
+    assert usage == [{'start': DAY_TWO, 'end': date(2024, 3, 3)}]
+    assert lambda_function.usage_stats_start_date() == date(2024, 3, 3)
+
+
+def test_a_failed_run_keeps_the_watermark(lambda_function, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'usage_stats_end_date', lambda: DAY_TWO)
+
+    def failing(query, params):
+        if 'evaluations' in query:
+            raise RuntimeError('statement timeout')
+        return respond(query, params)
+    with pytest.raises(RuntimeError):
+        run(lambda_function, monkeypatch, FakeConnection(failing))
+    assert lambda_function.load_state(lambda_function.s3, lambda_function.BUCKET, lambda_function.STATE_KEY) == {}
+
+
+def test_partitions_are_registered_as_they_are_written(lambda_function, lake, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'usage_stats_start_date', lambda: DAY_ONE)
+    monkeypatch.setattr(lambda_function, 'usage_stats_end_date', lambda: date(2024, 3, 3))
+    run(lambda_function, monkeypatch, FakeConnection(respond))
+
+    glue = lambda_function.partition_catalog.glue
+    assert sorted(glue.partitions['extract_usage_stats']) == [('2024-03-01',), ('2024-03-02',)]
+    manifest = load_manifest(lake, lambda_function.BUCKET, 'extract_usage_stats')
+    entry = manifest['partitions']['dt=2024-03-02']
+    assert (entry['key'], entry['rows']) == ('usage_stats/dt=2024-03-02/data.parquet', 1)
+
+
+def test_prom_outcomes_table_is_written_as_aggregated(lambda_function, lake, monkeypatch):
+    outcomes = lambda_function.extract_prom_outcomes(FakeConnection(respond), DAY_ONE)
+    assert isinstance(outcomes, pa.Table)
+    assert outcomes.schema == lambda_function.arrow_schema(lambda_function.PROM_OUTCOMES_COLUMNS)
+
+    monkeypatch.setattr(lambda_function, 'usage_stats_end_date', lambda: DAY_TWO)
+    run(lambda_function, monkeypatch, FakeConnection(respond))
+    body = lake.get_object(Bucket=lambda_function.BUCKET, Key=f'prom_outcomes/dt={DAY_TWO}/data.parquet')['Body']
+    assert pq.read_table(pa.BufferReader(body.read())).to_pylist() == [{
+        'region': 'NSW', 'prom_type': 'ODI', 'age_bracket': '35-44', 'gender': 'F',
+        'avg_baseline': 30.0, 'avg_final': 20.0, 'patient_count': 12,
+    }]
+
+
+def test_usage_rows_are_split_by_their_date_column(lambda_function):
+    columns = lambda_function.USAGE_STATS_COLUMNS
+    rows = [[TENANT, day, 4, 1, 2, 3] for day in (DAY_TWO, DAY_ONE, DAY_TWO)]
+    partitions = lambda_function.partition_rows(rows, columns, 'date', date(2024, 3, 3))
+    assert {dt: table['date'].to_pylist() for dt, table in partitions.items()} == {
+        '2024-03-01': [DAY_ONE], '2024-03-02': [DAY_TWO, DAY_TWO]}
+    assert lambda_function.partition_rows([], columns, 'date', DAY_TWO) == {}
+
+
+def test_response_keeps_the_tenants_uri_and_count(lambda_function, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'usage_stats_end_date', lambda: DAY_TWO)
+    tenant = [TENANT, 'Clinic', 'clinic', '0', 'starter', 'Australia/Sydney', 12, 3, None]
+    conn = FakeConnection(lambda query, params: [tenant] if 'FROM tenants' in query else respond(query, params))
+    body = json.loads(run(lambda_function, monkeypatch, conn)['body'])
+    assert body['tenants'] == f's3://{lambda_function.BUCKET}/tenants/dt={DAY_TWO}/data.parquet'
+    assert body['tenant_count'] == 1
+    assert body['exports']['usage_stats'] == {'uris': [], 'rows': 0}
@@ -0,0 +1,40 @@
+"""Counters shared by shard threads, and the run's EMF record."""
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+def test_counters_from_concurrent_threads_all_add_up():
+    table_metrics = metrics.TableMetrics('usage')
+
+    def shard(_):
+        with metrics.recording(table_metrics):
+            for _ in range(2000):
+                metrics.count(rows=1, bytes=3)
+                metrics.saved(bytes=2, seconds=0.5)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(shard, range(8)))
+
+    assert (table_metrics.rows, table_metrics.bytes) == (16000, 48000)
+    assert (table_metrics.saved_bytes, table_metrics.saved_seconds) == (32000, 8000.0)
+
+
+def test_emf_record_has_a_directive_per_table():
+    run = metrics.RunMetrics()
+    tables = [f'table_{i}' for i in range(8)]
+    for table in tables:
+        table_metrics = run.table(table)
+        for stage in metrics.STAGES:
+            table_metrics.add_stage(stage, 0.25)
+        table_metrics.add_counts(rows=10)
+
+    record = run.to_emf(date='2024-03-02')
+    directives = record['_aws']['CloudWatchMetrics']
+    assert len(directives) == 1 + len(tables)
+    assert [d['Name'] for d in directives[0]['Metrics']] == ['RunSeconds']
+    for table, directive in zip(tables, directives[1:]):
+        names = [d['Name'] for d in directive['Metrics']]
+        assert len(names) <= 100
+        assert all(name.startswith(f'{table}.') and name in record for name in names)
+    assert record[f'{tables[0]}.rows'] == 10
+    assert sum(len(d['Metrics']) for d in directives) > 100
@@ -0,0 +1,105 @@
+"""iter_copy_batches over canned COPY ... TO STDOUT CSV streams."""
+from datetime import date, datetime, timedelta
+
+import pyarrow as pa
+import pytest
+
+from pg_arrow import iter_copy_batches, read_copy_table
+
+SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('name', pa.string()),
+    ('visits', pa.int64()),
+    ('score', pa.float64()),
+    ('day', pa.date32()),
+    ('seen_at', pa.timestamp('us')),
+])
+
+
+class CopyCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def mogrify(self, query, params=None):
+        return query.encode()
+
+    def copy_expert(self, statement, out):
+        self.conn.statements.append(statement)
+        if self.conn.error is not None:
+            out.write(self.conn.stream[:len(self.conn.stream) // 2])
+            raise self.conn.error
+        # Written in small pieces, as psycopg2 passes COPY data on
+        for i in range(0, len(self.conn.stream), 7):
+            out.write(self.conn.stream[i:i + 7])
+
+
+class CopyConnection:
+    """A connection whose COPY TO STDOUT writes stream (bytes of Postgres CSV)."""
+
+    def __init__(self, stream, error=None):
+        self.stream = stream
+        self.error = error
+        self.statements = []
+
+    def cursor(self):
+        return CopyCursor(self)
+
+
+def read(stream, block_size=4 << 20):
+    return read_copy_table(CopyConnection(stream), 'SELECT 1', {}, SCHEMA, block_size=block_size)
+
+
+def copy_line(id, name='', visits='', score='', day='', seen_at=''):
+    return f'{id},{name},{visits},{score},{day},{seen_at}\n'
+
+
+def test_unquoted_empty_is_null_and_quoted_empty_is_empty_string():
+    table = read((copy_line('a', '') + copy_line('b', '""')).encode())
+    assert table['name'].to_pylist() == [None, '']
+    assert table['visits'].to_pylist() == [None, None]
+
+
+def test_quoted_commas_quotes_and_newlines_stay_in_their_field():
+    table = read(copy_line('a', '"Smith, Jones"', 1).encode()
+                 + copy_line('b', '"first line\nsecond, ""quoted"""', 2).encode())
+    assert table['name'].to_pylist() == ['Smith, Jones', 'first line\nsecond, "quoted"']
+    assert table['visits'].to_pylist() == [1, 2]
+
+
+def test_rows_split_across_blocks_are_read_whole():
+    # Every row runs over the 64 byte blocks, some of them inside a quoted newline
+    names = [f'"clinic {i},\nward {i * 7}"' if i % 3 else f'clinic {i}' for i in range(40)]
+    stream = ''.join(copy_line(f'id-{i:04}', name, i) for i, name in enumerate(names)).encode()
+    batches = list(iter_copy_batches(CopyConnection(stream), 'SELECT 1', {}, SCHEMA, block_size=64))
+    assert len(batches) > 1
+    table = pa.Table.from_batches(batches)
+    assert table['id'].to_pylist() == [f'id-{i:04}' for i in range(40)]
+    assert table['name'].to_pylist() == [name.strip('"') for name in names]
+
+
+def test_schema_and_values_round_trip_exactly():
+    seen_at = datetime(2024, 3, 2, 13, 45, 6, 789012)
+    micros = (seen_at - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+    days = (date(2024, 3, 1) - date(1970, 1, 1)).days
+    table = read(copy_line('a', 'Clinic', 9007199254740993, 0.1, days, micros).encode())
+    assert table.schema == SCHEMA
+    assert table.to_pylist() == [{'id': 'a', 'name': 'Clinic', 'visits': 9007199254740993, 'score': 0.1,
+                                  'day': date(2024, 3, 1), 'seen_at': seen_at}]
+
+
+def test_empty_result_is_an_empty_table():
+    table = read(b'')
+    assert table.num_rows == 0 and table.schema == SCHEMA
+
+
+def test_failed_copy_raises_the_database_error():
+    stream = ''.join(copy_line(f'id-{i}', 'x', i) for i in range(100)).encode()
+    conn = CopyConnection(stream, error=RuntimeError('canceling statement due to statement timeout'))
+    with pytest.raises(RuntimeError, match='statement timeout'):
+        list(iter_copy_batches(conn, 'SELECT 1', {}, SCHEMA))
@@ -0,0 +1,60 @@
+"""QualityCheck's key uniqueness, over whole tables and streamed batches."""
+import pyarrow as pa
+import pytest
+
+from quality import QualityCheck, QualityError, QualityRules
+
+RULES = QualityRules(unique=('region', 'prom_type'))
+
+
+def cohorts(keys):
+    return pa.table({'region': [k[0] for k in keys], 'prom_type': [k[1] for k in keys]})
+
+
+SORTED = [(region, prom) for region in ('NSW', 'QLD', 'VIC') for prom in ('KOOS', 'NDI', 'ODI')]
+
+
+def stream(keys, batch_size=2):
+    check = QualityCheck('prom_outcomes', RULES)
+    for _ in check.watch(iter(cohorts(keys).to_batches(max_chunksize=batch_size))):
+        pass
+    return check
+
+
+def test_sorted_stream_keeps_no_keys():
+    check = stream(SORTED)
+    assert check._unordered == []
+    assert check._first_key.to_pylist() == [{'region': 'NSW', 'prom_type': 'KOOS'}]
+    assert check._last_key.to_pylist() == [{'region': 'VIC', 'prom_type': 'ODI'}]
+
+
+@pytest.mark.parametrize('repeat', [1, 2])
+def test_a_repeated_key_fails(repeat):
+    # Repeated within a batch (index 1) or across a batch boundary (index 2)
+    keys = SORTED[:repeat + 1] + SORTED[repeat:]
+    with pytest.raises(QualityError, match='not unique'):
+        stream(keys)
+
+
+def test_unsorted_table_falls_back_to_a_group_by():
+    check = QualityCheck('prom_outcomes', RULES)
+    check.add(cohorts(list(reversed(SORTED))))
+    assert check.finish() == []
+    check = QualityCheck('prom_outcomes', RULES)
+    check.add(cohorts([SORTED[4], SORTED[0], SORTED[4]]))
+    with pytest.raises(QualityError, match='not unique'):
+        check.finish()
+
+
+def test_order_breaking_past_the_ordered_rows_is_checked_by_group_by():
+    # Sorted for two batches, then out of order but beyond every key seen so far
+    check = stream(SORTED[:4] + [SORTED[6], SORTED[5], SORTED[8], SORTED[7]])
+    assert check.finish() == []
+    with pytest.raises(QualityError, match='not unique'):
+        stream(SORTED[:4] + [SORTED[6], SORTED[5], SORTED[6]])
+
+
+def test_a_key_going_back_among_dropped_rows_fails():
+    # (NSW, NDI) may repeat a key of the first batch, which is no longer kept
+    with pytest.raises(QualityError, match='out of order'):
+        stream(SORTED[:4] + [SORTED[5], SORTED[1]])
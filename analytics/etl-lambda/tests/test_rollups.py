@@ -0,0 +1,105 @@
+"""Monthly rollups merged a day at a time over a local lake."""
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import rollups
+from parquet_writer import write_parquet
+
+TENANT = '00000000-0000-4000-8000-000000000001'
+
+
+def read(lake, bucket, key):
+    return pq.read_table(pa.BufferReader(lake.get_object(Bucket=bucket, Key=key)['Body'].read()))
+
+
+def write_input(handler, rollup, date_str, table, layout):
+    write_parquet(handler.s3, handler.S3_BUCKET, rollup.input_key(date_str), table, layout)
+
+
+def usage_day(handler, date_str, appointments):
+    day = date.fromisoformat(date_str)
+    return pa.table({
+        'tenant_id': [TENANT], 'date': pa.array([day], pa.date32()), 'appointments': [appointments],
+        'completed_appointments': [1], 'messages': [2], 'documents': [3],
+    }, schema=handler.arrow_schema(handler.USAGE_COLUMNS))
+
+
+def tenants_day(handler, mrr):
+    return pa.table({
+        'id': [TENANT, TENANT.replace('1', '2')], 'name': ['A', 'B'], 'slug': ['a', 'b'], 'status': ['0', '0'],
+        'plan': ['starter', 'starter'], 'region': ['Australia/Sydney'] * 2,
+        'created_at': pa.array([None, None], pa.timestamp('us')), 'patient_count': [10, 20],
+        'staff_count': [1, 2], 'mrr': [mrr, mrr],
+    }, schema=handler.arrow_schema(handler.TENANTS_COLUMNS))
+
+
+def merge(handler, rollup, date_str):
+    return rollups.merge_day(handler.s3, handler.S3_BUCKET, handler.partition_catalog, rollup, date_str)
+
+
+def test_merging_a_day_twice_changes_nothing(handler, lake):
+    rollup = handler.USAGE_BY_MONTH
+    for date_str, appointments in (('2024-03-02', 4), ('2024-03-03', 5)):
+        write_input(handler, rollup, date_str, usage_day(handler, date_str, appointments), handler.USAGE_LAYOUT)
+        assert merge(handler, rollup, date_str)['status'] == 'merged'
+    published_key = rollups.rollup_key(rollup.name, '2024-03')
+    state_key = rollups.state_key(rollup.name, '2024-03')
+    published, state = read(lake, handler.S3_BUCKET, published_key), read(lake, handler.S3_BUCKET, state_key)
+
+    result = merge(handler, rollup, '2024-03-03')
+    assert result == {'status': 'skipped', 'month': '2024-03', 'reason': '2024-03-03 already merged'}
+    assert read(lake, handler.S3_BUCKET, published_key).equals(published)
+    assert read(lake, handler.S3_BUCKET, state_key).equals(state)
+    assert published.to_pylist() == [{'tenant_id': TENANT, 'appointments': 9, 'completed_appointments': 2,
+                                      'messages': 4, 'documents': 6, 'days': 2}]
+
+
+def test_rebuilt_month_equals_the_merged_one(handler, lake):
+    rollup = handler.USAGE_BY_MONTH
+    for date_str, appointments in (('2024-03-02', 4), ('2024-03-03', 5)):
+        write_input(handler, rollup, date_str, usage_day(handler, date_str, appointments), handler.USAGE_LAYOUT)
+        merge(handler, rollup, date_str)
+    key = rollups.rollup_key(rollup.name, '2024-03')
+    merged = read(lake, handler.S3_BUCKET, key)
+    rollups.rebuild_month(handler.s3, handler.S3_BUCKET, handler.partition_catalog, rollup, '2024-03')
+    assert read(lake, handler.S3_BUCKET, key).equals(merged)
+
+
+def test_snapshot_month_keeps_only_its_latest_day(handler, lake):
+    rollup = handler.TENANTS_BY_PLAN
+    # Merged out of order: a day older than the month's latest does not replace it
+    for date_str, mrr in (('2024-03-01', 99), ('2024-03-05', 299), ('2024-03-03', 599)):
+        write_input(handler, rollup, date_str, tenants_day(handler, mrr), handler.TENANTS_LAYOUT)
+        merge(handler, rollup, date_str)
+
+    published = read(lake, handler.S3_BUCKET, rollups.rollup_key(rollup.name, '2024-03'))
+    assert published.to_pylist() == [{'plan': 'starter', 'tenants': 2, 'patient_count': 30, 'staff_count': 3,
+                                      'mrr': 598, 'as_of': '2024-03-05'}]
+
+
+def test_prom_cohorts_are_suppressed_when_published_not_in_the_state(handler, lake):
+    rollup = handler.PROM_OUTCOMES_BY_REGION
+    k = rollup.cohort.k
+
+    def stage(date_str, patients):
+        rows = pa.table({'region': ['NSW'] * patients, 'prom_type': ['ODI'] * patients,
+                         'baseline_score': [40.0] * patients, 'final_score': [20.0] * patients})
+        rollups.stage_input(handler.s3, handler.S3_BUCKET, rollup, date_str, rollup.cohort.partial(rows, {}))
+
+    # Each day alone is below k
+    first, second = k // 2, k - k // 2
+    stage('2024-03-02', first)
+    merge(handler, rollup, '2024-03-02')
+    published_key = rollups.rollup_key(rollup.name, '2024-03')
+    assert read(lake, handler.S3_BUCKET, published_key).num_rows == 0
+    state = read(lake, handler.S3_BUCKET, rollups.state_key(rollup.name, '2024-03'))
+    assert state['count_all'].to_pylist() == [first]
+
+    # Together they reach it, so the month publishes the cohort
+    stage('2024-03-03', second)
+    merge(handler, rollup, '2024-03-03')
+    assert read(lake, handler.S3_BUCKET, published_key).to_pylist() == [{
+        'region': 'NSW', 'prom_type': 'ODI', 'avg_baseline': 40.0, 'avg_final': 20.0, 'patient_count': k,
+    }]
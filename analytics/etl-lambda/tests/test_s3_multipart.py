@@ -0,0 +1,125 @@
+"""S3MultipartWriter and S3ObjectFile against moto's S3."""
+import os
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from moto import mock_aws
+
+import s3_multipart
+from s3_multipart import MIN_PART_SIZE, S3MultipartWriter, S3ObjectFile
+
+BUCKET = 'qivr-analytics-lake'
+
+
+class Recording:
+    """An S3 client recording each call's parameters, failing the first fail_parts upload_part calls."""
+
+    def __init__(self, s3, fail_parts=0):
+        self._s3 = s3
+        self.fail_parts = fail_parts
+        self.calls = []
+
+    def __getattr__(self, name):
+        call = getattr(self._s3, name)
+
+        def recorded(**params):
+            self.calls.append((name, params))
+            if name == 'upload_part' and self.fail_parts:
+                self.fail_parts -= 1
+                raise ConnectionError('connection reset')
+            return call(**params)
+        return recorded
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client('s3', region_name='ap-southeast-2')
+        client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'ap-southeast-2'})
+        yield client
+
+
+def written(s3, key):
+    return s3.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+
+def test_multipart_round_trip(s3):
+    data = os.urandom(2 * MIN_PART_SIZE + 12345)
+    with S3MultipartWriter(s3, BUCKET, 'big.bin', part_size=MIN_PART_SIZE, concurrency=2) as sink:
+        # Writes that do not line up with part boundaries
+        for i in range(0, len(data), 1_000_003):
+            sink.write(data[i:i + 1_000_003])
+    assert sink.parts_uploaded == 3
+    assert sink.bytes_written == len(data)
+    assert written(s3, 'big.bin') == data
+
+
+def test_small_output_is_one_put(s3):
+    client = Recording(s3)
+    with S3MultipartWriter(client, BUCKET, 'small.bin', metadata={'content-hash': 'abc'}) as sink:
+        sink.write(b'tiny')
+    assert [name for name, _ in client.calls] == ['put_object']
+    assert written(s3, 'small.bin') == b'tiny'
+    assert s3.head_object(Bucket=BUCKET, Key='small.bin')['Metadata'] == {'content-hash': 'abc'}
+
+
+def test_an_exception_aborts_the_upload(s3):
+    with pytest.raises(RuntimeError):
+        with S3MultipartWriter(s3, BUCKET, 'broken.bin', part_size=MIN_PART_SIZE) as sink:
+            sink.write(os.urandom(MIN_PART_SIZE + 1))
+            raise RuntimeError('encoder failed')
+    assert 'Contents' not in s3.list_objects_v2(Bucket=BUCKET)
+    assert 'Uploads' not in s3.list_multipart_uploads(Bucket=BUCKET)
+
+
+def test_failed_parts_are_retried(s3, monkeypatch):
+    monkeypatch.setattr(s3_multipart.time, 'sleep', lambda seconds: None)
+    client = Recording(s3, fail_parts=1)
+    data = os.urandom(MIN_PART_SIZE + 10)
+    with S3MultipartWriter(client, BUCKET, 'retried.bin', part_size=MIN_PART_SIZE, retries=1) as sink:
+        sink.write(data)
+    assert written(s3, 'retried.bin') == data
+
+
+def test_a_part_out_of_retries_aborts_the_upload(s3, monkeypatch):
+    monkeypatch.setattr(s3_multipart.time, 'sleep', lambda seconds: None)
+    client = Recording(s3, fail_parts=2)
+    with pytest.raises(ConnectionError):
+        with S3MultipartWriter(client, BUCKET, 'failed.bin', part_size=MIN_PART_SIZE, retries=1) as sink:
+            sink.write(os.urandom(MIN_PART_SIZE + 10))
+    assert 'abort_multipart_upload' in [name for name, _ in client.calls]
+    assert 'Uploads' not in s3.list_multipart_uploads(Bucket=BUCKET)
+
+
+def test_object_file_reads_ranges(s3):
+    data = bytes(range(256)) * 64
+    s3.put_object(Bucket=BUCKET, Key='ranged.bin', Body=data)
+    client = Recording(s3)
+    source = S3ObjectFile(client, BUCKET, 'ranged.bin')
+    assert source.size == len(data)
+
+    source.seek(1000)
+    assert source.read(24) == data[1000:1024]
+    source.seek(-10, os.SEEK_END)
+    assert source.read(100) == data[-10:]
+    assert source.read(1) == b''
+    ranges = [params['Range'] for name, params in client.calls if name == 'get_object']
+    assert ranges == ['bytes=1000-1023', f'bytes={len(data) - 10}-{len(data) - 1}']
+
+
+def test_parquet_footer_is_read_without_the_whole_object(s3):
+    table = pa.table({'id': pa.array(range(200_000)), 'value': pa.array([str(i) for i in range(200_000)])})
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, row_group_size=50_000)
+    s3.put_object(Bucket=BUCKET, Key='data.parquet', Body=sink.getvalue().to_pybytes())
+
+    client = Recording(s3)
+    source = S3ObjectFile(client, BUCKET, 'data.parquet')
+    parquet = pq.ParquetFile(source)
+    assert parquet.metadata.num_rows == 200_000
+    assert parquet.read_row_group(3, columns=['id'])['id'][0].as_py() == 150_000
+    fetched = sum(len(s3.get_object(Bucket=BUCKET, Key='data.parquet', Range=params['Range'])['Body'].read())
+                  for name, params in client.calls if name == 'get_object')
+    assert fetched < source.size / 2
@@ -0,0 +1,80 @@
+"""Tenant shard planning, weighted cuts and the split-on-timeout retry."""
+import random
+import uuid
+
+import pytest
+
+from sharding import ShardTimeout, TenantShard, TenantWeights, iter_shard_results, plan_shards
+
+_random = random.Random(7)
+IDS = sorted(str(uuid.UUID(int=_random.getrandbits(128), version=4)) for _ in range(200))
+
+
+def bound(value, default):
+    return uuid.UUID(value).int if value is not None else default
+
+
+def contains(shard, tenant_id):
+    value = uuid.UUID(tenant_id).int
+    return bound(shard.low, 0) <= value < bound(shard.high, 1 << 128)
+
+
+def tenants_in(shard):
+    return [tenant_id for tenant_id in IDS if contains(shard, tenant_id)]
+
+
+@pytest.mark.parametrize('count', [1, 2, 7, 16])
+@pytest.mark.parametrize('weighted', [False, True])
+def test_shards_cover_the_id_space_without_gaps_or_overlap(count, weighted):
+    weights = TenantWeights(IDS, range(1, len(IDS) + 1)) if weighted else None
+    shards = plan_shards(count, weights)
+    assert len(shards) == count
+    assert shards[0].low is None and shards[-1].high is None
+    for before, after in zip(shards, shards[1:]):
+        assert before.high == after.low
+        assert bound(before.low, 0) < uuid.UUID(before.high).int
+    assert sorted(tenant_id for shard in shards for tenant_id in tenants_in(shard)) == IDS
+
+
+def test_weighted_cuts_balance_the_weights():
+    # Weights from 1 to 400: an even split of the id space would be far off
+    weights = {tenant_id: 1 + (i * 37) % 400 for i, tenant_id in enumerate(IDS)}
+    shards = plan_shards(4, TenantWeights(list(weights), list(weights.values())))
+    totals = [sum(weights[tenant_id] for tenant_id in tenants_in(shard)) for shard in shards]
+    assert max(totals) - min(totals) <= 2 * max(weights.values())
+
+
+def test_cut_needs_two_tenants_in_the_range():
+    weights = TenantWeights(IDS[:1], [5])
+    assert weights.cut(0, 1 << 128, 0.5) is None
+
+
+def test_timed_out_shard_is_split_and_each_half_returned_once():
+    shards = plan_shards(4)
+    slow = shards[1]
+    runs = []
+
+    def run(shard, budgeted):
+        runs.append((repr(shard), budgeted))
+        if budgeted and repr(shard) == repr(slow):
+            raise ShardTimeout(repr(shard))
+        return tenants_in(shard)
+
+    results = list(iter_shard_results(shards, run, workers=3))
+    assert [tenant_id for _, rows in results for tenant_id in rows] == IDS
+    assert len(results) == 5
+    first, second = results[1][0], results[2][0]
+    assert (first.low, first.high, second.high) == (slow.low, second.low, slow.high)
+    assert first.splits == second.splits == 1
+    assert runs.count((repr(slow), True)) == 1
+
+
+def test_shard_split_max_splits_times_runs_without_a_budget():
+    def run(shard, budgeted):
+        if budgeted:
+            raise ShardTimeout(repr(shard))
+        return tenants_in(shard)
+
+    results = list(iter_shard_results([TenantShard()], run, workers=2, max_splits=2))
+    assert [tenant_id for _, rows in results for tenant_id in rows] == IDS
+    assert [shard.splits for shard, _ in results] == [2, 2, 2, 2]
@@ -0,0 +1,40 @@
+"""The local sink's reads, with and without memory maps."""
+import gc
+
+import pytest
+
+import sinks
+from catalog import GlueCatalog, load_manifest, partition_entry, publish_partitions
+
+DATA = bytes(range(256)) * 8
+
+
+@pytest.fixture(params=[False, True], ids=['file', 'mmap'])
+def sink(request, tmp_path):
+    sink = sinks.LocalSink(str(tmp_path), memory_map=request.param)
+    sink.put_object(Bucket='lake', Key='curated/blob.bin', Body=DATA)
+    return sink
+
+
+def test_whole_ranged_and_chunked_reads(sink):
+    assert bytes(sink.get_object(Bucket='lake', Key='curated/blob.bin')['Body'].read()) == DATA
+    ranged = sink.get_object(Bucket='lake', Key='curated/blob.bin', Range='bytes=100-299')['Body']
+    assert bytes(ranged.read()) == DATA[100:300]
+    body = sink.get_object(Bucket='lake', Key='curated/blob.bin')['Body']
+    chunks = iter(lambda: body.read(500), b'')
+    assert b''.join(bytes(chunk) for chunk in chunks) == DATA
+
+
+def test_memory_mapped_reads_are_views_that_outlive_the_body(tmp_path):
+    sink = sinks.LocalSink(str(tmp_path), memory_map=True)
+    sink.put_object(Bucket='lake', Key='curated/blob.bin', Body=DATA)
+    view = sink.get_object(Bucket='lake', Key='curated/blob.bin', Range='bytes=8-15')['Body'].read()
+    gc.collect()
+    assert isinstance(view, memoryview)
+    assert view.tobytes() == DATA[8:16]
+
+
+def test_manifests_read_back_through_either_read(sink):
+    entry = partition_entry({'dt': '2024-03-02'}, 'lake', 'curated/blob.bin', 1, len(DATA))
+    publish_partitions(sink, 'lake', GlueCatalog(sinks.MemoryGlue()), 'usage', [entry])
+    assert list(load_manifest(sink, 'lake', 'usage')['partitions']) == ['dt=2024-03-02']
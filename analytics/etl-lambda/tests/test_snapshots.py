@@ -0,0 +1,76 @@
+"""Content hashes of snapshot tables, and unchanged snapshots carried forward instead of rewritten."""
+import pyarrow as pa
+import pytest
+
+from catalog import load_manifest
+from parquet_writer import content_hash
+
+TENANT_IDS = [f'00000000-0000-4000-8000-{i:012x}' for i in range(6)]
+
+
+def tenants(handler, mrr=99, order=None):
+    ids = [TENANT_IDS[i] for i in (order or range(len(TENANT_IDS)))]
+    return pa.table({
+        'id': ids, 'name': [f'Clinic {i}' for i in ids], 'slug': ids, 'status': ['0'] * len(ids),
+        'plan': ['starter'] * len(ids), 'region': ['Australia/Sydney'] * len(ids),
+        'created_at': pa.array([None] * len(ids), pa.timestamp('us')), 'patient_count': [10] * len(ids),
+        'staff_count': [1] * len(ids), 'mrr': [mrr if i == TENANT_IDS[0] else 99 for i in ids],
+    }, schema=handler.arrow_schema(handler.TENANTS_COLUMNS))
+
+
+def test_hash_ignores_row_order_and_chunking(handler):
+    layout = handler.TENANTS_LAYOUT
+    table = tenants(handler)
+    shuffled = tenants(handler, order=[3, 0, 5, 1, 4, 2])
+    chunked = pa.concat_tables([shuffled.slice(0, 2), shuffled.slice(2)])
+    assert content_hash(shuffled, layout) == content_hash(table, layout)
+    assert content_hash(chunked, layout) == content_hash(table, layout)
+
+
+def test_hash_changes_with_content(handler):
+    layout = handler.TENANTS_LAYOUT
+    assert content_hash(tenants(handler, mrr=299), layout) != content_hash(tenants(handler), layout)
+    assert content_hash(tenants(handler).slice(1), layout) != content_hash(tenants(handler), layout)
+
+
+def publish(handler, table, date_str):
+    handler.write_snapshot_to_s3('tenants', table, date_str, handler.TENANTS_LAYOUT)
+    handler.register_partitions('tenants', [(date_str, table.num_rows)])
+
+
+@pytest.fixture
+def writes(handler, monkeypatch):
+    """Keys written (encoded and uploaded) rather than copied."""
+    written = []
+    write = handler.write_table_to_s3
+
+    def recording(table, s3_key, layout, metadata=None):
+        written.append(s3_key)
+        write(table, s3_key, layout, metadata)
+    monkeypatch.setattr(handler, 'write_table_to_s3', recording)
+    return written
+
+
+def test_unchanged_snapshot_is_copied_forward_with_its_hash(handler, lake, writes):
+    publish(handler, tenants(handler), '2024-03-01')
+    publish(handler, tenants(handler, order=[5, 4, 3, 2, 1, 0]), '2024-03-02')
+
+    assert writes == [handler.partition_key('tenants', '2024-03-01')]
+    first, second = (lake.head_object(Bucket=handler.S3_BUCKET, Key=handler.partition_key('tenants', d))
+                     for d in ('2024-03-01', '2024-03-02'))
+    digest = first['Metadata'][handler.CONTENT_HASH_KEY]
+    assert second['Metadata'][handler.CONTENT_HASH_KEY] == digest
+    assert second['ContentLength'] == first['ContentLength']
+    manifest = load_manifest(lake, handler.S3_BUCKET, 'tenants')
+    assert manifest['partitions']['dt=2024-03-02']['content_hash'] == digest
+
+
+def test_changed_snapshot_is_written_fresh(handler, lake, writes):
+    publish(handler, tenants(handler), '2024-03-01')
+    publish(handler, tenants(handler, mrr=599), '2024-03-02')
+
+    assert writes == [handler.partition_key('tenants', d) for d in ('2024-03-01', '2024-03-02')]
+    manifest = load_manifest(lake, handler.S3_BUCKET, 'tenants')['partitions']
+    assert manifest['dt=2024-03-02']['content_hash'] == content_hash(tenants(handler, mrr=599),
+                                                                     handler.TENANTS_LAYOUT)
+    assert manifest['dt=2024-03-02']['content_hash'] != manifest['dt=2024-03-01']['content_hash']
@@ -0,0 +1,122 @@
+"""SecretCache and ConnectionCache with a fake Secrets Manager and connection factory."""
+import pytest
+
+import warm_cache
+from fakes import FakeConnection, FakeSecrets
+from warm_cache import ConnectionCache, SecretCache
+
+SECRET_ID = 'qivr/production'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(warm_cache.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def secrets():
+    return FakeSecrets({SECRET_ID: {'host': 'db', 'username': 'etl', 'password': 'old'}})
+
+
+def test_secret_is_cached_until_its_ttl(secrets, clock):
+    cache = SecretCache(secrets, ttl=60)
+    assert cache.get(SECRET_ID)['password'] == 'old'
+    clock.now += 59
+    cache.get(SECRET_ID)
+    assert secrets.calls == 1
+
+    secrets.secrets[SECRET_ID] = {**secrets.secrets[SECRET_ID], 'password': 'new'}
+    clock.now += 1
+    assert cache.get(SECRET_ID)['password'] == 'new'
+    assert secrets.calls == 2
+    assert cache.stats() == {'hits': 1, 'misses': 2}
+
+
+def test_rotated_secret_is_refetched_when_cached_credentials_fail(secrets, clock):
+    cache = SecretCache(secrets, ttl=900)
+    accepted = {'password': 'old'}
+
+    def connect(creds):
+        if creds['password'] != accepted['password']:
+            raise PermissionError('password authentication failed')
+        return FakeConnection(creds=creds)
+
+    assert cache.connect(SECRET_ID, connect).creds['password'] == 'old'
+    # Rotated: the database takes only the new password, well within the TTL
+    secrets.secrets[SECRET_ID] = {**secrets.secrets[SECRET_ID], 'password': 'new'}
+    accepted['password'] = 'new'
+    assert cache.connect(SECRET_ID, connect).creds['password'] == 'new'
+    assert secrets.calls == 2
+    # The refreshed secret is the cached one from now on
+    cache.connect(SECRET_ID, connect)
+    assert secrets.calls == 2
+
+
+def test_fresh_secret_failing_is_not_retried(secrets, clock):
+    cache = SecretCache(secrets)
+    attempts = []
+
+    def connect(creds):
+        attempts.append(creds)
+        raise PermissionError('password authentication failed')
+
+    with pytest.raises(PermissionError):
+        cache.connect(SECRET_ID, connect)
+    assert len(attempts) == 1
+    assert secrets.calls == 1
+
+
+def test_idle_connection_is_reused():
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+    cache = ConnectionCache(connect, lambda conn: conn.run('SELECT 1'))
+    conn = cache.acquire()
+    cache.release(conn)
+    assert cache.acquire() is conn
+    assert len(opened) == 1
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_broken_connection_is_discarded():
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+    cache = ConnectionCache(connect, lambda conn: conn.run('SELECT 1'))
+
+    # Released as broken by the run that used it
+    conn = cache.acquire()
+    cache.release(conn, discard=True)
+    assert conn.closed
+    assert cache.acquire() is not conn
+
+    # Dropped by the server while idle: the ping fails and a new one is opened
+    idle = opened[-1]
+    cache.release(idle)
+    idle.close()
+    replacement = cache.acquire()
+    assert replacement is not idle
+    assert len(opened) == 3
+
+
+def test_only_max_idle_connections_are_kept():
+    cache = ConnectionCache(FakeConnection, lambda conn: None, max_idle=1)
+    first, second = cache.acquire(), cache.acquire()
+    cache.release(first)
+    cache.release(second)
+    assert not first.closed
+    assert second.closed
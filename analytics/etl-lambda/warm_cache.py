@@ -0,0 +1,129 @@
+"""
+Warm-start caches for the ETL Lambdas.
+Lambda reuses an execution environment across invocations, so state kept at
+module level survives until the container is recycled. The database secret
+is cached with a TTL and refetched early when the cached credentials stop
+working, which is how a Secrets Manager rotation shows up; idle connections
+are kept open and pinged before reuse.
+"""
+import json
+import os
+import threading
+import time
+
+SECRET_TTL_SECONDS = int(os.environ.get('SECRET_TTL_SECONDS', '900'))
+
+
+class SecretCache:
+    """JSON secrets from Secrets Manager, cached for ttl seconds."""
+
+    def __init__(self, client, ttl=SECRET_TTL_SECONDS):
+        self._client = client
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, secret_id, refresh=False):
+        """Return the parsed secret, fetching it on a miss, expiry or refresh."""
+        return self._get(secret_id, refresh)[0]
+
+    def _get(self, secret_id, refresh):
+        with self._lock:
+            entry = self._entries.get(secret_id)
+            if entry and not refresh and time.monotonic() - entry[0] < self._ttl:
+                self.hits += 1
+                return entry[1], False
+            self.misses += 1
+            resp = self._client.get_secret_value(SecretId=secret_id)
+            value = json.loads(resp['SecretString'])
+            self._entries[secret_id] = (time.monotonic(), value)
+            return value, True
+
+    def connect(self, secret_id, connect):
+        """Call connect(secret), refetching the secret once if cached credentials fail.
+
+        After a rotation the cached password is rejected until the TTL runs
+        out, so a failed connect with a cached secret retries with a fresh one.
+        """
+        creds, fetched = self._get(secret_id, False)
+        try:
+            return connect(creds)
+        except Exception:
+            if fetched:
+                raise
+            print(f"Connecting with cached secret {secret_id} failed; refreshing it")
+            return connect(self.get(secret_id, refresh=True))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class ConnectionCache:
+    """Idle connections kept across warm invocations.
+
+    acquire() hands out an idle connection once ping(conn) succeeds on it,
+    and opens a new one through connect() otherwise. release() returns it
+    for the next caller or invocation, keeping at most max_idle open.
+    """
+
+    def __init__(self, connect, ping, max_idle=1):
+        self._connect = connect
+        self._ping = ping
+        self._idle = []
+        self._lock = threading.Lock()
+        self.max_idle = max_idle
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                break
+            try:
+                self._ping(conn)
+            except Exception:
+                _close_quietly(conn)
+                continue
+            with self._lock:
+                self.hits += 1
+            return conn
+        conn = self._connect()
+        with self._lock:
+            self.misses += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """Keep conn for reuse, or close it if discarded or the cache is full."""
+        with self._lock:
+            if not discard and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        _close_quietly(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            _close_quietly(conn)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def stats_since(before, after):
+    """Per-invocation counts from two snapshots of {cache: stats()}."""
+    return {
+        name: {key: after[name][key] - before[name][key] for key in after[name]}
+        for name in after
+    }
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
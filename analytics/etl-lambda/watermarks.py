@@ -0,0 +1,65 @@
+"""
+High-water mark state for incremental ETL runs.
+A small JSON object in S3 records, per exported table, the database time up
+to which changes have been captured and the partition holding the merged
+result, so the next run only needs to extract rows changed since then.
+"""
+import json
+from datetime import datetime
+
+from coldstart import lazy_import
+
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+
+STATE_KEY = 'state/watermarks.json'
+
+
+def load_state(s3, bucket, key=STATE_KEY):
+    """Load the watermark state object, or an empty state on first run."""
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return {}
+    return json.loads(bytes(obj['Body'].read()))
+
+
+def save_state(s3, bucket, state, key=STATE_KEY):
+    """Persist the watermark state object."""
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(state, indent=2, sort_keys=True).encode('utf-8'),
+        ContentType='application/json',
+    )
+
+
+def get_high_water(entry):
+    """Return the recorded high-water mark of a table entry, if any."""
+    value = (entry or {}).get('high_water')
+    return datetime.fromisoformat(value) if value else None
+
+
+def merge_changes(previous, fresh, key_columns, changed_keys):
+    """Replace every row of previous whose key is in changed_keys with fresh.
+
+    Keys that changed but have no fresh rows (deleted or now suppressed)
+    simply drop out of the merged table.
+    """
+    if previous is None or previous.num_rows == 0:
+        return fresh
+    if not changed_keys:
+        return previous
+
+    previous = previous.select(fresh.schema.names).cast(fresh.schema)
+    changed = pa.array(['\x1f'.join(str(v) for v in key) for key in changed_keys])
+    unchanged = pc.invert(pc.is_in(_composite_key(previous, key_columns), value_set=changed))
+    return pa.concat_tables([previous.filter(unchanged), fresh])
+
+
+def _composite_key(table, key_columns):
+    """Join key columns into one string column for set membership tests."""
+    columns = [pc.cast(table.column(name), pa.string()) for name in key_columns]
+    if len(columns) == 1:
+        return columns[0]
+    return pc.binary_join_element_wise(*columns, '\x1f')
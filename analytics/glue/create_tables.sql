@@ -20,7 +20,7 @@ CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.tenants (
 PARTITIONED BY (dt STRING)
 STORED AS PARQUET
 LOCATION 's3://qivr-analytics-lake/curated/tenants/'
-TBLPROPERTIES ('parquet.compression'='SNAPPY');
+TBLPROPERTIES ('parquet.compression'='ZSTD');
 
 -- Usage table (daily metrics per tenant)
 CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.usage (
@@ -34,7 +34,7 @@ CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.usage (
 PARTITIONED BY (dt STRING)
 STORED AS PARQUET
 LOCATION 's3://qivr-analytics-lake/curated/usage/'
-TBLPROPERTIES ('parquet.compression'='SNAPPY');
+TBLPROPERTIES ('parquet.compression'='ZSTD');
 
 -- PROM outcomes (anonymized, k-anonymity enforced)
 CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.prom_outcomes (
@@ -49,9 +49,118 @@ CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.prom_outcomes (
 PARTITIONED BY (dt STRING)
 STORED AS PARQUET
 LOCATION 's3://qivr-analytics-lake/curated/prom_outcomes/'
-TBLPROPERTIES ('parquet.compression'='SNAPPY');
+TBLPROPERTIES ('parquet.compression'='ZSTD');
 
--- After creating tables, run this to discover partitions:
--- MSCK REPAIR TABLE qivr_analytics.tenants;
--- MSCK REPAIR TABLE qivr_analytics.usage;
--- MSCK REPAIR TABLE qivr_analytics.prom_outcomes;
+-- Compacted months: one file per table per month, written by compact.py.
+-- dt is a column here; each row group holds one day, so dt filters prune.
+CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.tenants_monthly (
+    id STRING,
+    name STRING,
+    slug STRING,
+    status STRING,
+    plan STRING,
+    region STRING,
+    created_at TIMESTAMP,
+    patient_count BIGINT,
+    staff_count BIGINT,
+    mrr BIGINT,
+    dt STRING
+)
+PARTITIONED BY (month STRING)
+STORED AS PARQUET
+LOCATION 's3://qivr-analytics-lake/compacted/tenants/';
+
+CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.usage_monthly (
+    tenant_id STRING,
+    date DATE,
+    appointments BIGINT,
+    completed_appointments BIGINT,
+    messages BIGINT,
+    documents BIGINT,
+    dt STRING
+)
+PARTITIONED BY (month STRING)
+STORED AS PARQUET
+LOCATION 's3://qivr-analytics-lake/compacted/usage/';
+
+CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.prom_outcomes_monthly (
+    region STRING,
+    prom_type STRING,
+    age_bracket STRING,
+    gender STRING,
+    avg_baseline DOUBLE,
+    avg_final DOUBLE,
+    patient_count BIGINT,
+    dt STRING
+)
+PARTITIONED BY (month STRING)
+STORED AS PARQUET
+LOCATION 's3://qivr-analytics-lake/compacted/prom_outcomes/';
+
+-- Full history: compacted months plus the daily partitions not yet compacted
+CREATE OR REPLACE VIEW qivr_analytics.tenants_history AS
+SELECT id, name, slug, status, plan, region, created_at, patient_count, staff_count, mrr, dt
+FROM qivr_analytics.tenants_monthly
+UNION ALL
+SELECT id, name, slug, status, plan, region, created_at, patient_count, staff_count, mrr, dt
+FROM qivr_analytics.tenants;
+
+CREATE OR REPLACE VIEW qivr_analytics.usage_history AS
+SELECT tenant_id, date, appointments, completed_appointments, messages, documents, dt
+FROM qivr_analytics.usage_monthly
+UNION ALL
+SELECT tenant_id, date, appointments, completed_appointments, messages, documents, dt
+FROM qivr_analytics.usage;
+
+CREATE OR REPLACE VIEW qivr_analytics.prom_outcomes_history AS
+SELECT region, prom_type, age_bracket, gender, avg_baseline, avg_final, patient_count, dt
+FROM qivr_analytics.prom_outcomes_monthly
+UNION ALL
+SELECT region, prom_type, age_bracket, gender, avg_baseline, avg_final, patient_count, dt
+FROM qivr_analytics.prom_outcomes;
+
+-- Monthly rollups, merged by the ETL one day at a time (etl-lambda/rollups.py).
+-- Each month is one file of a few kilobytes; dashboards read these, not the days.
+CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.usage_by_month (
+    tenant_id STRING,
+    appointments BIGINT,
+    completed_appointments BIGINT,
+    messages BIGINT,
+    documents BIGINT,
+    days BIGINT
+)
+PARTITIONED BY (month STRING)
+STORED AS PARQUET
+LOCATION 's3://qivr-analytics-lake/rollups/usage_by_month/';
+
+-- PROMs completed in the month; k-anonymity applied to the whole month
+CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.prom_outcomes_by_region (
+    region STRING,
+    prom_type STRING,
+    avg_baseline DOUBLE,
+    avg_final DOUBLE,
+    patient_count BIGINT
+)
+PARTITIONED BY (month STRING)
+STORED AS PARQUET
+LOCATION 's3://qivr-analytics-lake/rollups/prom_outcomes_by_region/';
+
+-- Plan totals from the month's latest tenants snapshot (as_of)
+CREATE EXTERNAL TABLE IF NOT EXISTS qivr_analytics.tenants_by_plan (
+    plan STRING,
+    tenants BIGINT,
+    patient_count BIGINT,
+    staff_count BIGINT,
+    mrr BIGINT,
+    as_of STRING
+)
+PARTITIONED BY (month STRING)
+STORED AS PARQUET
+LOCATION 's3://qivr-analytics-lake/rollups/tenants_by_plan/';
+
+-- Partitions are registered by the ETL as it writes them, and listed with row
+-- counts and sizes in s3://qivr-analytics-lake/manifests/<table>.json.
+-- After creating tables, register partitions that already exist (once):
+--   cd etl-lambda
+--   python catalog.py --tables tenants usage prom_outcomes tenants_monthly usage_monthly prom_outcomes_monthly \
+--     usage_by_month prom_outcomes_by_region tenants_by_plan
@@ -38,7 +38,9 @@ resource "aws_iam_role_policy" "etl_lambda_policy" {
         Action = [
           "s3:PutObject",
           "s3:GetObject",
-          "s3:ListBucket"
+          "s3:ListBucket",
+          "s3:AbortMultipartUpload",
+          "s3:DeleteObject"
         ]
         Resource = [
           "arn:aws:s3:::qivr-analytics-lake",
@@ -52,6 +54,26 @@ resource "aws_iam_role_policy" "etl_lambda_policy" {
         ]
         Resource = var.db_secret_arn
       },
+      {
+        # Exporters and compaction register partitions directly
+        Effect = "Allow"
+        Action = [
+          "glue:GetTable",
+          "glue:BatchCreatePartition",
+          "glue:BatchDeletePartition"
+        ]
+        Resource = [
+          "arn:aws:glue:ap-southeast-2:*:catalog",
+          "arn:aws:glue:ap-southeast-2:*:database/qivr_analytics",
+          "arn:aws:glue:ap-southeast-2:*:table/qivr_analytics/*"
+        ]
+      },
+      {
+        # Checkpointed runs hand their remaining work to a new invocation
+        Effect   = "Allow"
+        Action   = "lambda:InvokeFunction"
+        Resource = "arn:aws:lambda:ap-southeast-2:*:function:qivr-analytics-etl"
+      },
       {
         Effect = "Allow"
         Action = [
@@ -82,8 +104,9 @@ resource "aws_lambda_function" "etl" {
 
   environment {
     variables = {
-      S3_BUCKET     = "qivr-analytics-lake"
-      DB_SECRET_ARN = var.db_secret_arn
+      S3_BUCKET          = "qivr-analytics-lake"
+      DB_SECRET_ARN      = var.db_secret_arn
+      EXPORT_CONCURRENCY = "3"
     }
   }
 
@@ -113,12 +136,149 @@ resource "aws_lambda_permission" "allow_eventbridge" {
   source_arn    = aws_cloudwatch_event_rule.etl_schedule.arn
 }
 
+# Compaction - merges last month's daily partitions into one file per table
+resource "aws_lambda_function" "compact" {
+  filename         = "${path.module}/../etl-lambda/deployment.zip"
+  function_name    = "qivr-analytics-compact"
+  role             = aws_iam_role.etl_lambda_role.arn
+  handler          = "compact.compact_handler"
+  runtime          = "python3.11"
+  timeout          = 900
+  memory_size      = 512
+
+  vpc_config {
+    subnet_ids         = var.private_subnet_ids
+    security_group_ids = [var.lambda_security_group_id]
+  }
+
+  environment {
+    variables = {
+      S3_BUCKET     = "qivr-analytics-lake"
+      DB_SECRET_ARN = var.db_secret_arn
+    }
+  }
+
+  layers = [
+    "arn:aws:lambda:ap-southeast-2:336392948345:layer:AWSSDKPandas-Python311:17"
+  ]
+}
+
+# 4 AM UTC on the 2nd, once the 1st's export no longer depends on last month
+resource "aws_cloudwatch_event_rule" "compact_schedule" {
+  name                = "qivr-analytics-compact-schedule"
+  description         = "Compact the previous month of the analytics lake"
+  schedule_expression = "cron(0 4 2 * ? *)"
+}
+
+resource "aws_cloudwatch_event_target" "compact_target" {
+  rule      = aws_cloudwatch_event_rule.compact_schedule.name
+  target_id = "qivr-analytics-compact"
+  arn       = aws_lambda_function.compact.arn
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_compact" {
+  statement_id  = "AllowEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.compact.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.compact_schedule.arn
+}
+
+# Analytics read service - answers the admin portal's queries from a local
+# cache of lake partitions (etl-lambda/lake_query.py); read-only, no VPC
+resource "aws_iam_role" "query_lambda_role" {
+  name = "qivr-analytics-query-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [{
+      Action = "sts:AssumeRole"
+      Effect = "Allow"
+      Principal = {
+        Service = "lambda.amazonaws.com"
+      }
+    }]
+  })
+}
+
+resource "aws_iam_role_policy" "query_lambda_policy" {
+  name = "qivr-analytics-query-policy"
+  role = aws_iam_role.query_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject"
+        ]
+        Resource = [
+          "arn:aws:s3:::qivr-analytics-lake/curated/*",
+          "arn:aws:s3:::qivr-analytics-lake/compacted/*",
+          "arn:aws:s3:::qivr-analytics-lake/rollups/*",
+          "arn:aws:s3:::qivr-analytics-lake/manifests/*"
+        ]
+      },
+      {
+        # Without ListBucket a missing key (a table's manifest before its
+        # first publish) is a 403 rather than the 404 the cache expects
+        Effect   = "Allow"
+        Action   = "s3:ListBucket"
+        Resource = "arn:aws:s3:::qivr-analytics-lake"
+        Condition = {
+          StringLike = {
+            "s3:prefix" = ["curated/*", "compacted/*", "rollups/*", "manifests/*"]
+          }
+        }
+      }
+    ]
+  })
+}
+
+resource "aws_lambda_function" "query" {
+  filename         = "${path.module}/../etl-lambda/deployment.zip"
+  function_name    = "qivr-analytics-query"
+  role             = aws_iam_role.query_lambda_role.arn
+  handler          = "lake_query.query_handler"
+  runtime          = "python3.11"
+  timeout          = 30
+  memory_size      = 1024
+
+  # The partition cache lives in /tmp
+  ephemeral_storage {
+    size = 2048
+  }
+
+  environment {
+    variables = {
+      S3_BUCKET                 = "qivr-analytics-lake"
+      LAKE_CACHE_MAX_MB         = "1536"
+      LAKE_MANIFEST_TTL_SECONDS = "60"
+    }
+  }
+
+  layers = [
+    "arn:aws:lambda:ap-southeast-2:336392948345:layer:AWSSDKPandas-Python311:17"
+  ]
+}
+
 # Glue database
 resource "aws_glue_catalog_database" "analytics" {
   name = "qivr_analytics"
 }
 
-# Glue crawler to auto-discover partitions
+# Glue crawler for schema changes only; partitions are registered by the ETL
+# itself (see etl-lambda/catalog.py), so it no longer runs on a schedule
 resource "aws_glue_crawler" "analytics" {
   name          = "qivr-analytics-crawler"
   role          = aws_iam_role.glue_crawler_role.arn
@@ -128,8 +288,6 @@ resource "aws_glue_crawler" "analytics" {
     path = "s3://qivr-analytics-lake/curated/"
   }
 
-  schedule = "cron(30 2 * * ? *)"  # Run 30 min after ETL
-
   schema_change_policy {
     delete_behavior = "LOG"
     update_behavior = "UPDATE_IN_DATABASE"
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Bulk-provision Cognito users from a CSV or JSONL file
+
+For each user: look them up (AdminGetUser), create them if missing
+(AdminCreateUser), set their password if one is given (AdminSetUserPassword,
+falling back to temporary-then-permanent as set-clinic-password.py does) and
+add them to their groups (AdminAddUserToGroup). Users are provisioned
+concurrently, and every call first takes a token from its Cognito quota
+category's bucket, so the tool stays under the pool's requests-per-second
+quotas however many workers run; calls throttled anyway are retried with
+exponential backoff.
+
+Each finished user is appended to a JSONL results log (never with its
+password). Running again with the same log skips users already provisioned,
+so an interrupted or partly failed run is simply re-run.
+
+Input columns (CSV header or JSONL keys):
+  email      required, used as the username
+  password   optional; without one Cognito emails an invitation
+  groups     optional, ';'-separated in CSV or a list in JSONL
+  anything else is a user attribute, e.g. given_name, custom:tenant_id
+
+Usage:
+  python3 provision-cognito-users.py staff.csv --user-pool-id ap-southeast-2_jbutB4tj1
+  python3 provision-cognito-users.py users.jsonl --user-pool-id ... --workers 16 --log users.results.jsonl
+  # Against moto (moto_server -p 5000)
+  python3 provision-cognito-users.py users.csv --user-pool-id ... --endpoint-url http://localhost:5000
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Configuration
+REGION = os.environ.get('AWS_REGION', 'ap-southeast-2')
+USER_POOL_ID = os.environ.get('COGNITO_USER_POOL_ID')
+WORKERS = 8
+
+# Cognito's default requests-per-second quota per category, and the category of
+# each call made here. Raise them with --rate if the pool's quotas were increased.
+RATE_LIMITS = {
+    'UserRead': 120,
+    'UserCreation': 50,
+    'UserUpdate': 25,
+}
+OPERATION_CATEGORIES = {
+    'admin_get_user': 'UserRead',
+    'admin_create_user': 'UserCreation',
+    'admin_set_user_password': 'UserUpdate',
+    'admin_add_user_to_group': 'UserUpdate',
+}
+
+# Throttled calls are retried up to this many times, backing off exponentially
+MAX_RETRIES = 8
+BACKOFF_BASE_SECONDS = 0.2
+BACKOFF_MAX_SECONDS = 10.0
+THROTTLING_ERRORS = ('TooManyRequestsException', 'ThrottlingException', 'LimitExceededException')
+
+COMPLETED = ('created', 'updated')
+
+
+class TokenBucket:
+    """Allows rate calls per second on average, in bursts of at most burst."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedCognito:
+    """Calls the Cognito admin API through per-category token buckets, retrying throttles."""
+
+    def __init__(self, client, rates=RATE_LIMITS, max_retries=MAX_RETRIES):
+        self.client = client
+        self.buckets = {category: TokenBucket(rate) for category, rate in rates.items()}
+        self.max_retries = max_retries
+        self.calls = Counter()
+        self.throttles = Counter()
+        self._lock = threading.Lock()
+
+    def call(self, operation, **params):
+        bucket = self.buckets[OPERATION_CATEGORIES[operation]]
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            with self._lock:
+                self.calls[operation] += 1
+            try:
+                return getattr(self.client, operation)(**params)
+            except ClientError as e:
+                if error_code(e) not in THROTTLING_ERRORS or attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.throttles[operation] += 1
+                # Full jitter, so throttled workers do not retry in lockstep
+                time.sleep(random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)))
+
+
+def error_code(error):
+    return error.response.get('Error', {}).get('Code')
+
+
+def read_users(path):
+    """User dicts from a CSV or JSONL file, with groups as a list."""
+    with open(path, newline='') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            users = [json.loads(line) for line in f if line.strip()]
+        else:
+            users = list(csv.DictReader(f))
+    for number, user in enumerate(users, 1):
+        if not user.get('email'):
+            raise ValueError(f"{path}: user {number} has no email")
+        user['email'] = user['email'].strip().lower()
+        groups = user.get('groups') or []
+        if isinstance(groups, str):
+            groups = [g.strip() for g in groups.split(';') if g.strip()]
+        user['groups'] = groups
+    duplicates = [email for email, n in Counter(u['email'] for u in users).items() if n > 1]
+    if duplicates:
+        raise ValueError(f"{path}: duplicate emails: {', '.join(duplicates[:5])}")
+    return users
+
+
+def user_attributes(user):
+    """Cognito attributes of a user: every column but email, password and groups, plus the email."""
+    attributes = [{'Name': 'email', 'Value': user['email']}, {'Name': 'email_verified', 'Value': 'true'}]
+    for name, value in user.items():
+        # None is where csv puts a row's values beyond the header
+        if name not in (None, 'email', 'password', 'groups') and value not in (None, ''):
+            attributes.append({'Name': name, 'Value': str(value)})
+    return attributes
+
+
+def load_results(path):
+    """Usernames the results log records as provisioned."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                if result['status'] in COMPLETED:
+                    done.add(result['username'])
+                else:
+                    done.discard(result['username'])
+    return done
+
+
+def set_password(cognito, pool_id, username, password):
+    """Set a permanent password, via a temporary one if Cognito rejects that first."""
+    try:
+        cognito.call('admin_set_user_password', UserPoolId=pool_id, Username=username,
+                     Password=password, Permanent=True)
+    except ClientError as e:
+        if error_code(e) in THROTTLING_ERRORS or error_code(e) == 'InvalidPasswordException':
+            raise
+        cognito.call('admin_set_user_password', UserPoolId=pool_id, Username=username,
+                     Password=password, Permanent=False)
+        cognito.call('admin_set_user_password', UserPoolId=pool_id, Username=username,
+                     Password=password, Permanent=True)
+
+
+def provision_user(cognito, pool_id, user, suppress_invites=False):
+    """Create or update one user; the result recorded in the log."""
+    username = user['email']
+    password = user.get('password')
+    status = 'updated'
+    try:
+        response = cognito.call('admin_get_user', UserPoolId=pool_id, Username=username)
+    except ClientError as e:
+        if error_code(e) != 'UserNotFoundException':
+            raise
+        params = {'UserPoolId': pool_id, 'Username': username, 'UserAttributes': user_attributes(user),
+                  'DesiredDeliveryMediums': ['EMAIL']}
+        # With a password to set there is nothing to invite the user with
+        if password or suppress_invites:
+            params['MessageAction'] = 'SUPPRESS'
+        try:
+            response = cognito.call('admin_create_user', **params)['User']
+            status = 'created'
+        except ClientError as e:
+            # Created by someone else since we looked
+            if error_code(e) != 'UsernameExistsException':
+                raise
+            response = cognito.call('admin_get_user', UserPoolId=pool_id, Username=username)
+
+    if password:
+        set_password(cognito, pool_id, username, password)
+    for group in user['groups']:
+        cognito.call('admin_add_user_to_group', UserPoolId=pool_id, Username=username, GroupName=group)
+
+    attributes = response.get('Attributes') or response.get('UserAttributes') or []
+    sub = next((a['Value'] for a in attributes if a['Name'] == 'sub'), None)
+    return {'username': username, 'status': status, 'sub': sub}
+
+
+def provision(cognito, pool_id, users, log_path, workers=WORKERS, suppress_invites=False, progress_every=10.0):
+    """Provision users concurrently, appending each result to the log; a Counter of statuses."""
+    statuses = Counter()
+    log_lock = threading.Lock()
+    started = last_report = time.monotonic()
+
+    def run(user):
+        try:
+            result = provision_user(cognito, pool_id, user, suppress_invites)
+        except ClientError as e:
+            result = {'username': user['email'], 'status': 'failed', 'error': f"{error_code(e)}: {e}"}
+        except Exception as e:
+            result = {'username': user['email'], 'status': 'failed', 'error': str(e)}
+        result['at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        with log_lock:
+            log.write(json.dumps(result) + '\n')
+            log.flush()
+        return result
+
+    with open(log_path, 'a') as log, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, user) for user in users]
+        for future in as_completed(futures):
+            result = future.result()
+            statuses[result['status']] += 1
+            if result['status'] == 'failed':
+                print(f"❌ {result['username']}: {result['error']}")
+            now = time.monotonic()
+            if now - last_report >= progress_every:
+                done = sum(statuses.values())
+                print(f"  {done}/{len(users)} users, {done / (now - started):.1f} users/s")
+                last_report = now
+    return statuses
+
+
+def parse_rates(values):
+    rates = dict(RATE_LIMITS)
+    for value in values:
+        category, _, rate = value.partition('=')
+        if category not in rates:
+            raise SystemExit(f"Unknown quota category {category!r}; expected one of {', '.join(rates)}")
+        rates[category] = float(rate)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-provision Cognito users from a CSV or JSONL file')
+    parser.add_argument('users', help='CSV or JSONL (.jsonl) file of users')
+    parser.add_argument('--user-pool-id', default=USER_POOL_ID, required=USER_POOL_ID is None)
+    parser.add_argument('--region', default=REGION)
+    parser.add_argument('--endpoint-url', help='Cognito endpoint, e.g. a moto server')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--rate', action='append', default=[], metavar='CATEGORY=RPS',
+                        help=f"Override a quota category's rate ({', '.join(RATE_LIMITS)})")
+    parser.add_argument('--log', help='Results log (default: <users file>.results.jsonl)')
+    parser.add_argument('--suppress-invites', action='store_true',
+                        help='Do not email new users without a password an invitation')
+    args = parser.parse_args()
+
+    try:
+        users = read_users(args.users)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+    log_path = args.log or f"{os.path.splitext(args.users)[0]}.results.jsonl"
+    done = load_results(log_path)
+    pending = [user for user in users if user['email'] not in done]
+
+    print(f"User Pool: {args.user_pool_id}")
+    print(f"Region: {args.region}")
+    print(f"Users: {len(users)} ({len(users) - len(pending)} already provisioned in {log_path})")
+    print()
+    if not pending:
+        return 0
+
+    # Throttles are retried here, after the token bucket, rather than by botocore
+    client = boto3.client('cognito-idp', region_name=args.region, endpoint_url=args.endpoint_url,
+                          config=Config(retries={'mode': 'standard', 'max_attempts': 1},
+                                        max_pool_connections=args.workers))
+    cognito = RateLimitedCognito(client, parse_rates(args.rate))
+    started = time.monotonic()
+    statuses = provision(cognito, args.user_pool_id, pending, log_path, args.workers, args.suppress_invites)
+    seconds = time.monotonic() - started
+
+    print()
+    print(f"✅ {statuses['created']} created, {statuses['updated']} updated, {statuses['failed']} failed "
+          f"in {seconds:.1f}s ({len(pending) / seconds:.1f} users/s)")
+    print(f"   Calls: {dict(cognito.calls)}")
+    if cognito.throttles:
+        print(f"   Throttled and retried: {dict(cognito.throttles)}")
+    if statuses['failed']:
+        print(f"   Re-run the same command to retry the failed users (results in {log_path})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""database/provision-cognito-users.py against moto's Cognito."""
+import importlib.util
+import json
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database',
+                      'provision-cognito-users.py')
+REGION = 'ap-southeast-2'
+PASSWORD = 'Str0ng!Passw0rd'
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('provision_cognito_users', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+provision = load_script()
+
+
+@pytest.fixture
+def cognito(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', REGION)
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    with mock_aws():
+        client = boto3.client('cognito-idp', region_name=REGION)
+        pool_id = client.create_user_pool(PoolName='qivr')['UserPool']['Id']
+        for group in ('Clinician', 'Admin'):
+            client.create_group(GroupName=group, UserPoolId=pool_id)
+        yield client, pool_id
+
+
+def run(monkeypatch, users_path, pool_id, *args):
+    monkeypatch.setattr(sys, 'argv', ['provision-cognito-users.py', str(users_path), '--user-pool-id', pool_id,
+                                      '--region', REGION, *args])
+    return provision.main()
+
+
+def groups_of(client, pool_id, username):
+    response = client.admin_list_groups_for_user(UserPoolId=pool_id, Username=username)
+    return sorted(group['GroupName'] for group in response['Groups'])
+
+
+def attributes_of(client, pool_id, username):
+    response = client.admin_get_user(UserPoolId=pool_id, Username=username)
+    return {a['Name']: a['Value'] for a in response['UserAttributes']}
+
+
+def results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_csv_users_are_created(cognito, monkeypatch, tmp_path):
+    client, pool_id = cognito
+    users = tmp_path / 'staff.csv'
+    users.write_text('email,password,groups,given_name\n'
+                     f'Dr.Smith@Clinic.test,{PASSWORD},Clinician;Admin,Jane\n'
+                     'nurse@clinic.test,,Clinician,\n')
+    assert run(monkeypatch, users, pool_id) == 0
+
+    assert groups_of(client, pool_id, 'dr.smith@clinic.test') == ['Admin', 'Clinician']
+    assert attributes_of(client, pool_id, 'dr.smith@clinic.test')['given_name'] == 'Jane'
+    assert groups_of(client, pool_id, 'nurse@clinic.test') == ['Clinician']
+    logged = results(tmp_path / 'staff.results.jsonl')
+    assert sorted((r['username'], r['status']) for r in logged) == [
+        ('dr.smith@clinic.test', 'created'), ('nurse@clinic.test', 'created')]
+    # Passwords never reach the log
+    assert PASSWORD not in (tmp_path / 'staff.results.jsonl').read_text()
+
+
+def test_jsonl_users_are_created(cognito, monkeypatch, tmp_path):
+    client, pool_id = cognito
+    users = tmp_path / 'users.jsonl'
+    users.write_text(json.dumps({'email': 'admin@clinic.test', 'groups': ['Admin'], 'family_name': 'Lee'}) + '\n\n')
+    log = tmp_path / 'custom.log.jsonl'
+    assert run(monkeypatch, users, pool_id, '--log', str(log), '--suppress-invites') == 0
+
+    assert groups_of(client, pool_id, 'admin@clinic.test') == ['Admin']
+    assert attributes_of(client, pool_id, 'admin@clinic.test')['family_name'] == 'Lee'
+    assert [r['status'] for r in results(log)] == ['created']
+
+
+def test_existing_users_are_updated_not_created(cognito, tmp_path):
+    client, pool_id = cognito
+    client.admin_create_user(UserPoolId=pool_id, Username='existing@clinic.test', MessageAction='SUPPRESS')
+    users = [{'email': 'existing@clinic.test', 'groups': ['Clinician']}]
+
+    limited = provision.RateLimitedCognito(client)
+    statuses = provision.provision(limited, pool_id, users, str(tmp_path / 'log.jsonl'), workers=2)
+    assert statuses == {'updated': 1}
+    assert 'admin_create_user' not in limited.calls
+    assert groups_of(client, pool_id, 'existing@clinic.test') == ['Clinician']
+
+
+def test_a_rerun_resumes_from_the_results_log(cognito, monkeypatch, tmp_path):
+    client, pool_id = cognito
+    users = tmp_path / 'staff.csv'
+    users.write_text('email,groups\none@clinic.test,Clinician\ntwo@clinic.test,Clinician\n')
+    log = tmp_path / 'staff.results.jsonl'
+    # An earlier run provisioned one user and failed the other
+    log.write_text(json.dumps({'username': 'one@clinic.test', 'status': 'created'}) + '\n'
+                   + json.dumps({'username': 'two@clinic.test', 'status': 'failed', 'error': 'throttled'}) + '\n')
+    client.admin_create_user(UserPoolId=pool_id, Username='one@clinic.test', MessageAction='SUPPRESS')
+
+    assert run(monkeypatch, users, pool_id) == 0
+    logged = results(log)
+    assert [(r['username'], r['status']) for r in logged[2:]] == [('two@clinic.test', 'created')]
+    # one@ was skipped, so nothing added it to its group
+    assert groups_of(client, pool_id, 'one@clinic.test') == []
+    assert groups_of(client, pool_id, 'two@clinic.test') == ['Clinician']
+
+    # Everything is provisioned now: a third run makes no calls at all
+    monkeypatch.setattr(provision.boto3, 'client', lambda *args, **kwargs: pytest.fail('no client expected'))
+    assert run(monkeypatch, users, pool_id) == 0
+    assert len(results(log)) == 3